@@ -0,0 +1,5 @@
+from .formats import SOURCE_EXTENSIONS, detect_file_type
+from .images import convert_image, convert_image_multi
+from .documents import convert_txt_to_docx, convert_docx_to_txt, convert_html_to_txt, convert_html_to_docx
+from .video import find_ffmpeg_cached, process_video_conversion
+from .conversion import CONVERSIONS, MULTI_TARGET_OPTIONS, conversion_options, convert, convert_input
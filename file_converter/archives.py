@@ -0,0 +1,85 @@
+import os
+import zipfile
+
+from .config import config
+from .formats import SOURCE_EXTENSIONS
+
+ARCHIVE_MAX_MEMBERS = 500
+ARCHIVE_MAX_TOTAL_MB = 1024
+
+ARCHIVE_STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.mp4', '.mp3', '.flac', '.docx', '.zip')
+
+def archive_members(archive, options):
+    extensions = tuple(SOURCE_EXTENSIONS.get(options['source'], []))
+    members = []
+    skipped = []
+    for member in archive.infolist():
+        base_name = os.path.basename(member.filename.rstrip('/'))
+        if member.is_dir() or member.filename.startswith('__MACOSX/') or base_name.startswith('.'):
+            continue
+        if extensions and not base_name.lower().endswith(extensions):
+            skipped.append(f"{member.filename}: неподдерживаемый формат")
+        elif member.file_size > options['max_size']:
+            skipped.append(f"{member.filename}: файл слишком большой")
+        else:
+            members.append(member)
+    
+    max_members = config.get('archive_max_members', ARCHIVE_MAX_MEMBERS)
+    if len(members) > max_members:
+        raise Exception(f"В архиве слишком много файлов: {len(members)}. Максимум: {max_members}")
+    
+    total_size = sum(member.file_size for member in members)
+    if total_size > config.get('archive_max_total_mb', ARCHIVE_MAX_TOTAL_MB) * 1024 * 1024:
+        raise Exception(f"Распакованное содержимое архива слишком большое: {total_size // (1024 * 1024)} МБ")
+    return members, skipped
+
+def read_archive_member(archive, member, max_size):
+    with archive.open(member) as f:
+        data = f.read(max_size + 1)
+    if len(data) > max_size:
+        raise Exception("файл слишком большой")
+    return data
+
+class ArchiveWriter:
+    def __init__(self, output_dir, base_name, part_size):
+        self.output_dir = output_dir
+        self.base_name = base_name
+        self.part_size = part_size
+        self.parts = []
+        self.names = set()
+        self.archive = None
+        self.entries = 0
+    
+    def open_part(self):
+        suffix = f"_part{len(self.parts) + 1}" if self.parts else ""
+        path = os.path.join(self.output_dir, f"{self.base_name}_converted{suffix}.zip")
+        self.archive = zipfile.ZipFile(path, 'w')
+        self.parts.append(path)
+        self.entries = 0
+    
+    def unique_name(self, name):
+        candidate = name
+        number = 1
+        while candidate in self.names:
+            number += 1
+            root, ext = os.path.splitext(name)
+            candidate = f"{root}_{number}{ext}"
+        self.names.add(candidate)
+        return candidate
+    
+    def add(self, name, data):
+        if self.archive and self.entries and self.archive.fp.tell() + len(data) > self.part_size:
+            self.archive.close()
+            self.archive = None
+        if not self.archive:
+            self.open_part()
+        
+        compress_type = zipfile.ZIP_STORED if name.lower().endswith(ARCHIVE_STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+        self.archive.writestr(self.unique_name(name), data, compress_type=compress_type)
+        self.entries += 1
+    
+    def close(self):
+        if self.archive:
+            self.archive.close()
+            self.archive = None
+        return self.parts
@@ -0,0 +1,227 @@
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .resources import cpu_budget
+from .formats import SOURCE_EXTENSIONS
+from .conversion import CONVERSIONS, conversion_options, convert
+
+STATE_FILE = ".convert_state.jsonl"
+
+worker_loop = None
+
+def init_worker(cores):
+    global worker_loop
+    worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(worker_loop)
+    cpu_budget.limit_cores(cores)
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.part"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def output_stem(path, relative_dir):
+    return os.path.normcase(relative_dir), os.path.splitext(os.path.basename(path))[0].lower()
+
+def output_name(path, filename, keep_extension):
+    root, ext = os.path.splitext(os.path.basename(path))
+    if keep_extension and ext and filename.startswith(root):
+        return f"{root}_{ext.lstrip('.')}{filename[len(root):]}"
+    return filename
+
+def convert_path(path, output_dir, conv_type, targets, target_size, keep_extension=False):
+    started = time.perf_counter()
+    converted_files = worker_loop.run_until_complete(
+        convert(conv_type, input_path=path, targets=targets, target_size=target_size, as_file=True)
+    )
+    outputs = []
+    output_bytes = 0
+    for converted_file in converted_files:
+        output_path = os.path.join(output_dir, output_name(path, converted_file['filename'], keep_extension))
+        write_atomic(output_path, converted_file['bytes'])
+        outputs.append(output_path)
+        output_bytes += len(converted_file['bytes'])
+    return outputs, output_bytes, time.perf_counter() - started
+
+def collect_inputs(patterns, source):
+    extensions = tuple(SOURCE_EXTENSIONS.get(source, []))
+    inputs = []
+    seen = set()
+    
+    def add(path, anchor):
+        path = os.path.abspath(path)
+        if path not in seen:
+            seen.add(path)
+            inputs.append((path, os.path.abspath(anchor)))
+    
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(extensions):
+                        add(os.path.join(root, name), pattern)
+        elif os.path.isfile(pattern):
+            add(pattern, os.path.dirname(pattern) or '.')
+        else:
+            matches = sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+            if not matches:
+                print(f"⚠️ Нет файлов по шаблону {pattern}", file=sys.stderr)
+            for path in matches:
+                add(path, os.path.dirname(path) or '.')
+    
+    anchors = {anchor for path, anchor in inputs}
+    try:
+        base = anchors.pop() if len(anchors) == 1 else os.path.commonpath(anchors)
+    except ValueError:
+        base = None
+    return [
+        (path, os.path.relpath(os.path.dirname(path), base) if base else os.path.splitdrive(os.path.dirname(path))[1].lstrip(os.sep))
+        for path, anchor in inputs
+    ]
+
+def state_key(path, options):
+    stat = os.stat(path)
+    return json.dumps([path, stat.st_size, stat.st_mtime_ns, options['type'], options['targets'], options['target_size']])
+
+def load_state(state_path):
+    done = {}
+    if not os.path.exists(state_path):
+        return done
+    with open(state_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if all(os.path.exists(output) for output in entry['outputs']):
+                done[entry['key']] = entry
+    return done
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m file_converter',
+        description='Пакетная конвертация файлов теми же конвертерами, что использует бот'
+    )
+    parser.add_argument('conv_type', choices=sorted(CONVERSIONS), help='тип конвертации, например jpg_to_png')
+    parser.add_argument('inputs', nargs='+', help='файлы, каталоги (обходятся рекурсивно) или glob-шаблоны')
+    parser.add_argument('-o', '--output', default='converted', help='каталог для результатов')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='число параллельных процессов')
+    parser.add_argument('--targets', help='несколько форматов через запятую, например png,webp')
+    parser.add_argument('--target-size', type=float, help='целевой размер результата в МБ')
+    parser.add_argument('--no-resume', action='store_true', help='конвертировать заново уже обработанные файлы')
+    parser.add_argument('-v', '--verbose', action='store_true', help='подробный лог конвертеров')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO if args.verbose else logging.WARNING
+    )
+    
+    targets = [target.strip() for target in args.targets.split(',') if target.strip()] if args.targets else None
+    target_size = int(args.target_size * 1024 * 1024) if args.target_size else None
+    try:
+        options = conversion_options(args.conv_type, targets, target_size, as_file=True)
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    
+    inputs = collect_inputs(args.inputs, options['source'])
+    if not inputs:
+        print("❌ Не найдено файлов для конвертации", file=sys.stderr)
+        return 1
+    
+    output_root = os.path.abspath(args.output)
+    os.makedirs(output_root, exist_ok=True)
+    state_path = os.path.join(output_root, STATE_FILE)
+    done = {} if args.no_resume else load_state(state_path)
+    
+    stems = {}
+    for path, relative_dir in inputs:
+        stem = output_stem(path, relative_dir)
+        stems[stem] = stems.get(stem, 0) + 1
+    
+    pending = []
+    skipped = 0
+    for path, relative_dir in inputs:
+        key = state_key(path, options)
+        if key in done:
+            skipped += 1
+            continue
+        pending.append((path, os.path.normpath(os.path.join(output_root, relative_dir)), key, stems[output_stem(path, relative_dir)] > 1))
+    
+    jobs = max(1, min(args.jobs, len(pending) or 1))
+    cores = max(1, len(cpu_budget.cores) // jobs)
+    print(f"Файлов: {len(inputs)}, уже сконвертировано: {skipped}, процессов: {jobs}, ядер на процесс: {cores}")
+    
+    succeeded = 0
+    failed = 0
+    input_bytes = 0
+    output_bytes = 0
+    started = time.perf_counter()
+    
+    def finish(path, key, future_result, error):
+        nonlocal succeeded, failed, input_bytes, output_bytes
+        if error is not None:
+            failed += 1
+            print(f"❌ {path}: {error}")
+            return
+        outputs, size, elapsed = future_result
+        succeeded += 1
+        input_bytes += os.path.getsize(path)
+        output_bytes += size
+        print(f"✅ {path} → {', '.join(os.path.relpath(output, output_root) for output in outputs)} ({elapsed:.2f} сек)")
+        with open(state_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'key': key, 'source': path, 'outputs': outputs}, ensure_ascii=False) + '\n')
+    
+    try:
+        if jobs == 1:
+            init_worker(cores)
+            for path, output_dir, key, keep_extension in pending:
+                try:
+                    result = convert_path(path, output_dir, args.conv_type, targets, target_size, keep_extension)
+                except Exception as e:
+                    finish(path, key, None, e)
+                else:
+                    finish(path, key, result, None)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(cores,)) as executor:
+                futures = {
+                    executor.submit(convert_path, path, output_dir, args.conv_type, targets, target_size, keep_extension): (path, key)
+                    for path, output_dir, key, keep_extension in pending
+                }
+                try:
+                    for future in as_completed(futures):
+                        path, key = futures[future]
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            finish(path, key, None, e)
+                        else:
+                            finish(path, key, result, None)
+                except KeyboardInterrupt:
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise
+    except KeyboardInterrupt:
+        print("⏹ Прервано, при следующем запуске конвертация продолжится с необработанных файлов")
+        return 130
+    
+    elapsed = time.perf_counter() - started
+    print(
+        f"\nГотово: успешно {succeeded}, ошибок {failed}, пропущено {skipped}\n"
+        f"Вход {input_bytes / (1024 * 1024):.1f} МБ, результат {output_bytes / (1024 * 1024):.1f} МБ, время {elapsed:.2f} сек\n"
+        f"Пропускная способность: {succeeded / elapsed if elapsed else 0:.2f} файл/с, "
+        f"{input_bytes / (1024 * 1024) / elapsed if elapsed else 0:.2f} МБ/с"
+    )
+    return 1 if failed else 0
@@ -0,0 +1,12 @@
+import os
+import json
+
+config_file = "bot_config.json"
+
+def load_config():
+    if os.path.exists(config_file):
+        with open(config_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+config = load_config()
@@ -0,0 +1,226 @@
+import os
+import logging
+
+from .config import config
+from .tracing import trace_span
+from .resources import cpu_budget, quality_policy
+from .formats import detect_file_type, read_file_header
+from .images import convert_image, convert_image_multi
+from .documents import convert_docx_to_txt, convert_html_to_docx, convert_html_to_txt, convert_txt_to_docx
+from .video import process_video_conversion
+
+logger = logging.getLogger(__name__)
+
+CONVERSIONS = {
+    'jpg_to_png': ('jpg', 'png'),
+    'jpg_to_webp': ('jpg', 'webp'),
+    'jpg_to_GIF': ('jpg', 'GIF'),
+    'png_to_jpg': ('png', 'jpg'),
+    'png_to_webp': ('png', 'webp'),
+    'png_to_GIF': ('png', 'GIF'),
+    'webp_to_jpg': ('webp', 'jpg'),
+    'webp_to_png': ('webp', 'png'),
+    'webp_to_GIF': ('webp', 'GIF'),
+    'GIF_to_jpg': ('GIF', 'jpg'),
+    'GIF_to_png': ('GIF', 'png'),
+    'GIF_to_webp': ('GIF', 'webp'),
+    'txt_to_docx': ('txt', 'docx'),
+    'docx_to_txt': ('docx', 'txt'),
+    'html_to_txt': ('html', 'txt'),
+    'html_to_docx': ('html', 'docx'),
+    'GIF_to_mp4': ('GIF', 'mp4'),
+    'mp4_to_GIF': ('video', 'GIF'),
+    'video_to_mp3': ('video', 'mp3'),
+    'video_to_wav': ('video', 'wav'),
+    'video_to_flac': ('video', 'flac')
+}
+
+MULTI_TARGET_OPTIONS = {
+    'jpg': ['png', 'webp', 'GIF'],
+    'png': ['jpg', 'webp', 'GIF'],
+    'webp': ['jpg', 'png', 'GIF'],
+    'GIF': ['jpg', 'png', 'webp'],
+    'video': ['mp3', 'wav', 'flac']
+}
+
+PHOTO_DELIVERY_MAX_SIDE = 1280
+
+def supports_target_size(conv_type):
+    if conv_type == 'GIF_to_mp4':
+        return True
+    source, _, target = conv_type.partition('_to_')
+    image_formats = ['jpg', 'png', 'webp', 'GIF']
+    return source in image_formats and target in image_formats
+
+def supports_send_as_file(conv_type):
+    source, _, target = conv_type.partition('_to_')
+    image_formats = ['jpg', 'png', 'webp', 'GIF']
+    return source in image_formats and target in image_formats
+
+def photo_delivery_side(options):
+    if options.get('as_file') or options.get('target_size') or not supports_send_as_file(options['type']):
+        return None
+    return config.get('photo_delivery_max_side', PHOTO_DELIVERY_MAX_SIDE)
+
+async def convert_input(options, file_bytes, original_name, progress=None, local_path=None, output_dir=None):
+    source_ext = options['source']
+    target_ext = options['target']
+    conv_type = options['type']
+    
+    converted_files = []
+    
+    with trace_span('detect_file_type'):
+        detected_type = detect_file_type(bytes(file_bytes), original_name)
+    logger.info(f"Файл {original_name}: ожидаемый тип {source_ext}, определен как {detected_type}")
+    
+    if source_ext in ['jpg', 'jpeg', 'png', 'webp', 'GIF'] and conv_type != 'GIF_to_mp4':
+        if source_ext == 'GIF' and detected_type != 'GIF':
+            raise Exception(f"Файл {original_name} не является GIF.")
+        elif source_ext == 'jpg' and detected_type not in ['jpg', 'jpeg']:
+            raise Exception(f"Файл {original_name} не является JPG/JPEG.")
+        elif source_ext == 'png' and detected_type != 'png':
+            raise Exception(f"Файл {original_name} не является PNG.")
+        elif source_ext == 'webp' and detected_type != 'webp':
+            raise Exception(f"Файл {original_name} не является WebP.")
+        
+        targets = options.get('targets') or [target_ext]
+        quality = quality_policy.select(conv_type, not options.get('target_size'))
+        max_side = photo_delivery_side(options)
+        if len(targets) > 1:
+            converted_images = await convert_image_multi(bytes(file_bytes), source_ext, targets, options.get('target_size'), quality, max_side)
+        else:
+            converted_images = {
+                target_ext: await convert_image(bytes(file_bytes), source_ext, target_ext, options.get('target_size'), quality, max_side)
+            }
+        
+        if '.' in original_name:
+            name_without_ext = original_name.rsplit('.', 1)[0]
+        else:
+            name_without_ext = original_name
+        
+        mime_types = {
+            'jpg': 'image/jpeg',
+            'png': 'image/png',
+            'webp': 'image/webp',
+            'GIF': 'image/gif'
+        }
+        
+        for image_target, converted_bytes in converted_images.items():
+            converted_files.append({
+                'bytes': converted_bytes,
+                'filename': f"{name_without_ext}_converted.{image_target}",
+                'mime_type': mime_types.get(image_target, f'image/{image_target}'),
+                'as_document': bool(options.get('target_size') or options.get('as_file'))
+            })
+    
+    elif conv_type == 'txt_to_docx':
+        if detected_type != 'txt':
+            raise Exception(f"Файл {original_name} не является текстовым файлом.")
+        
+        txt_content = bytes(file_bytes).decode('utf-8', errors='ignore')
+        converted_bytes = await convert_txt_to_docx(txt_content)
+        
+        new_filename = f"{original_name.rsplit('.', 1)[0]}_converted.docx"
+        
+        converted_files.append({
+            'bytes': converted_bytes,
+            'filename': new_filename,
+            'mime_type': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        })
+    
+    elif conv_type == 'docx_to_txt':
+        if detected_type not in ['docx', 'doc']:
+            raise Exception(f"Файл {original_name} не является Word документом.")
+        
+        converted_bytes = await convert_docx_to_txt(bytes(file_bytes))
+        
+        new_filename = f"{original_name.rsplit('.', 1)[0]}_converted.txt"
+        
+        converted_files.append({
+            'bytes': converted_bytes,
+            'filename': new_filename,
+            'mime_type': 'text/plain'
+        })
+    
+    elif conv_type == 'html_to_txt':
+        if detected_type not in ['html', 'htm']:
+            raise Exception(f"Файл {original_name} не является HTML файлом.")
+        
+        converted_bytes = await convert_html_to_txt(bytes(file_bytes))
+        
+        new_filename = f"{original_name.rsplit('.', 1)[0]}_converted.txt"
+        
+        converted_files.append({
+            'bytes': converted_bytes,
+            'filename': new_filename,
+            'mime_type': 'text/plain'
+        })
+    
+    elif conv_type == 'html_to_docx':
+        if detected_type not in ['html', 'htm']:
+            raise Exception(f"Файл {original_name} не является HTML файлом.")
+        
+        converted_bytes = await convert_html_to_docx(bytes(file_bytes))
+        
+        new_filename = f"{original_name.rsplit('.', 1)[0]}_converted.docx"
+        
+        converted_files.append({
+            'bytes': converted_bytes,
+            'filename': new_filename,
+            'mime_type': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        })
+    
+    elif conv_type in ['GIF_to_mp4', 'mp4_to_GIF', 'video_to_mp3', 'video_to_wav', 'video_to_flac']:
+        if progress and cpu_budget.active_jobs >= cpu_budget.max_jobs:
+            await progress(text="Ожидание свободного процессора...")
+        
+        async with cpu_budget.job(conv_type) as cpu_slot:
+            if progress:
+                await progress(text="Конвертация видео...")
+            
+            quality = quality_policy.select(conv_type, not options.get('target_size'))
+            converted_data = await process_video_conversion(
+                file_bytes, 
+                conv_type, 
+                original_name, 
+                progress,
+                options.get('target_size'),
+                options.get('targets'),
+                cpu_slot,
+                quality,
+                local_path,
+                output_dir
+            )
+        converted_files.extend(converted_data)
+    
+    return converted_files
+
+def conversion_options(conv_type, targets=None, target_size=None, as_file=False):
+    if conv_type not in CONVERSIONS:
+        raise Exception(f"Неизвестный тип конвертации: {conv_type}")
+    
+    source, target = CONVERSIONS[conv_type]
+    allowed_targets = MULTI_TARGET_OPTIONS.get(source, [target])
+    for extra_target in targets or []:
+        if extra_target not in allowed_targets:
+            raise Exception(f"Формат {extra_target} недоступен для {source}. Доступны: {', '.join(allowed_targets)}")
+    
+    return {
+        'type': conv_type,
+        'source': source,
+        'target': target,
+        'targets': targets or None,
+        'target_size': target_size,
+        'as_file': as_file
+    }
+
+async def convert(conv_type, file_bytes=None, file_name=None, targets=None, target_size=None, as_file=False, progress=None, input_path=None):
+    options = conversion_options(conv_type, targets, target_size, as_file)
+    file_name = file_name or os.path.basename(input_path or '')
+    if file_bytes is None:
+        if conv_type in ['GIF_to_mp4', 'mp4_to_GIF', 'video_to_mp3', 'video_to_wav', 'video_to_flac']:
+            file_bytes = read_file_header(input_path)
+        else:
+            with open(input_path, 'rb') as f:
+                file_bytes = f.read()
+    return await convert_input(options, file_bytes, file_name, progress, input_path)
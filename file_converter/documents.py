@@ -0,0 +1,849 @@
+import re
+import logging
+import codecs
+import zipfile
+import xml.etree.ElementTree as ET
+import io
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+
+from .config import config
+from .resources import conversion_pool
+
+logger = logging.getLogger(__name__)
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '<Override PartName="/word/numbering.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml"/>'
+    '</Types>'
+)
+
+DOCX_PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+DOCX_DOCUMENT_RELS_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/numbering" Target="numbering.xml"/>'
+)
+
+DOCX_HYPERLINK_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink'
+
+DOCX_HEADING_STYLES = ''.join(
+    f'<w:style w:type="paragraph" w:styleId="Heading{level}"><w:name w:val="heading {level}"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:uiPriority w:val="9"/><w:qFormat/>'
+    f'<w:pPr><w:keepNext/><w:keepLines/><w:spacing w:before="{480 if level == 1 else 200}" w:after="0"/><w:outlineLvl w:val="{level - 1}"/></w:pPr>'
+    f'<w:rPr><w:rFonts w:ascii="Cambria" w:eastAsia="Times New Roman" w:hAnsi="Cambria" w:cs="Times New Roman"/><w:b/><w:bCs/>'
+    f'<w:color w:val="{"365F91" if level == 1 else "4F81BD"}"/><w:sz w:val="{size}"/><w:szCs w:val="{size}"/></w:rPr></w:style>'
+    for level, size in [(1, 28), (2, 26), (3, 24), (4, 22), (5, 22), (6, 22)]
+)
+
+DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:docDefaults>'
+    '<w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:eastAsia="Calibri" w:hAnsi="Calibri" w:cs="Times New Roman"/>'
+    '<w:sz w:val="22"/><w:szCs w:val="22"/><w:lang w:val="ru-RU" w:eastAsia="en-US" w:bidi="ar-SA"/></w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="200" w:line="276" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+    '<w:style w:type="character" w:default="1" w:styleId="DefaultParagraphFont"><w:name w:val="Default Paragraph Font"/><w:uiPriority w:val="1"/><w:semiHidden/><w:unhideWhenUsed/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:uiPriority w:val="10"/><w:qFormat/>'
+    '<w:pPr><w:pBdr><w:bottom w:val="single" w:sz="8" w:space="4" w:color="4F81BD"/></w:pBdr><w:spacing w:after="300" w:line="240" w:lineRule="auto"/><w:contextualSpacing/></w:pPr>'
+    '<w:rPr><w:rFonts w:ascii="Cambria" w:eastAsia="Times New Roman" w:hAnsi="Cambria" w:cs="Times New Roman"/><w:color w:val="17365D"/><w:spacing w:val="5"/><w:kern w:val="28"/><w:sz w:val="52"/><w:szCs w:val="52"/></w:rPr></w:style>'
+    + DOCX_HEADING_STYLES +
+    '<w:style w:type="paragraph" w:styleId="ListParagraph"><w:name w:val="List Paragraph"/><w:basedOn w:val="Normal"/><w:uiPriority w:val="34"/><w:qFormat/>'
+    '<w:pPr><w:ind w:left="720"/><w:contextualSpacing/></w:pPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Quote"><w:name w:val="Quote"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:uiPriority w:val="29"/><w:qFormat/>'
+    '<w:pPr><w:ind w:left="567"/></w:pPr><w:rPr><w:i/><w:iCs/><w:color w:val="404040"/></w:rPr></w:style>'
+    '<w:style w:type="character" w:styleId="Hyperlink"><w:name w:val="Hyperlink"/><w:basedOn w:val="DefaultParagraphFont"/><w:uiPriority w:val="99"/><w:unhideWhenUsed/>'
+    '<w:rPr><w:color w:val="0000FF"/><w:u w:val="single"/></w:rPr></w:style>'
+    '<w:style w:type="table" w:default="1" w:styleId="TableNormal"><w:name w:val="Normal Table"/><w:uiPriority w:val="99"/><w:semiHidden/><w:unhideWhenUsed/>'
+    '<w:tblPr><w:tblInd w:w="0" w:type="dxa"/><w:tblCellMar><w:top w:w="0" w:type="dxa"/><w:left w:w="108" w:type="dxa"/>'
+    '<w:bottom w:w="0" w:type="dxa"/><w:right w:w="108" w:type="dxa"/></w:tblCellMar></w:tblPr></w:style>'
+    '<w:style w:type="table" w:styleId="TableGrid"><w:name w:val="Table Grid"/><w:basedOn w:val="TableNormal"/><w:uiPriority w:val="59"/>'
+    '<w:pPr><w:spacing w:after="0" w:line="240" w:lineRule="auto"/></w:pPr>'
+    '<w:tblPr><w:tblBorders><w:top w:val="single" w:sz="4" w:space="0" w:color="auto"/><w:left w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:bottom w:val="single" w:sz="4" w:space="0" w:color="auto"/><w:right w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+    '<w:insideH w:val="single" w:sz="4" w:space="0" w:color="auto"/><w:insideV w:val="single" w:sz="4" w:space="0" w:color="auto"/></w:tblBorders></w:tblPr></w:style>'
+    '</w:styles>'
+)
+
+DOCX_NUMBERING_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:numbering xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:abstractNum w:abstractNumId="0"><w:multiLevelType w:val="hybridMultilevel"/>'
+    + ''.join(
+        f'<w:lvl w:ilvl="{level}"><w:start w:val="1"/><w:numFmt w:val="bullet"/><w:lvlText w:val="{"•◦▪"[level % 3]}"/><w:lvlJc w:val="left"/>'
+        f'<w:pPr><w:ind w:left="{720 * (level + 1)}" w:hanging="360"/></w:pPr></w:lvl>'
+        for level in range(9)
+    ) +
+    '</w:abstractNum>'
+    '<w:abstractNum w:abstractNumId="1"><w:multiLevelType w:val="hybridMultilevel"/>'
+    + ''.join(
+        f'<w:lvl w:ilvl="{level}"><w:start w:val="1"/><w:numFmt w:val="decimal"/><w:lvlText w:val="%{level + 1}."/><w:lvlJc w:val="left"/>'
+        f'<w:pPr><w:ind w:left="{720 * (level + 1)}" w:hanging="360"/></w:pPr></w:lvl>'
+        for level in range(9)
+    ) +
+    '</w:abstractNum>'
+)
+
+DOCX_DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><w:body>'
+)
+
+DOCX_DOCUMENT_END = (
+    '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+    '<w:pgMar w:top="1440" w:right="1800" w:bottom="1440" w:left="1800" w:header="720" w:footer="720" w:gutter="0"/>'
+    '<w:cols w:space="720"/><w:docGrid w:linePitch="360"/></w:sectPr>'
+    '</w:body></w:document>'
+)
+
+DOCX_FLUSH_CHARS = 64 * 1024
+DOCX_BULLET_NUM_ID = 1
+
+xml_invalid_chars = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+def xml_escape(text):
+    text = xml_invalid_chars.sub('', text)
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+def docx_run_xml(text, bold=False, italic=False, monospace=False, char_style=None):
+    text = xml_escape(text)
+    text = text.replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">')
+    text = text.replace('\r', '</w:t><w:br/><w:t xml:space="preserve">')
+    
+    properties = ''
+    if char_style:
+        properties += f'<w:rStyle w:val="{char_style}"/>'
+    if monospace:
+        properties += '<w:rFonts w:ascii="Courier New" w:hAnsi="Courier New" w:cs="Courier New"/>'
+    if bold:
+        properties += '<w:b/><w:bCs/>'
+    if italic:
+        properties += '<w:i/><w:iCs/>'
+    if properties:
+        properties = f'<w:rPr>{properties}</w:rPr>'
+    
+    return f'<w:r>{properties}<w:t xml:space="preserve">{text}</w:t></w:r>'
+
+class StreamingDocxWriter:
+    def __init__(self, output):
+        self.zip = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+        self.stream = self.zip.open('word/document.xml', 'w')
+        self.buffer = []
+        self.buffered = 0
+        self.hyperlinks = []
+        self.ordered_lists = 0
+        self.tables = []
+        self.write(DOCX_DOCUMENT_START)
+    
+    def write(self, xml):
+        self.buffer.append(xml)
+        self.buffered += len(xml)
+        if self.buffered >= DOCX_FLUSH_CHARS:
+            self.flush()
+    
+    def flush(self):
+        if self.buffer:
+            self.stream.write(''.join(self.buffer).encode('utf-8'))
+            self.buffer = []
+            self.buffered = 0
+    
+    def heading(self, text, level=1):
+        style = 'Title' if level == 0 else f'Heading{level}'
+        self.write_paragraph(docx_run_xml(text), f'<w:pStyle w:val="{style}"/>')
+    
+    def paragraph(self, text, alignment='left'):
+        self.write_paragraph(docx_run_xml(text), f'<w:jc w:val="{alignment}"/>')
+    
+    def rich_paragraph(self, runs, style=None, numbering=None, alignment='left'):
+        properties = ''
+        if style:
+            properties += f'<w:pStyle w:val="{style}"/>'
+        if numbering:
+            num_id, level = numbering
+            properties += f'<w:numPr><w:ilvl w:val="{min(level, 8)}"/><w:numId w:val="{num_id}"/></w:numPr>'
+        properties += f'<w:jc w:val="{alignment}"/>'
+        
+        content = []
+        for text, bold, italic, monospace, link in runs:
+            if link:
+                content.append(f'<w:hyperlink r:id="{self.hyperlink_id(link)}">{docx_run_xml(text, bold, italic, monospace, "Hyperlink")}</w:hyperlink>')
+            else:
+                content.append(docx_run_xml(text, bold, italic, monospace))
+        
+        self.write_paragraph(''.join(content), properties)
+    
+    def write_paragraph(self, content, properties=''):
+        if self.tables:
+            self.ensure_cell()
+            self.tables[-1]['cell_has_paragraph'] = True
+        self.write(f'<w:p><w:pPr>{properties}</w:pPr>{content}</w:p>')
+    
+    def hyperlink_id(self, url):
+        self.hyperlinks.append(url)
+        return f'rId{len(self.hyperlinks) + 2}'
+    
+    def new_ordered_numbering(self):
+        self.ordered_lists += 1
+        return self.ordered_lists + 1
+    
+    def start_table(self):
+        if self.tables:
+            self.ensure_cell()
+            self.tables[-1]['cell_has_paragraph'] = False
+        self.tables.append({'table_written': False, 'row_open': False, 'row_written': False, 'cell_open': False, 'cell_has_paragraph': False})
+    
+    def start_row(self):
+        if not self.tables:
+            return
+        self.end_row()
+        self.tables[-1]['row_open'] = True
+        self.tables[-1]['row_written'] = False
+    
+    def start_cell(self):
+        if not self.tables:
+            return
+        table = self.tables[-1]
+        self.end_cell()
+        if not table['row_open']:
+            self.start_row()
+        if not table['table_written']:
+            self.write('<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:w="0" w:type="auto"/></w:tblPr><w:tblGrid/>')
+            table['table_written'] = True
+        if not table['row_written']:
+            self.write('<w:tr>')
+            table['row_written'] = True
+        self.write('<w:tc><w:tcPr><w:tcW w:w="0" w:type="auto"/></w:tcPr>')
+        table['cell_open'] = True
+        table['cell_has_paragraph'] = False
+    
+    def ensure_cell(self):
+        if not self.tables[-1]['cell_open']:
+            self.start_cell()
+    
+    def end_cell(self):
+        if not self.tables:
+            return
+        table = self.tables[-1]
+        if table['cell_open']:
+            if not table['cell_has_paragraph']:
+                self.write('<w:p/>')
+            self.write('</w:tc>')
+            table['cell_open'] = False
+    
+    def end_row(self):
+        if not self.tables:
+            return
+        table = self.tables[-1]
+        self.end_cell()
+        if table['row_open'] and table['row_written']:
+            self.write('</w:tr>')
+        table['row_open'] = False
+    
+    def end_table(self):
+        if not self.tables:
+            return
+        self.end_row()
+        if self.tables.pop()['table_written']:
+            self.write('</w:tbl>')
+        if self.tables:
+            self.tables[-1]['cell_has_paragraph'] = False
+    
+    def close(self):
+        while self.tables:
+            self.end_table()
+        self.write(DOCX_DOCUMENT_END)
+        self.flush()
+        self.stream.close()
+        
+        relationships = [DOCX_DOCUMENT_RELS_START]
+        for index, url in enumerate(self.hyperlinks, 3):
+            relationships.append(f'<Relationship Id="rId{index}" Type="{DOCX_HYPERLINK_REL}" Target="{xml_escape(url)}" TargetMode="External"/>')
+        relationships.append('</Relationships>')
+        
+        numbering = [DOCX_NUMBERING_START, f'<w:num w:numId="{DOCX_BULLET_NUM_ID}"><w:abstractNumId w:val="0"/></w:num>']
+        for num_id in range(2, self.ordered_lists + 2):
+            numbering.append(
+                f'<w:num w:numId="{num_id}"><w:abstractNumId w:val="1"/>'
+                f'<w:lvlOverride w:ilvl="0"><w:startOverride w:val="1"/></w:lvlOverride></w:num>'
+            )
+        numbering.append('</w:numbering>')
+        
+        self.zip.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        self.zip.writestr('_rels/.rels', DOCX_PACKAGE_RELS)
+        self.zip.writestr('word/_rels/document.xml.rels', ''.join(relationships))
+        self.zip.writestr('word/styles.xml', DOCX_STYLES)
+        self.zip.writestr('word/numbering.xml', ''.join(numbering))
+        self.zip.close()
+
+def iter_text_lines(text):
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+def write_txt_to_docx_streaming(txt_content):
+    doc_buffer = io.BytesIO()
+    writer = StreamingDocxWriter(doc_buffer)
+    writer.heading('Конвертированный документ', 0)
+    
+    for para in iter_text_lines(txt_content):
+        para = para.strip()
+        if para:
+            writer.paragraph(para)
+    
+    writer.close()
+    return doc_buffer.getvalue()
+
+async def convert_txt_to_docx(txt_content):
+    return await conversion_pool.run(convert_txt_to_docx_sync, txt_content)
+
+def convert_txt_to_docx_sync(txt_content):
+    if config.get('fast_docx', True):
+        try:
+            return write_txt_to_docx_streaming(txt_content)
+        except Exception as e:
+            logger.error(f"Ошибка быстрой записи DOCX, используем python-docx: {e}")
+    
+    return convert_txt_to_docx_python_docx(txt_content)
+
+def convert_txt_to_docx_python_docx(txt_content):
+    try:
+        doc = Document()
+        doc.add_heading('Конвертированный документ', 0)
+        
+        paragraphs = txt_content.split('\n')
+        for para in paragraphs:
+            if para.strip():
+                p = doc.add_paragraph(para.strip())
+                p.alignment = WD_ALIGN_PARAGRAPH.LEFT
+        
+        doc_buffer = io.BytesIO()
+        doc.save(doc_buffer)
+        doc_buffer.seek(0)
+        
+        return doc_buffer.getvalue()
+    except Exception as e:
+        logger.error(f"Ошибка конвертации TXT в DOCX: {e}")
+        raise
+
+DOCX_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DOCX_MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+DOCX_OFFICE_DOCUMENT_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+
+def docx_text_parts(docx_zip):
+    main_part = 'word/document.xml'
+    try:
+        rels = ET.fromstring(docx_zip.read('_rels/.rels'))
+        for rel in rels:
+            if rel.get('Type') == DOCX_OFFICE_DOCUMENT_REL:
+                main_part = rel.get('Target', main_part).lstrip('/')
+    except KeyError:
+        pass
+    
+    def part_number(name):
+        digits = re.sub(r'\D', '', name.rsplit('/', 1)[-1])
+        return int(digits) if digits else 0
+    
+    names = docx_zip.namelist()
+    headers = sorted((n for n in names if re.fullmatch(r'word/header\d*\.xml', n)), key=part_number)
+    footers = sorted((n for n in names if re.fullmatch(r'word/footer\d*\.xml', n)), key=part_number)
+    notes = [n for n in ['word/footnotes.xml', 'word/endnotes.xml'] if n in names]
+    
+    return headers + [main_part] + notes + footers
+
+def iter_docx_part_lines(stream):
+    paragraphs = []
+    cells = []
+    rows = []
+    run_depth = 0
+    skip_depth = 0
+    container = None
+    
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        tag = elem.tag
+        
+        if tag == DOCX_MC_FALLBACK:
+            skip_depth += 1 if event == 'start' else -1
+            continue
+        if skip_depth:
+            continue
+        
+        if event == 'start':
+            if container is None or tag == DOCX_W + 'body':
+                container = elem
+            elif tag == DOCX_W + 'p':
+                paragraphs.append([])
+            elif tag == DOCX_W + 'r':
+                run_depth += 1
+            elif tag == DOCX_W + 'tc':
+                cells.append([])
+            elif tag == DOCX_W + 'tr':
+                rows.append([])
+            continue
+        
+        line = None
+        if tag == DOCX_W + 't':
+            if run_depth and paragraphs:
+                paragraphs[-1].append(elem.text or '')
+        elif tag == DOCX_W + 'tab':
+            if run_depth and paragraphs:
+                paragraphs[-1].append('\t')
+        elif tag in (DOCX_W + 'br', DOCX_W + 'cr'):
+            if run_depth and paragraphs:
+                paragraphs[-1].append('\n')
+        elif tag == DOCX_W + 'r':
+            run_depth -= 1
+        elif tag == DOCX_W + 'p':
+            line = ''.join(paragraphs.pop()) if paragraphs else ''
+        elif tag == DOCX_W + 'tc':
+            cell = cells.pop() if cells else []
+            if rows:
+                rows[-1].append(' '.join(text for text in cell if text.strip()))
+        elif tag == DOCX_W + 'tr':
+            line = '\t'.join(rows.pop()) if rows else ''
+        
+        if line is not None and line.strip():
+            if cells:
+                cells[-1].append(line)
+            else:
+                yield line
+        
+        if tag in (DOCX_W + 'p', DOCX_W + 'tbl') and not paragraphs and not cells and container is not None:
+            container.clear()
+
+def extract_docx_text_streaming(docx_bytes):
+    output = io.BytesIO()
+    first = True
+    
+    with zipfile.ZipFile(io.BytesIO(docx_bytes)) as docx_zip:
+        for part in docx_text_parts(docx_zip):
+            with docx_zip.open(part) as stream:
+                for line in iter_docx_part_lines(stream):
+                    if not first:
+                        output.write(b'\n')
+                    output.write(line.encode('utf-8'))
+                    first = False
+    
+    return output.getvalue()
+
+async def convert_docx_to_txt(docx_bytes):
+    return await conversion_pool.run(convert_docx_to_txt_sync, docx_bytes)
+
+def convert_docx_to_txt_sync(docx_bytes):
+    if config.get('fast_docx', True):
+        try:
+            return extract_docx_text_streaming(docx_bytes)
+        except Exception as e:
+            logger.error(f"Ошибка быстрого чтения DOCX, используем python-docx: {e}")
+    
+    return convert_docx_to_txt_python_docx(docx_bytes)
+
+def convert_docx_to_txt_python_docx(docx_bytes):
+    try:
+        doc_buffer = io.BytesIO(docx_bytes)
+        doc = Document(doc_buffer)
+        
+        text_content = []
+        for paragraph in doc.paragraphs:
+            if paragraph.text.strip():
+                text_content.append(paragraph.text)
+        
+        return '\n'.join(text_content).encode('utf-8')
+    except Exception as e:
+        logger.error(f"Ошибка конвертации DOCX в TXT: {e}")
+        raise
+
+HTML_CHARSET_SNIFF_BYTES = 4096
+HTML_SAMPLE_BYTES = 64 * 1024
+HTML_FEED_CHARS = 64 * 1024
+HTML_SKIP_TAGS = {'script', 'style'}
+HTML_BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'caption', 'dd', 'div', 'dl', 'dt',
+    'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'title', 'tr', 'ul'
+}
+HTML_CELL_TAGS = {'td', 'th'}
+RUSSIAN_FREQUENT_LETTERS = set('оеаинтсрвлкмдпуяыь')
+
+html_meta_charset = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([-\w:.]+)', re.IGNORECASE)
+xml_declaration_encoding = re.compile(rb'<\?xml[^>]*encoding\s*=\s*["\']([-\w:.]+)', re.IGNORECASE)
+whitespace_run = re.compile(r'\s+')
+
+def normalize_charset(name):
+    try:
+        codec = codecs.lookup(name.strip().lower())
+    except LookupError:
+        return None
+    if codec.name.startswith('utf-16'):
+        return 'utf-8'
+    return codec.name
+
+def detect_html_charset(html_bytes):
+    if html_bytes.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if html_bytes.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    
+    head = bytes(html_bytes[:HTML_CHARSET_SNIFF_BYTES])
+    for pattern in (html_meta_charset, xml_declaration_encoding):
+        match = pattern.search(head)
+        if match:
+            charset = normalize_charset(match.group(1).decode('ascii', errors='ignore'))
+            if charset:
+                return charset
+    
+    sample = bytes(html_bytes[:HTML_SAMPLE_BYTES])
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=len(html_bytes) <= HTML_SAMPLE_BYTES)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    
+    high_bytes = sum(1 for byte in sample if byte >= 0x80)
+    best_charset, best_score = 'cp1252', 0
+    for charset in ('cp1251', 'koi8_r', 'cp866'):
+        score = sum(1 for char in sample.decode(charset, errors='ignore') if char in RUSSIAN_FREQUENT_LETTERS)
+        if score > best_score:
+            best_charset, best_score = charset, score
+    
+    if best_score < high_bytes * 0.3:
+        return 'cp1252'
+    return best_charset
+
+def iter_decoded_chunks(data, charset, chunk_size=HTML_FEED_CHARS):
+    decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        chunk = decoder.decode(view[offset:offset + chunk_size])
+        if chunk:
+            yield chunk
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+class HtmlTextExtractor(HTMLParser):
+    def __init__(self, write_line):
+        super().__init__(convert_charrefs=True)
+        self.write_line = write_line
+        self.skip_depth = 0
+        self.pre_depth = 0
+        self.parts = []
+    
+    def flush_line(self):
+        if self.parts:
+            text = ''.join(self.parts)
+            self.parts = []
+            if self.pre_depth:
+                for line in text.split('\n'):
+                    if line.strip():
+                        self.write_line(line.rstrip())
+            else:
+                line = whitespace_run.sub(' ', text).strip()
+                if line:
+                    self.write_line(line)
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in HTML_BLOCK_TAGS:
+            self.flush_line()
+            if tag == 'pre':
+                self.pre_depth += 1
+        elif tag in HTML_CELL_TAGS and self.parts:
+            self.parts.append(' ')
+    
+    def handle_startendtag(self, tag, attrs):
+        if tag in HTML_BLOCK_TAGS:
+            self.flush_line()
+    
+    def handle_endtag(self, tag):
+        if tag in HTML_SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in HTML_BLOCK_TAGS:
+            self.flush_line()
+            if tag == 'pre':
+                self.pre_depth = max(0, self.pre_depth - 1)
+    
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+    
+    def close(self):
+        super().close()
+        self.flush_line()
+
+def iter_html_text_lines(html_bytes):
+    lines = []
+    extractor = HtmlTextExtractor(lines.append)
+    
+    for chunk in iter_decoded_chunks(html_bytes, detect_html_charset(html_bytes)):
+        extractor.feed(chunk)
+        yield from lines
+        lines.clear()
+    
+    extractor.close()
+    yield from lines
+
+def extract_html_text_streaming(html_bytes):
+    return '\n'.join(iter_html_text_lines(html_bytes)).encode('utf-8')
+
+async def convert_html_to_txt(html_bytes):
+    return await conversion_pool.run(convert_html_to_txt_sync, html_bytes)
+
+def convert_html_to_txt_sync(html_bytes):
+    if config.get('fast_html', True):
+        try:
+            return extract_html_text_streaming(html_bytes)
+        except Exception as e:
+            logger.error(f"Ошибка быстрого разбора HTML, используем BeautifulSoup: {e}")
+    
+    return convert_html_to_txt_bs4(html_bytes)
+
+def convert_html_to_txt_bs4(html_bytes):
+    try:
+        html_content = html_bytes.decode(detect_html_charset(html_bytes), errors='ignore')
+        soup = BeautifulSoup(html_content, 'html.parser')
+        
+        for script in soup(["script", "style"]):
+            script.decompose()
+        
+        text = soup.get_text()
+        lines = (line.strip() for line in text.splitlines())
+        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+        text = '\n'.join(chunk for chunk in chunks if chunk)
+        
+        return text.encode('utf-8')
+    except Exception as e:
+        logger.error(f"Ошибка конвертации HTML в TXT: {e}")
+        raise
+
+HTML_HEADING_TAGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+HTML_BOLD_TAGS = {'b', 'strong'}
+HTML_ITALIC_TAGS = {'i', 'em', 'cite', 'dfn', 'var'}
+HTML_MONOSPACE_TAGS = {'code', 'kbd', 'samp', 'tt'}
+HTML_LINK_SCHEMES = ('http://', 'https://', 'mailto:', 'ftp://')
+
+class HtmlDocxBuilder(HTMLParser):
+    def __init__(self, writer):
+        super().__init__(convert_charrefs=True)
+        self.writer = writer
+        self.skip_depth = 0
+        self.title_parts = None
+        self.title_written = False
+        self.runs = []
+        self.style = None
+        self.numbering = None
+        self.bold = 0
+        self.italic = 0
+        self.monospace = 0
+        self.pre = 0
+        self.quote = 0
+        self.header_cells = 0
+        self.links = []
+        self.lists = []
+    
+    def ensure_title(self, title=None):
+        if not self.title_written:
+            self.writer.heading(title or 'Конвертированный документ', 0)
+            self.title_written = True
+    
+    def flush_paragraph(self):
+        if not self.runs:
+            return
+        
+        runs = self.runs
+        self.runs = []
+        
+        text, bold, italic, monospace, link = runs[-1]
+        runs[-1] = (text.rstrip(' \r') if not self.pre else text.rstrip('\r'), bold, italic, monospace, link)
+        runs = [run for run in runs if run[0]]
+        if not any(run[0].strip() for run in runs):
+            return
+        
+        style = self.style
+        if not style and self.quote:
+            style = 'Quote'
+        if not style and self.lists and not self.numbering:
+            style = 'ListParagraph'
+        
+        self.ensure_title()
+        self.writer.rich_paragraph(runs, style, self.numbering)
+        self.numbering = None
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'title':
+            self.title_parts = []
+        elif tag in HTML_HEADING_TAGS:
+            self.flush_paragraph()
+            self.style = f'Heading{HTML_HEADING_TAGS[tag]}'
+        elif tag in ('ul', 'ol'):
+            self.flush_paragraph()
+            self.lists.append(DOCX_BULLET_NUM_ID if tag == 'ul' else self.writer.new_ordered_numbering())
+        elif tag == 'li':
+            self.flush_paragraph()
+            self.numbering = (self.lists[-1], len(self.lists) - 1) if self.lists else (DOCX_BULLET_NUM_ID, 0)
+        elif tag == 'table':
+            self.flush_paragraph()
+            self.ensure_title()
+            self.writer.start_table()
+        elif tag == 'tr':
+            self.flush_paragraph()
+            self.writer.start_row()
+        elif tag in HTML_CELL_TAGS:
+            self.flush_paragraph()
+            self.writer.start_cell()
+            if tag == 'th':
+                self.header_cells += 1
+        elif tag == 'br':
+            if self.runs:
+                self.add_text('\r')
+        elif tag == 'a':
+            href = (dict(attrs).get('href') or '').strip()
+            self.links.append(href if href.lower().startswith(HTML_LINK_SCHEMES) else None)
+        elif tag in HTML_BOLD_TAGS:
+            self.bold += 1
+        elif tag in HTML_ITALIC_TAGS:
+            self.italic += 1
+        elif tag in HTML_MONOSPACE_TAGS:
+            self.monospace += 1
+        elif tag == 'blockquote':
+            self.flush_paragraph()
+            self.quote += 1
+        elif tag == 'pre':
+            self.flush_paragraph()
+            self.pre += 1
+        elif tag in HTML_BLOCK_TAGS:
+            self.flush_paragraph()
+    
+    def handle_endtag(self, tag):
+        if tag in HTML_SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'title':
+            if self.title_parts is not None:
+                self.ensure_title(whitespace_run.sub(' ', ''.join(self.title_parts)).strip())
+                self.title_parts = None
+        elif tag in HTML_HEADING_TAGS:
+            self.flush_paragraph()
+            self.style = None
+        elif tag in ('ul', 'ol'):
+            self.flush_paragraph()
+            if self.lists:
+                self.lists.pop()
+        elif tag == 'li':
+            self.flush_paragraph()
+            self.numbering = None
+        elif tag == 'table':
+            self.flush_paragraph()
+            self.writer.end_table()
+        elif tag == 'tr':
+            self.flush_paragraph()
+            self.writer.end_row()
+        elif tag in HTML_CELL_TAGS:
+            self.flush_paragraph()
+            self.writer.end_cell()
+            if tag == 'th':
+                self.header_cells = max(0, self.header_cells - 1)
+        elif tag == 'a':
+            if self.links:
+                self.links.pop()
+        elif tag in HTML_BOLD_TAGS:
+            self.bold = max(0, self.bold - 1)
+        elif tag in HTML_ITALIC_TAGS:
+            self.italic = max(0, self.italic - 1)
+        elif tag in HTML_MONOSPACE_TAGS:
+            self.monospace = max(0, self.monospace - 1)
+        elif tag == 'blockquote':
+            self.flush_paragraph()
+            self.quote = max(0, self.quote - 1)
+        elif tag == 'pre':
+            self.flush_paragraph()
+            self.pre = max(0, self.pre - 1)
+        elif tag in HTML_BLOCK_TAGS and tag != 'br':
+            self.flush_paragraph()
+    
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.title_parts is not None:
+            self.title_parts.append(data)
+            return
+        
+        if self.pre:
+            text = data.replace('\r\n', '\n').replace('\n', '\r')
+            if not self.runs:
+                text = text.lstrip('\r')
+        else:
+            text = whitespace_run.sub(' ', data)
+            if not self.runs or self.runs[-1][0].endswith((' ', '\r')):
+                text = text.lstrip(' ')
+        
+        if text:
+            self.add_text(text)
+    
+    def add_text(self, text):
+        self.runs.append((
+            text,
+            self.bold > 0 or self.header_cells > 0,
+            self.italic > 0,
+            self.monospace > 0 or self.pre > 0,
+            self.links[-1] if self.links else None
+        ))
+    
+    def close(self):
+        super().close()
+        self.flush_paragraph()
+        self.ensure_title()
+
+def write_html_to_docx_streaming(html_bytes):
+    doc_buffer = io.BytesIO()
+    writer = StreamingDocxWriter(doc_buffer)
+    builder = HtmlDocxBuilder(writer)
+    
+    for chunk in iter_decoded_chunks(html_bytes, detect_html_charset(html_bytes)):
+        builder.feed(chunk)
+    
+    builder.close()
+    writer.close()
+    return doc_buffer.getvalue()
+
+async def convert_html_to_docx(html_bytes):
+    return await conversion_pool.run(convert_html_to_docx_sync, html_bytes)
+
+def convert_html_to_docx_sync(html_bytes):
+    if config.get('fast_html', True):
+        try:
+            return write_html_to_docx_streaming(html_bytes)
+        except Exception as e:
+            logger.error(f"Ошибка прямой конвертации HTML в DOCX, используем текстовый путь: {e}")
+    
+    return convert_html_to_docx_via_text(html_bytes)
+
+def convert_html_to_docx_via_text(html_bytes):
+    try:
+        txt_content = convert_html_to_txt_sync(html_bytes)
+        return convert_txt_to_docx_sync(txt_content.decode('utf-8', errors='ignore'))
+    except Exception as e:
+        logger.error(f"Ошибка конвертации HTML в DOCX: {e}")
+        raise
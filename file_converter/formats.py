@@ -0,0 +1,48 @@
+FILE_HEADER_BYTES = 64
+
+SOURCE_EXTENSIONS = {
+    'jpg': ['.jpg', '.jpeg', '.jpe', '.jfif'],
+    'png': ['.png'],
+    'webp': ['.webp'],
+    'GIF': ['.gif', '.gifv'],
+    'txt': ['.txt', '.text'],
+    'docx': ['.docx', '.doc'],
+    'html': ['.html', '.htm', '.xhtml'],
+    'video': ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv', '.mpg', '.mpeg', '.3gp']
+}
+
+def detect_file_type(file_bytes, filename):
+    filename_lower = filename.lower()
+    
+    if filename_lower.endswith('.gif'):
+        return 'GIF'
+    elif filename_lower.endswith(('.mp4', '.mov', '.avi', '.mkv', '.webm')):
+        return 'video'
+    elif filename_lower.endswith(('.jpg', '.jpeg')):
+        return 'jpg'
+    elif filename_lower.endswith('.png'):
+        return 'png'
+    elif filename_lower.endswith('.webp'):
+        return 'webp'
+    elif filename_lower.endswith('.txt'):
+        return 'txt'
+    elif filename_lower.endswith(('.docx', '.doc')):
+        return 'docx'
+    elif filename_lower.endswith(('.html', '.htm')):
+        return 'html'
+    
+    if len(file_bytes) >= 6:
+        if file_bytes[:6] in [b'GIF87a', b'GIF89a']:
+            return 'GIF'
+        elif file_bytes[:8] == b'\x89PNG\r\n\x1a\n':
+            return 'png'
+        elif file_bytes[:2] == b'\xff\xd8':
+            return 'jpg'
+        elif len(file_bytes) >= 12 and file_bytes[:4] == b'RIFF' and file_bytes[8:12] == b'WEBP':
+            return 'webp'
+    
+    return 'unknown'
+
+def read_file_header(path):
+    with open(path, 'rb') as f:
+        return bytearray(f.read(FILE_HEADER_BYTES))
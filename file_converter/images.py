@@ -0,0 +1,171 @@
+import logging
+import asyncio
+from PIL import Image
+import io
+
+from .resources import conversion_pool
+
+logger = logging.getLogger(__name__)
+
+TARGET_SIZE_SAFETY = 0.92
+TARGET_SIZE_TRIAL_PIXELS = 512 * 512
+TARGET_SIZE_MIN_QUALITY = 50
+TARGET_SIZE_SCALED_QUALITY = 75
+TARGET_SIZE_MAX_ATTEMPTS = 3
+TARGET_SIZE_SCALE_ITERATIONS = 3
+
+def encode_image(image, save_params, scale=1.0):
+    if scale < 1.0:
+        if image.mode in ['P', '1']:
+            image = image.convert('RGBA')
+        width = max(1, int(image.width * scale))
+        height = max(1, int(image.height * scale))
+        image = image.resize((width, height), Image.LANCZOS)
+    
+    output_buffer = io.BytesIO()
+    image.save(output_buffer, **save_params)
+    return output_buffer.getvalue()
+
+def fit_image_to_size(image, save_params, target_size):
+    budget = target_size * TARGET_SIZE_SAFETY
+    lossy = 'quality' in save_params
+    
+    pixels = image.width * image.height
+    trial_scale = min(1.0, (TARGET_SIZE_TRIAL_PIXELS / pixels) ** 0.5) if pixels else 1.0
+    trial = image
+    if trial_scale < 1.0:
+        trial = image.resize(
+            (max(1, int(image.width * trial_scale)), max(1, int(image.height * trial_scale))),
+            Image.NEAREST
+        )
+    pixel_ratio = pixels / max(1, trial.width * trial.height)
+    
+    def estimate(quality, scale=1.0):
+        params = dict(save_params)
+        if quality is not None:
+            params['quality'] = quality
+        params.pop('optimize', None)
+        return len(encode_image(trial, params, scale)) * pixel_ratio
+    
+    def fit_scale(quality):
+        scale = 1.0
+        for _ in range(TARGET_SIZE_SCALE_ITERATIONS):
+            scale = min(1.0, scale * (budget / estimate(quality, scale)) ** 0.5)
+        return scale
+    
+    quality = save_params.get('quality')
+    scale = 1.0
+    
+    if lossy:
+        if estimate(quality) > budget:
+            low, high = TARGET_SIZE_MIN_QUALITY, quality
+            if estimate(low) > budget:
+                quality = TARGET_SIZE_SCALED_QUALITY
+                scale = fit_scale(quality)
+            else:
+                while high - low > 2:
+                    middle = (low + high) // 2
+                    if estimate(middle) <= budget:
+                        low = middle
+                    else:
+                        high = middle
+                quality = low
+    elif estimate(None) > budget:
+        scale = fit_scale(None)
+    
+    params = dict(save_params)
+    if lossy:
+        params['quality'] = quality
+    
+    for attempt in range(TARGET_SIZE_MAX_ATTEMPTS):
+        result = encode_image(image, params, scale)
+        logger.info(f"Подбор размера: попытка {attempt + 1}, качество {params.get('quality')}, масштаб {scale:.2f}, размер {len(result)} байт")
+        if len(result) <= target_size:
+            return result
+        scale *= min(0.95, (budget / len(result)) ** 0.5)
+    
+    raise Exception(f"Не удалось уложить изображение в {target_size / (1024 * 1024):.1f} МБ")
+
+def prepare_image(image, source_format, target_format, quality=None):
+    if target_format in ['jpg', 'jpeg'] and image.mode in ['RGBA', 'P']:
+        image = image.convert('RGB')
+    elif target_format == 'png' and image.mode == 'P':
+        image = image.convert('RGBA')
+    
+    save_params = {}
+    if target_format == 'jpg':
+        save_params['format'] = 'JPEG'
+        save_params['quality'] = 95
+    elif target_format == 'png':
+        save_params['format'] = 'PNG'
+        if quality and quality['png_compress_level'] is not None:
+            save_params['compress_level'] = quality['png_compress_level']
+        else:
+            save_params['optimize'] = True
+    elif target_format == 'webp':
+        save_params['format'] = 'WEBP'
+        save_params['quality'] = 90
+        if quality:
+            save_params['method'] = quality['webp_method']
+    elif target_format == 'GIF':
+        save_params['format'] = 'GIF'
+        if source_format == 'GIF':
+            if hasattr(image, 'is_animated') and image.is_animated:
+                image.seek(0)
+    
+    return image, save_params
+
+def encode_image_for_target(image, source_format, target_format, target_size=None, quality=None):
+    image, save_params = prepare_image(image, source_format, target_format, quality)
+    
+    if target_size:
+        return fit_image_to_size(image, save_params, target_size)
+    
+    return encode_image(image, save_params)
+
+def encode_image_copy(image, source_format, target_format, target_size=None, quality=None):
+    return encode_image_for_target(image.copy(), source_format, target_format, target_size, quality)
+
+def open_image(file_bytes, max_side=None):
+    image = Image.open(io.BytesIO(file_bytes))
+    if max_side and max(image.size) > max_side:
+        if image.format == 'JPEG':
+            image.draft(image.mode, (max_side, max_side))
+        if image.mode in ['P', '1']:
+            image = image.convert('RGBA')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+def load_image(file_bytes, source_format, max_side=None):
+    image = open_image(file_bytes, max_side)
+    if source_format == 'GIF' and getattr(image, 'is_animated', False):
+        image.seek(0)
+    image.load()
+    return image
+
+def convert_image_sync(file_bytes, source_format, target_format, target_size=None, quality=None, max_side=None):
+    image = open_image(file_bytes, max_side)
+    return encode_image_for_target(image, source_format, target_format, target_size, quality)
+
+async def convert_image(file_bytes, source_format, target_format, target_size=None, quality=None, max_side=None):
+    try:
+        return await conversion_pool.run(convert_image_sync, file_bytes, source_format, target_format, target_size, quality, max_side)
+        
+    except Exception as e:
+        logger.error(f"Ошибка конвертации изображения: {e}")
+        raise
+
+async def convert_image_multi(file_bytes, source_format, target_formats, target_size=None, quality=None, max_side=None):
+    try:
+        image = await conversion_pool.run(load_image, file_bytes, source_format, max_side)
+        
+        results = await asyncio.gather(*[
+            conversion_pool.run(encode_image_copy, image, source_format, target_format, target_size, quality)
+            for target_format in target_formats
+        ])
+        
+        return dict(zip(target_formats, results))
+        
+    except Exception as e:
+        logger.error(f"Ошибка конвертации изображения: {e}")
+        raise
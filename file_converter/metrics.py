@@ -0,0 +1,97 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+METRICS_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+METRICS_SIZE_BUCKETS = [16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024]
+
+metrics_registry = []
+
+def metrics_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def metrics_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{metrics_label_value(value)}"' for name, value in pairs) + '}'
+
+class Metric:
+    metric_type = 'untyped'
+    
+    def __init__(self, name, help_text, label_names=(), callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.callback = callback
+        self.values = {}
+        metrics_registry.append(self)
+    
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+    
+    def samples(self):
+        values = self.values
+        if self.callback:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [(self.name, key, None, value) for key, value in sorted(values.items())]
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.metric_type}']
+        for name, key, extra, value in self.samples():
+            lines.append(f'{name}{metrics_labels(self.label_names, key, extra)} {value}')
+        return lines
+
+class Counter(Metric):
+    metric_type = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+    
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+    
+    def __init__(self, name, help_text, label_names=(), buckets=METRICS_LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = list(buckets)
+    
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state['counts'][index] += 1
+        state['sum'] += value
+        state['count'] += 1
+    
+    def samples(self):
+        result = []
+        for key, state in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, state['counts']):
+                result.append((f'{self.name}_bucket', key, ('le', bound), count))
+            result.append((f'{self.name}_bucket', key, ('le', '+Inf'), state['count']))
+            result.append((f'{self.name}_sum', key, None, state['sum']))
+            result.append((f'{self.name}_count', key, None, state['count']))
+        return result
+
+def render_metrics():
+    lines = []
+    for metric in metrics_registry:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            logger.error(f"Ошибка сбора метрики {metric.name}: {e}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,127 @@
+import os
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import io
+
+from .config import config
+
+PROFILE_DIR = "profiles"
+PROFILE_REPORT_LINES = 15
+
+def profile_dump_path(prefix, ext):
+    profile_dir = config.get('profile_dir', PROFILE_DIR)
+    os.makedirs(profile_dir, exist_ok=True)
+    now = time.time()
+    return os.path.join(profile_dir, f"{prefix}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(now))}_{int(now * 1000) % 1000:03d}.{ext}")
+
+class ProfilerControl:
+    def __init__(self):
+        self.active = False
+        self.started_at = None
+        self.busy = False
+        self.profiles = []
+        self.skipped = 0
+        self.lock = threading.Lock()
+    
+    def start(self):
+        if self.active:
+            return False
+        
+        self.active = True
+        self.started_at = time.monotonic()
+        with self.lock:
+            self.profiles = []
+            self.skipped = 0
+        return True
+    
+    def wrap(self, func):
+        def run(*args):
+            with self.lock:
+                profiling = self.active and not self.busy
+                if profiling:
+                    self.busy = True
+                elif self.active:
+                    self.skipped += 1
+            if not profiling:
+                return func(*args)
+            
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                with self.lock:
+                    self.busy = False
+                    self.skipped += 1
+                return func(*args)
+            
+            try:
+                return func(*args)
+            finally:
+                profile.disable()
+                with self.lock:
+                    self.busy = False
+                    if self.active:
+                        self.profiles.append(profile)
+        return run
+    
+    def stop(self):
+        if not self.active:
+            return None
+        
+        self.active = False
+        with self.lock:
+            profiles, self.profiles = self.profiles, []
+            skipped = self.skipped
+        
+        stats = pstats.Stats(stream=io.StringIO())
+        for profile in profiles:
+            stats.add(profile)
+        
+        path = profile_dump_path('profile', 'prof')
+        stats.dump_stats(path)
+        
+        report = io.StringIO()
+        stats.stream = report
+        stats.sort_stats('cumulative').print_stats(config.get('profile_report_lines', PROFILE_REPORT_LINES))
+        with open(path[:-len('.prof')] + '.txt', 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
+        
+        return {
+            'path': path,
+            'duration': time.monotonic() - self.started_at,
+            'calls': len(profiles),
+            'skipped': skipped,
+            'report': report.getvalue()
+        }
+
+profiler = ProfilerControl()
+memory_snapshots = {'previous': None}
+
+def take_memory_snapshot():
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+    ])
+    path = profile_dump_path('memsnap', 'tracemalloc')
+    snapshot.dump(path)
+    
+    lines = []
+    previous = memory_snapshots['previous']
+    if previous:
+        lines.append("Рост с прошлого снимка:")
+        for stat in snapshot.compare_to(previous, 'lineno')[:10]:
+            lines.append(str(stat))
+        lines.append("")
+    
+    lines.append("Крупнейшие выделения:")
+    for stat in snapshot.statistics('lineno')[:10]:
+        lines.append(str(stat))
+    
+    memory_snapshots['previous'] = snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    with open(path[:-len('.tracemalloc')] + '.txt', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+    return path, current, peak, '\n'.join(lines)
@@ -0,0 +1,449 @@
+import os
+import re
+import sys
+import time
+import logging
+import contextlib
+import tempfile
+import asyncio
+import shutil
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import config
+from .metrics import Counter, Gauge, Histogram
+from .tracing import trace_event
+from .profiling import profiler
+
+logger = logging.getLogger(__name__)
+
+QUALITY_TIERS = [
+    {
+        'name': 'normal',
+        'enter_load': 0,
+        'leave_load': 0,
+        'x264_preset': 'medium',
+        'x264_crf': 23,
+        'gif_fps': 10,
+        'gif_width': 320,
+        'gif_palette': 'full',
+        'png_compress_level': None,
+        'webp_method': 4
+    },
+    {
+        'name': 'reduced',
+        'enter_load': 1.5,
+        'leave_load': 1.0,
+        'x264_preset': 'faster',
+        'x264_crf': 23,
+        'gif_fps': 10,
+        'gif_width': 320,
+        'gif_palette': 'lite',
+        'png_compress_level': 6,
+        'webp_method': 2
+    },
+    {
+        'name': 'fast',
+        'enter_load': 2.5,
+        'leave_load': 1.75,
+        'x264_preset': 'veryfast',
+        'x264_crf': 23,
+        'gif_fps': 8,
+        'gif_width': 256,
+        'gif_palette': 'none',
+        'png_compress_level': 1,
+        'webp_method': 0
+    }
+]
+QUALITY_TIER_MIN_SECONDS = 30
+
+MEMORY_FACTORS = {
+    'jpg': 24,
+    'webp': 24,
+    'png': 8,
+    'GIF': 12,
+    'GIF_to_mp4': 4,
+    'mp4_to_GIF': 4,
+    'video': 4,
+    'txt': 3,
+    'docx': 8,
+    'html': 6
+}
+MEMORY_DEFAULT_FACTOR = 10
+MEMORY_MIN_FACTOR = 1
+MEMORY_MAX_FACTOR = 100
+MEMORY_MIN_RESERVATION = 16 * 1024 * 1024
+MEMORY_LEARNING_RATE = 0.2
+MEMORY_SAMPLE_INTERVAL = 0.25
+SCRATCH_SIZE_FACTOR = 4
+SCRATCH_MIN_RESERVATION = 64 * 1024 * 1024
+SCRATCH_ORPHAN_AGE = 3600
+
+queue_wait_seconds = Histogram('converter_queue_wait_seconds', 'Ожидание свободного ресурса перед задачей', ['resource'])
+
+class CpuSlot:
+    def __init__(self, cores, threads, pin_cores, conv_type=None):
+        self.cores = cores
+        self.threads = threads
+        self.pin_cores = pin_cores
+        self.conv_type = conv_type
+    
+    def input_args(self):
+        return ['-filter_threads', str(self.threads), '-threads', str(self.threads)]
+    
+    def output_args(self):
+        return ['-threads', str(self.threads)]
+
+class CpuBudget:
+    def __init__(self, max_jobs, pin_cores):
+        if hasattr(os, 'sched_getaffinity'):
+            self.cores = sorted(os.sched_getaffinity(0))
+        else:
+            self.cores = list(range(os.cpu_count() or 1))
+        self.max_jobs = max(1, max_jobs or len(self.cores) // 2)
+        self.pin_cores = pin_cores and hasattr(os, 'sched_setaffinity')
+        self.semaphore = asyncio.Semaphore(self.max_jobs)
+        self.core_load = {core: 0 for core in self.cores}
+        self.active_jobs = 0
+        self.waiting_jobs = 0
+    
+    @contextlib.asynccontextmanager
+    async def job(self, conv_type=None):
+        started = time.monotonic()
+        self.waiting_jobs += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting_jobs -= 1
+        queue_wait_seconds.observe(time.monotonic() - started, resource='cpu')
+        trace_event('cpu_wait', started)
+        
+        slot = self.allocate()
+        slot.conv_type = conv_type
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+            self.semaphore.release()
+    
+    def allocate(self):
+        self.active_jobs += 1
+        demand = min(self.max_jobs, self.active_jobs + self.waiting_jobs)
+        threads = max(1, len(self.cores) // demand)
+        cores = sorted(self.cores, key=lambda core: self.core_load[core])[:threads]
+        for core in cores:
+            self.core_load[core] += 1
+        
+        logger.info(f"Выделено потоков FFmpeg: {threads} (активных задач: {self.active_jobs}, в очереди: {self.waiting_jobs})")
+        return CpuSlot(cores, threads, self.pin_cores)
+    
+    def release(self, slot):
+        self.active_jobs -= 1
+        for core in slot.cores:
+            self.core_load[core] -= 1
+    
+    def limit_cores(self, count):
+        self.cores = self.cores[:max(1, count)]
+        self.core_load = {core: 0 for core in self.cores}
+        self.max_jobs = min(self.max_jobs, max(1, len(self.cores) // 2))
+        self.semaphore = asyncio.Semaphore(self.max_jobs)
+
+cpu_budget = CpuBudget(config.get('max_concurrent_jobs'), config.get('cpu_affinity', False))
+
+
+def default_memory_budget():
+    if hasattr(os, 'sysconf') and 'SC_PHYS_PAGES' in os.sysconf_names:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2
+    return 1024 * 1024 * 1024
+
+def current_memory_usage():
+    if not os.path.exists('/proc/self/statm'):
+        return None
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            usage = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+    
+    for pid in list(ffmpeg_processes):
+        try:
+            usage += read_process_usage(pid)[1]
+        except (OSError, ValueError, IndexError):
+            pass
+    return usage
+
+class MemoryBudget:
+    def __init__(self, total):
+        self.total = total
+        self.reserved = 0
+        self.reservations = []
+        self.waiters = []
+        self.condition = asyncio.Condition()
+        self.factors = {}
+        self.idle_usage = None
+        self.sampler_task = None
+    
+    def factor(self, conv_type):
+        if conv_type in self.factors:
+            return self.factors[conv_type]
+        return MEMORY_FACTORS.get(conv_type, MEMORY_FACTORS.get(conv_type.split('_to_')[0], MEMORY_DEFAULT_FACTOR))
+    
+    def estimate(self, conv_type, input_size):
+        return max(MEMORY_MIN_RESERVATION, int(input_size * self.factor(conv_type)))
+    
+    def fits(self, amount):
+        return not self.reservations or self.reserved + amount <= self.total
+    
+    def would_wait(self, conv_type, input_size):
+        return bool(self.waiters) or not self.fits(self.estimate(conv_type, input_size))
+    
+    async def acquire(self, conv_type, input_size):
+        started = time.monotonic()
+        reservation = {
+            'conv_type': conv_type,
+            'input_size': input_size,
+            'amount': self.estimate(conv_type, input_size),
+            'peak': 0
+        }
+        
+        async with self.condition:
+            self.waiters.append(reservation)
+            try:
+                await self.condition.wait_for(lambda: self.waiters[0] is reservation and self.fits(reservation['amount']))
+            finally:
+                self.waiters = [waiter for waiter in self.waiters if waiter is not reservation]
+                self.condition.notify_all()
+            
+            if not self.reservations:
+                self.idle_usage = current_memory_usage()
+            self.reservations.append(reservation)
+            self.reserved += reservation['amount']
+        queue_wait_seconds.observe(time.monotonic() - started, resource='memory')
+        trace_event('memory_wait', started, reserved=reservation['amount'])
+        
+        logger.info(f"Резерв памяти {conv_type}: {reservation['amount'] // (1024 * 1024)} МБ (занято {self.reserved // (1024 * 1024)} из {self.total // (1024 * 1024)} МБ)")
+        if self.sampler_task is None or self.sampler_task.done():
+            self.sampler_task = asyncio.create_task(self.sample_loop())
+        return reservation
+    
+    async def release(self, reservation):
+        self.sample()
+        async with self.condition:
+            self.reservations = [item for item in self.reservations if item is not reservation]
+            self.reserved -= reservation['amount']
+            self.learn(reservation)
+            self.condition.notify_all()
+    
+    def sample(self):
+        usage = current_memory_usage()
+        if usage is None or self.idle_usage is None or not self.reserved:
+            return
+        
+        growth = max(0, usage - self.idle_usage)
+        for reservation in self.reservations:
+            share = growth * reservation['amount'] / self.reserved
+            reservation['peak'] = max(reservation['peak'], share)
+    
+    async def sample_loop(self):
+        while self.reservations:
+            self.sample()
+            await asyncio.sleep(MEMORY_SAMPLE_INTERVAL)
+    
+    def learn(self, reservation):
+        if reservation['peak'] <= 0 or reservation['input_size'] <= 0:
+            return
+        
+        conv_type = reservation['conv_type']
+        observed = reservation['peak'] / reservation['input_size']
+        factor = self.factor(conv_type)
+        factor += config.get('memory_learning_rate', MEMORY_LEARNING_RATE) * (observed - factor)
+        self.factors[conv_type] = min(MEMORY_MAX_FACTOR, max(MEMORY_MIN_FACTOR, factor))
+        logger.info(f"Коэффициент памяти {conv_type}: {self.factors[conv_type]:.1f} (замер {observed:.1f})")
+
+memory_budget = MemoryBudget(int(config.get('memory_budget_mb', 0) * 1024 * 1024) or default_memory_budget())
+
+class ConversionPool:
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.in_flight = 0
+    
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self.executor, profiler.wrap(func), *args)
+        finally:
+            self.in_flight -= 1
+
+conversion_pool = ConversionPool(config.get('conversion_threads', os.cpu_count() or 2))
+
+class QualityPolicy:
+    def __init__(self, budget, memory, pool):
+        self.budget = budget
+        self.memory = memory
+        self.pool = pool
+        self.tier = 0
+        self.changed_at = time.monotonic()
+        self.tier_counts = {}
+    
+    def load(self):
+        ffmpeg_load = (self.budget.active_jobs + self.budget.waiting_jobs + len(self.memory.waiters)) / self.budget.max_jobs
+        return max(ffmpeg_load, self.pool.in_flight / self.pool.workers)
+    
+    def update(self):
+        load = self.load()
+        tier = self.tier
+        while tier + 1 < len(QUALITY_TIERS) and load >= QUALITY_TIERS[tier + 1]['enter_load']:
+            tier += 1
+        if tier == self.tier and time.monotonic() - self.changed_at >= config.get('quality_tier_min_seconds', QUALITY_TIER_MIN_SECONDS):
+            while tier > 0 and load < QUALITY_TIERS[tier]['leave_load']:
+                tier -= 1
+        
+        if tier != self.tier:
+            logger.info(f"Уровень качества: {QUALITY_TIERS[self.tier]['name']} → {QUALITY_TIERS[tier]['name']} (нагрузка {load:.2f})")
+            self.tier = tier
+            self.changed_at = time.monotonic()
+        return QUALITY_TIERS[self.tier]
+    
+    def select(self, conv_type, degrade=True):
+        quality = self.update() if degrade and config.get('adaptive_quality', True) else QUALITY_TIERS[0]
+        key = (conv_type, quality['name'])
+        self.tier_counts[key] = self.tier_counts.get(key, 0) + 1
+        logger.info(f"Задача {conv_type} выполняется на уровне качества {quality['name']}")
+        return quality
+
+quality_policy = QualityPolicy(cpu_budget, memory_budget, conversion_pool)
+
+def process_alive(pid):
+    if sys.platform == 'win32':
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def link_or_copy(source_path, target_path):
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
+
+class ScratchSpace:
+    def __init__(self):
+        self.roots = []
+        if config.get('scratch_tmpfs_dir'):
+            self.roots.append({
+                'path': config['scratch_tmpfs_dir'],
+                'quota': int(config.get('scratch_tmpfs_quota_mb', 512) * 1024 * 1024),
+                'max_job': int(config.get('scratch_tmpfs_max_job_mb', 64) * 1024 * 1024),
+                'reserved': 0
+            })
+        self.roots.append({
+            'path': config.get('scratch_dir') or os.path.join(tempfile.gettempdir(), 'converter_bot_scratch'),
+            'quota': int(config.get('scratch_quota_mb', 10240) * 1024 * 1024),
+            'max_job': None,
+            'reserved': 0
+        })
+        self.jobs = {}
+    
+    def estimate(self, input_size):
+        return max(SCRATCH_MIN_RESERVATION, int(input_size * config.get('scratch_size_factor', SCRATCH_SIZE_FACTOR)))
+    
+    def choose_root(self, expected_size):
+        for root in self.roots:
+            if root['max_job'] is not None and expected_size > root['max_job']:
+                continue
+            if root['reserved'] and root['reserved'] + expected_size > root['quota']:
+                continue
+            try:
+                os.makedirs(root['path'], exist_ok=True)
+                if shutil.disk_usage(root['path']).free < expected_size:
+                    continue
+            except OSError as e:
+                logger.error(f"Каталог временных файлов {root['path']} недоступен: {e}")
+                continue
+            return root
+        raise Exception("Недостаточно места для временных файлов. Попробуйте позже.")
+    
+    def create_job_dir(self, input_size):
+        expected_size = self.estimate(input_size)
+        root = self.choose_root(expected_size)
+        path = tempfile.mkdtemp(prefix=f'converter_job_{os.getpid()}_', dir=root['path'])
+        root['reserved'] += expected_size
+        self.jobs[path] = (root, expected_size)
+        return path
+    
+    def check_usage(self, path):
+        if path not in self.jobs:
+            return
+        usage = 0
+        for folder, dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    usage += os.path.getsize(os.path.join(folder, name))
+                except OSError:
+                    pass
+        root, expected_size = self.jobs[path]
+        if usage <= expected_size:
+            return
+        root['reserved'] += usage - expected_size
+        self.jobs[path] = (root, usage)
+        if root['reserved'] > root['quota']:
+            logger.warning(f"Временные файлы задачи {path} заняли {usage // (1024 * 1024)} МБ, квота {root['path']} превышена")
+            raise Exception("Недостаточно места для временных файлов. Попробуйте позже.")
+    
+    def remove_job_dir(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        if path in self.jobs:
+            root, expected_size = self.jobs.pop(path)
+            root['reserved'] -= expected_size
+    
+    def sweep(self):
+        removed = 0
+        now = time.time()
+        for root in self.roots:
+            if not os.path.isdir(root['path']):
+                continue
+            for name in os.listdir(root['path']):
+                path = os.path.join(root['path'], name)
+                match = re.match(r'converter_job_(\d+)_', name)
+                if not match:
+                    continue
+                pid = int(match.group(1))
+                alive = process_alive(pid) if pid != os.getpid() else False
+                if alive is False or alive is None and now - os.path.getmtime(path) > SCRATCH_ORPHAN_AGE:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+        
+        if removed:
+            logger.info(f"Удалено оставшихся временных файлов и каталогов: {removed}")
+        return removed
+
+scratch_space = ScratchSpace()
+
+Gauge('converter_queue_depth', 'Задачи, ожидающие процессор или память', callback=lambda: cpu_budget.waiting_jobs + len(memory_budget.waiters))
+
+Gauge('converter_cpu_jobs', 'Задачи, занимающие слот процессора', callback=lambda: cpu_budget.active_jobs)
+Gauge('converter_conversion_pool_jobs', 'Задачи в пуле потоков конвертации (выполняются и ждут)', callback=lambda: conversion_pool.in_flight)
+Gauge('converter_cpu_jobs_limit', 'Максимум одновременных задач FFmpeg', callback=lambda: cpu_budget.max_jobs)
+Gauge('converter_ffmpeg_processes', 'Запущенные процессы FFmpeg', callback=lambda: len(ffmpeg_processes))
+Gauge('converter_memory_reserved_bytes', 'Зарезервированная задачами память', callback=lambda: memory_budget.reserved)
+Gauge('converter_memory_budget_bytes', 'Бюджет памяти', callback=lambda: memory_budget.total)
+Gauge('converter_memory_factor', 'Коэффициент памяти для типа конвертации', ['conv_type'], callback=lambda: {(conv_type,): factor for conv_type, factor in memory_budget.factors.items()})
+Gauge('converter_scratch_reserved_bytes', 'Зарезервированное место для временных файлов', ['root'], callback=lambda: {(root['path'],): root['reserved'] for root in scratch_space.roots})
+Gauge('converter_quality_tier', 'Текущий уровень качества (0 - normal)', callback=lambda: quality_policy.tier)
+Counter('converter_quality_tier_jobs_total', 'Задачи по уровню качества', ['conv_type', 'tier'], callback=lambda: dict(quality_policy.tier_counts))
+
+ffmpeg_processes = {}
+
+def read_process_usage(pid):
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu_time = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    with open(f'/proc/{pid}/statm', 'r') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return cpu_time, rss
@@ -0,0 +1,156 @@
+import json
+import time
+import logging
+import logging.handlers
+import contextlib
+import asyncio
+import contextvars
+import uuid
+
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+TRACE_LOG_FILE = "traces.jsonl"
+SLOW_JOB_LOG_FILE = "slow_jobs.jsonl"
+TRACE_LOG_MAX_MB = 10
+TRACE_LOG_BACKUP_COUNT = 5
+SLOW_JOB_THRESHOLDS = {
+    'GIF_to_mp4': 60,
+    'mp4_to_GIF': 60,
+    'video_to_mp3': 45,
+    'video_to_wav': 45,
+    'video_to_flac': 45,
+    'txt_to_docx': 15,
+    'docx_to_txt': 15,
+    'html_to_txt': 15,
+    'html_to_docx': 20
+}
+SLOW_JOB_DEFAULT_THRESHOLD = 30
+
+trace_logger = logging.getLogger('converter.traces')
+slow_job_logger = logging.getLogger('converter.slow_jobs')
+current_trace = contextvars.ContextVar('current_trace', default=None)
+current_span_id = contextvars.ContextVar('current_span_id', default=None)
+
+def setup_trace_logs():
+    for trace_log, key, default_path in [
+        (trace_logger, 'trace_log_file', TRACE_LOG_FILE),
+        (slow_job_logger, 'slow_job_log_file', SLOW_JOB_LOG_FILE)
+    ]:
+        path = config.get(key, default_path)
+        trace_log.propagate = False
+        trace_log.setLevel(logging.INFO)
+        if not path or trace_log.handlers:
+            continue
+        
+        handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=int(config.get('trace_log_max_mb', TRACE_LOG_MAX_MB) * 1024 * 1024),
+            backupCount=config.get('trace_log_backup_count', TRACE_LOG_BACKUP_COUNT),
+            encoding='utf-8'
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        trace_log.addHandler(handler)
+
+def slow_job_threshold(conv_type):
+    thresholds = dict(SLOW_JOB_THRESHOLDS, **config.get('slow_job_thresholds', {}))
+    return thresholds.get(conv_type, config.get('slow_job_default_threshold', SLOW_JOB_DEFAULT_THRESHOLD))
+
+class JobTrace:
+    def __init__(self, user_id, chat_id, conv_type, total_files, kind='job'):
+        self.trace_id = uuid.uuid4().hex
+        self.kind = kind
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.conv_type = conv_type
+        self.total_files = total_files
+        self.files_failed = 0
+        self.status = 'ok'
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.spans = []
+    
+    def add_span(self, name, started, attributes):
+        span = {
+            'span_id': uuid.uuid4().hex[:16],
+            'parent_id': current_span_id.get(),
+            'name': name,
+            'start': round(started - self.started, 4),
+            'duration': None,
+            'status': 'ok',
+            'attributes': attributes
+        }
+        self.spans.append(span)
+        return span
+    
+    @contextlib.contextmanager
+    def span(self, name, attributes):
+        started = time.monotonic()
+        span = self.add_span(name, started, attributes)
+        token = current_span_id.set(span['span_id'])
+        try:
+            yield span
+        except asyncio.CancelledError:
+            span['status'] = 'cancelled'
+            raise
+        except Exception as e:
+            span['status'] = 'error'
+            span['error'] = str(e)[:200]
+            raise
+        finally:
+            span['duration'] = round(time.monotonic() - started, 4)
+            current_span_id.reset(token)
+    
+    def breakdown(self):
+        totals = {}
+        for span in self.spans:
+            if span['duration'] is not None:
+                totals[span['name']] = round(totals.get(span['name'], 0) + span['duration'], 4)
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+    
+    def finish(self):
+        duration = time.monotonic() - self.started
+        if self.status == 'ok' and self.files_failed:
+            self.status = 'failed' if self.files_failed >= self.total_files else 'partial'
+        record = {
+            'trace_id': self.trace_id,
+            'kind': self.kind,
+            'user_id': self.user_id,
+            'chat_id': self.chat_id,
+            'conv_type': self.conv_type,
+            'files': self.total_files,
+            'files_failed': self.files_failed,
+            'status': self.status,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.started_at)) + 'Z',
+            'duration': round(duration, 4),
+            'spans': self.spans
+        }
+        try:
+            trace_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+            
+            threshold = slow_job_threshold(self.conv_type)
+            if duration >= threshold:
+                record['threshold'] = threshold
+                record['breakdown'] = self.breakdown()
+                slow_job_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+                logger.warning(f"Медленная задача {self.trace_id} ({self.conv_type}): {duration:.1f} сек при пороге {threshold} сек")
+        except Exception as e:
+            logger.error(f"Не удалось записать трассировку {self.trace_id}: {e}")
+
+@contextlib.contextmanager
+def trace_span(name, **attributes):
+    trace = current_trace.get()
+    if trace is None:
+        yield attributes
+        return
+    
+    with trace.span(name, attributes):
+        yield attributes
+
+def trace_event(name, started, status='ok', **attributes):
+    trace = current_trace.get()
+    if trace is not None:
+        span = trace.add_span(name, started, attributes)
+        span['duration'] = round(time.monotonic() - started, 4)
+        span['status'] = status
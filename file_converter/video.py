@@ -0,0 +1,706 @@
+import os
+import re
+import sys
+import glob
+import time
+import signal
+import logging
+import tempfile
+import asyncio
+import subprocess
+import shutil
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .config import config
+from .metrics import Counter, Histogram
+from .tracing import trace_event, trace_span
+from .resources import QUALITY_TIERS, ffmpeg_processes, link_or_copy, read_process_usage, scratch_space
+from .formats import detect_file_type
+from .images import TARGET_SIZE_SAFETY
+
+logger = logging.getLogger(__name__)
+
+ffmpeg_cache = None
+
+VIDEO_MIN_BITRATE_KBPS = 50
+SEGMENT_MIN_DURATION = 20
+SEGMENT_MIN_LENGTH = 5
+SEGMENT_MAX_COUNT = 4
+
+GIF_MAX_DURATION = 30
+FFMPEG_MAX_MEMORY_MB = 4096
+FFMPEG_MAX_CPU_SECONDS = 1800
+FFMPEG_MAX_OUTPUT_MB = 1024
+FFMPEG_MAX_RSS_MB = 1536
+FFMPEG_CPU_OUTLIER_FACTOR = 3
+FFMPEG_CPU_OUTLIER_SAMPLES = 5
+FFMPEG_WATCHDOG_INTERVAL = 1.0
+
+ffmpeg_wall_seconds = Histogram('converter_ffmpeg_wall_seconds', 'Время работы процесса FFmpeg', ['conv_type', 'result'])
+ffmpeg_cpu_seconds = Histogram('converter_ffmpeg_cpu_seconds', 'Процессорное время FFmpeg (user + system)', ['conv_type', 'result'])
+
+ffmpeg_cache_total = Counter('converter_ffmpeg_path_cache_total', 'Обращения к кэшу пути FFmpeg', ['result'])
+
+async def find_ffmpeg_cached():
+    global ffmpeg_cache
+    if ffmpeg_cache and os.path.exists(ffmpeg_cache):
+        ffmpeg_cache_total.inc(result='hit')
+        return ffmpeg_cache
+    
+    ffmpeg_cache_total.inc(result='miss')
+    if 'ffmpeg_path' in config and os.path.exists(config['ffmpeg_path']):
+        ffmpeg_cache = config['ffmpeg_path']
+        return ffmpeg_cache
+    
+    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    local_ffmpeg = os.path.join(current_dir, "ffmpeg.exe")
+    
+    if os.path.exists(local_ffmpeg):
+        ffmpeg_cache = local_ffmpeg
+        return local_ffmpeg
+    
+    ffmpeg_in_path = shutil.which('ffmpeg')
+    if ffmpeg_in_path:
+        ffmpeg_cache = ffmpeg_in_path
+        return ffmpeg_in_path
+    
+    common_paths = ['ffmpeg.exe', 'ffmpeg', r'.\ffmpeg.exe']
+    for path in common_paths:
+        try:
+            returncode, _ = await run_probe_command([path, '-version'], timeout=3)
+            if returncode == 0:
+                ffmpeg_cache = path
+                return path
+        except:
+            continue
+    
+    return None
+
+def cpu_input_args(cpu_slot):
+    return cpu_slot.input_args() if cpu_slot else []
+
+def cpu_output_args(cpu_slot):
+    return cpu_slot.output_args() if cpu_slot else []
+
+class FfmpegLimitError(Exception):
+    pass
+
+ffmpeg_watchdog_task = None
+ffmpeg_memory_error = re.compile(r'cannot allocate memory|out of memory|malloc of size \d+ failed|pthread_create\(\) failed', re.IGNORECASE)
+ffmpeg_received_signal = re.compile(r'received signal (\d+)')
+ffmpeg_benchmark = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s')
+
+def ffmpeg_resource_limits():
+    if resource is None or not sys.platform.startswith('linux') or not config.get('ffmpeg_limits', True):
+        return []
+    return [
+        (resource.RLIMIT_AS, int(config.get('ffmpeg_max_memory_mb', FFMPEG_MAX_MEMORY_MB) * 1024 * 1024)),
+        (resource.RLIMIT_CPU, int(config.get('ffmpeg_max_cpu_seconds', FFMPEG_MAX_CPU_SECONDS))),
+        (resource.RLIMIT_FSIZE, int(config.get('ffmpeg_max_output_mb', FFMPEG_MAX_OUTPUT_MB) * 1024 * 1024))
+    ]
+
+def apply_ffmpeg_limits(pid, cpu_slot):
+    try:
+        if cpu_slot and cpu_slot.pin_cores:
+            os.sched_setaffinity(pid, set(cpu_slot.cores))
+        for limit, value in ffmpeg_resource_limits():
+            hard = resource.prlimit(pid, limit)[1]
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            soft = value
+            if limit == resource.RLIMIT_CPU and (hard == resource.RLIM_INFINITY or value + 5 <= hard):
+                hard = value + 5
+            else:
+                hard = value
+            resource.prlimit(pid, limit, (soft, hard))
+    except ProcessLookupError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось применить ограничения к FFmpeg (pid {pid}): {e}")
+
+def ffmpeg_limit_reason(returncode, stderr_text):
+    received = ffmpeg_received_signal.search(stderr_text)
+    signal_number = -returncode if returncode < 0 else int(received.group(1)) if received else None
+    
+    if signal_number is not None and signal_number == getattr(signal, 'SIGXCPU', None):
+        return "превышен лимит процессорного времени"
+    if signal_number is not None and signal_number == getattr(signal, 'SIGXFSZ', None) or 'File too large' in stderr_text:
+        return "превышен допустимый размер выходного файла"
+    if ffmpeg_memory_error.search(stderr_text):
+        return "превышен лимит памяти"
+    if signal_number is not None and signal_number == getattr(signal, 'SIGKILL', None):
+        return "процесс FFmpeg принудительно завершен системой из-за нехватки ресурсов"
+    return None
+
+def register_ffmpeg_process(process, cpu_slot):
+    global ffmpeg_watchdog_task
+    entry = {
+        'process': process,
+        'threads': cpu_slot.threads if cpu_slot else None,
+        'cpu_time': None,
+        'sampled_at': None,
+        'strikes': 0,
+        'kill_reason': None
+    }
+    ffmpeg_processes[process.pid] = entry
+    
+    if config.get('ffmpeg_watchdog', True) and os.path.exists('/proc/self/statm'):
+        if ffmpeg_watchdog_task is None or ffmpeg_watchdog_task.done():
+            ffmpeg_watchdog_task = asyncio.create_task(ffmpeg_watchdog())
+    return entry
+
+async def ffmpeg_watchdog():
+    while ffmpeg_processes:
+        await asyncio.sleep(config.get('ffmpeg_watchdog_interval', FFMPEG_WATCHDOG_INTERVAL))
+        max_rss = config.get('ffmpeg_max_rss_mb', FFMPEG_MAX_RSS_MB) * 1024 * 1024
+        outlier_factor = config.get('ffmpeg_cpu_outlier_factor', FFMPEG_CPU_OUTLIER_FACTOR)
+        outlier_samples = config.get('ffmpeg_cpu_outlier_samples', FFMPEG_CPU_OUTLIER_SAMPLES)
+        now = time.monotonic()
+        for pid, entry in list(ffmpeg_processes.items()):
+            if entry['process'].returncode is not None or entry['kill_reason']:
+                continue
+            try:
+                cpu_time, rss = read_process_usage(pid)
+            except (OSError, ValueError, IndexError):
+                continue
+            
+            reason = None
+            if rss > max_rss:
+                reason = f"процесс FFmpeg занял {rss // (1024 * 1024)} МБ памяти (лимит {max_rss // (1024 * 1024)} МБ)"
+            elif entry['threads'] and entry['cpu_time'] is not None:
+                cores_used = (cpu_time - entry['cpu_time']) / max(now - entry['sampled_at'], 0.001)
+                if cores_used > entry['threads'] * outlier_factor:
+                    entry['strikes'] += 1
+                else:
+                    entry['strikes'] = 0
+                if entry['strikes'] >= outlier_samples:
+                    reason = f"процесс FFmpeg загружает {cores_used:.1f} ядер при выделенных {entry['threads']}"
+            
+            entry['cpu_time'] = cpu_time
+            entry['sampled_at'] = now
+            
+            if reason:
+                logger.warning(f"Сторожевой таймер останавливает FFmpeg (pid {pid}): {reason}")
+                entry['kill_reason'] = reason
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+def observe_ffmpeg(cpu_slot, result, started, stderr_text=""):
+    conv_type = cpu_slot.conv_type if cpu_slot and cpu_slot.conv_type else 'unknown'
+    ffmpeg_wall_seconds.observe(time.monotonic() - started, conv_type=conv_type, result=result)
+    cpu_seconds = None
+    match = ffmpeg_benchmark.search(stderr_text)
+    if match:
+        cpu_seconds = float(match.group(1)) + float(match.group(2))
+        ffmpeg_cpu_seconds.observe(cpu_seconds, conv_type=conv_type, result=result)
+    trace_event('ffmpeg', started, result, cpu_seconds=cpu_seconds, threads=cpu_slot.threads if cpu_slot else None)
+
+async def run_ffmpeg_command(cmd, timeout=120, cpu_slot=None):
+    cmd = [cmd[0], '-benchmark'] + cmd[1:]
+    logger.info(f"Запуск FFmpeg: {' '.join(cmd)}")
+    started = time.monotonic()
+    
+    creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            creationflags=creation_flags,
+            start_new_session=sys.platform != 'win32'
+        )
+    except Exception as e:
+        raise Exception(f"Ошибка выполнения FFmpeg: {str(e)}")
+    
+    apply_ffmpeg_limits(process.pid, cpu_slot)
+    entry = register_ffmpeg_process(process, cpu_slot)
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        await kill_ffmpeg_process(process)
+        observe_ffmpeg(cpu_slot, 'timeout', started)
+        raise Exception("Таймаут конвертации. Файл слишком большой или сложный.")
+    except asyncio.CancelledError:
+        await kill_ffmpeg_process(process)
+        observe_ffmpeg(cpu_slot, 'cancelled', started)
+        raise
+    finally:
+        ffmpeg_processes.pop(process.pid, None)
+    
+    stderr_text = stderr.decode('utf-8', errors='ignore') if stderr else ""
+    if process.returncode != 0:
+        reason = entry['kill_reason'] or ffmpeg_limit_reason(process.returncode, stderr_text)
+        if reason:
+            observe_ffmpeg(cpu_slot, 'limit', started, stderr_text)
+            logger.error(f"FFmpeg остановлен: {reason}")
+            raise FfmpegLimitError(f"Задача остановлена: {reason}")
+        
+        observe_ffmpeg(cpu_slot, 'error', started, stderr_text)
+        error_msg = '\n'.join(line for line in stderr_text.splitlines() if not line.startswith('bench:')).strip()[-500:]
+        if not error_msg:
+            error_msg = "Неизвестная ошибка"
+        logger.error(f"Ошибка FFmpeg: {error_msg}")
+        raise Exception(f"Ошибка выполнения FFmpeg: Ошибка FFmpeg: {error_msg}")
+    
+    observe_ffmpeg(cpu_slot, 'ok', started, stderr_text)
+    return True
+
+async def kill_ffmpeg_process(process):
+    if process.returncode is None:
+        try:
+            if sys.platform != 'win32':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+async def run_probe_command(cmd, timeout=10):
+    creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        creationflags=creation_flags,
+        start_new_session=sys.platform != 'win32'
+    )
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        await kill_ffmpeg_process(process)
+        raise
+    return process.returncode, stderr.decode('utf-8', errors='ignore') if stderr else ""
+
+async def probe_media_info(input_path):
+    ffmpeg_path = await find_ffmpeg_cached()
+    info = {'duration': 0.0, 'width': 0, 'height': 0, 'fps': 0.0, 'has_audio': False}
+    if not ffmpeg_path:
+        return info
+    
+    try:
+        _, stderr_text = await run_probe_command([ffmpeg_path, '-hide_banner', '-i', input_path], timeout=10)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка анализа файла {input_path}: {e}")
+        return info
+    
+    match = re.search(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)', stderr_text)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    
+    match = re.search(r'Stream #.*?Video:.*?(\d{2,5})x(\d{2,5})', stderr_text)
+    if match:
+        info['width'] = int(match.group(1))
+        info['height'] = int(match.group(2))
+    
+    match = re.search(r'Stream #.*?Video:.*?([\d.]+) (?:fps|tbr)', stderr_text)
+    if match:
+        info['fps'] = float(match.group(1))
+    
+    info['has_audio'] = re.search(r'Stream #.*?Audio:', stderr_text) is not None
+    
+    return info
+
+async def convert_GIF_to_mp4(input_path, output_path, progress=None, target_size=None, cpu_slot=None, quality=None):
+    ffmpeg_path = await find_ffmpeg_cached()
+    if not ffmpeg_path:
+        raise Exception("FFmpeg не найден")
+    
+    if target_size:
+        await convert_GIF_to_mp4_target_size(ffmpeg_path, input_path, output_path, target_size, cpu_slot)
+        return
+    
+    duration = (await probe_media_info(input_path))['duration']
+    segment_count = plan_video_segments(duration, cpu_slot.threads if cpu_slot else os.cpu_count() or 1)
+    if segment_count > 1:
+        try:
+            await convert_GIF_to_mp4_segmented(ffmpeg_path, input_path, output_path, duration, segment_count, cpu_slot, quality)
+            return
+        except (asyncio.CancelledError, FfmpegLimitError):
+            raise
+        except Exception as e:
+            logger.warning(f"Параллельное кодирование по сегментам не удалось, кодирую целиком: {e}")
+    
+    cmd = [ffmpeg_path] + cpu_input_args(cpu_slot) + ['-i', input_path] + gif_to_mp4_encode_args(quality) + cpu_output_args(cpu_slot) + ['-movflags', 'faststart', '-y', output_path]
+    
+    await run_ffmpeg_command(cmd, timeout=180, cpu_slot=cpu_slot)
+
+def gif_to_mp4_encode_args(quality=None, pre_filter=None):
+    quality = quality or QUALITY_TIERS[0]
+    scale_filter = 'scale=trunc(iw/2)*2:trunc(ih/2)*2'
+    return [
+        '-pix_fmt', 'yuv420p',
+        '-vf', f'{pre_filter},{scale_filter}' if pre_filter else scale_filter,
+        '-c:v', 'libx264',
+        '-preset', quality['x264_preset'],
+        '-crf', str(quality['x264_crf'])
+    ]
+
+def plan_video_segments(duration, cores):
+    max_segments = min(cores, config.get('segment_max_count', SEGMENT_MAX_COUNT))
+    if max_segments < 2:
+        return 1
+    
+    if duration < config.get('segment_min_duration', SEGMENT_MIN_DURATION):
+        return 1
+    
+    segment_count = min(max_segments, int(duration // config.get('segment_min_length', SEGMENT_MIN_LENGTH)))
+    return max(segment_count, 1)
+
+async def convert_GIF_to_mp4_segmented(ffmpeg_path, input_path, output_path, duration, segment_count, cpu_slot=None, quality=None):
+    segment_length = duration / segment_count
+    boundaries = [f'{index * segment_length:.3f}' for index in range(segment_count)]
+    threads_per_segment = max(1, (cpu_slot.threads if cpu_slot else os.cpu_count() or 1) // segment_count)
+    
+    logger.info(f"Кодирование по сегментам: {segment_count} x {segment_length:.1f} сек, потоков на сегмент: {threads_per_segment}")
+    
+    segment_dir = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        segment_paths = []
+        tasks = []
+        for index in range(segment_count):
+            segment_path = os.path.join(segment_dir, f'segment_{index:03d}.mp4')
+            segment_paths.append(segment_path)
+            trim_filter = f'trim=start={boundaries[index]}'
+            if index < segment_count - 1:
+                trim_filter += f':end={boundaries[index + 1]}'
+            cmd = [ffmpeg_path, '-i', input_path] + gif_to_mp4_encode_args(quality, trim_filter)
+            cmd += ['-threads', str(threads_per_segment), '-an', '-y', segment_path]
+            tasks.append(asyncio.create_task(run_ffmpeg_command(cmd, timeout=180, cpu_slot=cpu_slot)))
+        
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        scratch_space.check_usage(os.path.dirname(segment_dir))
+        
+        list_path = os.path.join(segment_dir, 'segments.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for segment_path in segment_paths:
+                escaped_path = segment_path.replace("'", "'\\''")
+                f.write(f"file '{escaped_path}'\n")
+        
+        await run_ffmpeg_command([
+            ffmpeg_path,
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', list_path,
+            '-c', 'copy',
+            '-movflags', 'faststart',
+            '-y',
+            output_path
+        ], timeout=60, cpu_slot=cpu_slot)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+async def convert_GIF_to_mp4_target_size(ffmpeg_path, input_path, output_path, target_size, cpu_slot=None):
+    duration = (await probe_media_info(input_path))['duration']
+    if duration <= 0:
+        raise Exception("Не удалось определить длительность GIF для подбора размера")
+    
+    bitrate_kbps = int(target_size * 8 * TARGET_SIZE_SAFETY / duration / 1000)
+    if bitrate_kbps < VIDEO_MIN_BITRATE_KBPS:
+        raise Exception(f"GIF слишком длинный, чтобы уложиться в {target_size / (1024 * 1024):.1f} МБ")
+    
+    logger.info(f"Двухпроходное кодирование: длительность {duration:.1f} сек, битрейт {bitrate_kbps} кбит/с")
+    
+    passlog_prefix = output_path + '.passlog'
+    encode_args = [
+        '-pix_fmt', 'yuv420p',
+        '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+        '-c:v', 'libx264',
+        '-preset', 'medium',
+        '-b:v', f'{bitrate_kbps}k',
+        '-passlogfile', passlog_prefix,
+        '-an'
+    ] + cpu_output_args(cpu_slot)
+    
+    try:
+        await run_ffmpeg_command(
+            [ffmpeg_path] + cpu_input_args(cpu_slot) + ['-i', input_path] + encode_args + ['-pass', '1', '-f', 'mp4', '-y', os.devnull],
+            timeout=180,
+            cpu_slot=cpu_slot
+        )
+        await run_ffmpeg_command(
+            [ffmpeg_path] + cpu_input_args(cpu_slot) + ['-i', input_path] + encode_args + ['-pass', '2', '-movflags', 'faststart', '-y', output_path],
+            timeout=180,
+            cpu_slot=cpu_slot
+        )
+    finally:
+        for path in glob.glob(glob.escape(passlog_prefix) + '*'):
+            try:
+                os.unlink(path)
+            except:
+                pass
+    
+    if os.path.getsize(output_path) > target_size:
+        raise Exception(f"Не удалось уложить видео в {target_size / (1024 * 1024):.1f} МБ")
+
+async def convert_mp4_to_GIF(input_path, output_path, progress=None, cpu_slot=None, quality=None):
+    ffmpeg_path = await find_ffmpeg_cached()
+    if not ffmpeg_path:
+        raise Exception("FFmpeg не найден")
+    
+    quality = quality or QUALITY_TIERS[0]
+    info = await probe_media_info(input_path)
+    max_duration = config.get('gif_max_duration', GIF_MAX_DURATION)
+    if info['duration'] > max_duration:
+        logger.info(f"Видео длиннее {max_duration} сек ({info['duration']:.1f} сек), в GIF попадут первые {max_duration} сек")
+    
+    fps, width = gif_output_geometry(info, quality)
+    scale_filter = f"fps={fps},scale={width}:-2:flags={'lanczos' if quality['gif_palette'] == 'full' else 'bilinear'}"
+    input_args = [ffmpeg_path] + cpu_input_args(cpu_slot) + ['-t', str(max_duration), '-i', input_path]
+    palettegen, paletteuse = gif_palette_filters(quality)
+    
+    if progress:
+        await progress(55)
+    
+    if not palettegen:
+        await run_ffmpeg_command(input_args + ['-vf', scale_filter, '-loop', '0', '-y', output_path], timeout=180, cpu_slot=cpu_slot)
+        return
+    
+    frames_path = output_path + '.frames.nut'
+    palette_path = output_path + '.palette.png'
+    try:
+        await run_ffmpeg_command(input_args + [
+            '-filter_complex', f'[0:v]{scale_filter},split[frames][source];[source]{palettegen}[palette]',
+            '-map', '[palette]', '-y', palette_path,
+            '-map', '[frames]', '-c:v', 'rawvideo', '-y', frames_path
+        ], timeout=180, cpu_slot=cpu_slot)
+        
+        if progress:
+            await progress(70)
+        
+        last_error = None
+        for palette_filter in dict.fromkeys([paletteuse, 'paletteuse=dither=none', None]):
+            if palette_filter:
+                cmd = [ffmpeg_path, '-i', frames_path, '-i', palette_path, '-lavfi', f'[0:v][1:v]{palette_filter}']
+            else:
+                cmd = [ffmpeg_path, '-i', frames_path]
+            try:
+                await run_ffmpeg_command(cmd + ['-loop', '0', '-y', output_path], timeout=120, cpu_slot=cpu_slot)
+                break
+            except FfmpegLimitError:
+                raise
+            except Exception as e:
+                logger.info(f"Повторяем только шаг наложения палитры: {e}")
+                last_error = e
+        else:
+            raise Exception(f"Не удалось конвертировать MP4 в GIF: {str(last_error)}")
+    finally:
+        for path in [frames_path, palette_path]:
+            if os.path.exists(path):
+                try:
+                    os.unlink(path)
+                except:
+                    pass
+
+def gif_output_geometry(info, quality):
+    fps = quality['gif_fps']
+    if info['fps'] > 0:
+        fps = min(fps, info['fps'])
+    width = quality['gif_width']
+    if info['width'] > 0:
+        width = min(width, info['width'])
+    return fps, width
+
+def gif_palette_filters(quality):
+    if quality['gif_palette'] == 'full':
+        return 'palettegen=stats_mode=diff', 'paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle'
+    elif quality['gif_palette'] == 'lite':
+        return 'palettegen=max_colors=128', 'paletteuse=dither=none'
+    return None, None
+
+def audio_codec_args(audio_format):
+    if audio_format == 'mp3':
+        return ['-q:a', '2']
+    elif audio_format == 'wav':
+        return ['-acodec', 'pcm_s16le', '-ac', '2', '-ar', '44100']
+    elif audio_format == 'flac':
+        return ['-acodec', 'flac', '-compression_level', '5']
+    return []
+
+async def convert_video_to_audio(input_path, output_path, audio_format, progress=None, cpu_slot=None):
+    await convert_video_to_audio_multi(input_path, [(audio_format, output_path)], progress, cpu_slot)
+
+async def convert_video_to_audio_multi(input_path, outputs, progress=None, cpu_slot=None):
+    ffmpeg_path = await find_ffmpeg_cached()
+    if not ffmpeg_path:
+        raise Exception("FFmpeg не найден")
+    
+    cmd = [ffmpeg_path] + cpu_input_args(cpu_slot) + ['-i', input_path]
+    
+    for audio_format, output_path in outputs:
+        cmd.extend(['-map', 'a'])
+        cmd.extend(audio_codec_args(audio_format))
+        cmd.extend(cpu_output_args(cpu_slot))
+        cmd.extend(['-y', output_path])
+    
+    if progress:
+        await progress(55)
+    
+    await run_ffmpeg_command(cmd, timeout=180, cpu_slot=cpu_slot)
+    
+    if progress:
+        await progress(75)
+
+def remove_results(results):
+    for converted_file in results:
+        if 'path' in converted_file:
+            shutil.rmtree(os.path.dirname(converted_file['path']), ignore_errors=True)
+
+def read_output(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+async def process_video_conversion(file_bytes, conv_type, original_name, progress=None, target_size=None, targets=None, cpu_slot=None, quality=None, input_path=None, output_dir=None):
+    job_dir = None
+    outputs = []
+    results = []
+    
+    try:
+        with trace_span('detect_file_type'):
+            detected_type = detect_file_type(file_bytes[:16], original_name)
+        
+        logger.info(f"Определен тип файла: {detected_type} для {original_name}")
+        
+        if conv_type == 'GIF_to_mp4' and detected_type != 'GIF':
+            if detected_type == 'video':
+                raise Exception(f"Файл {original_name} является видеофайлом (MP4), а не GIF.")
+            else:
+                raise Exception(f"Файл {original_name} не является GIF файлом.")
+        
+        if conv_type == 'mp4_to_GIF' and detected_type not in ['video', 'GIF', 'mp4']:
+            raise Exception(f"Файл {original_name} не является видеофайлом.")
+        
+        if conv_type == 'GIF_to_mp4':
+            input_ext = 'gif'
+        elif conv_type == 'mp4_to_GIF':
+            if detected_type == 'GIF':
+                input_ext = 'gif'
+            else:
+                input_ext = 'mp4'
+        elif conv_type in ['video_to_mp3', 'video_to_wav', 'video_to_flac']:
+            input_ext = 'mp4'
+        
+        if input_path:
+            job_dir = scratch_space.create_job_dir(os.path.getsize(input_path))
+        else:
+            with trace_span('write_input', bytes=len(file_bytes)):
+                job_dir = scratch_space.create_job_dir(len(file_bytes))
+                input_path = os.path.join(job_dir, f'input.{input_ext}')
+                with open(input_path, 'wb') as f:
+                    f.write(file_bytes)
+            scratch_space.check_usage(job_dir)
+        
+        if progress:
+            await progress(25)
+        
+        if conv_type == 'GIF_to_mp4':
+            outputs.append(('mp4', os.path.join(job_dir, 'output.mp4')))
+            
+            if progress:
+                await progress(35)
+            
+            await convert_GIF_to_mp4(input_path, outputs[0][1], progress, target_size, cpu_slot, quality)
+            
+            if progress:
+                await progress(65)
+        
+        elif conv_type == 'mp4_to_GIF':
+            outputs.append(('gif', os.path.join(job_dir, 'output.gif')))
+            output_path = outputs[0][1]
+            
+            if progress:
+                await progress(35)
+            
+            if detected_type == 'GIF':
+                logger.info(f"Файл уже является GIF, копируем без конвертации")
+                link_or_copy(input_path, output_path)
+            else:
+                await convert_mp4_to_GIF(input_path, output_path, progress, cpu_slot, quality)
+            
+            if progress:
+                await progress(65)
+        
+        elif conv_type in ['video_to_mp3', 'video_to_wav', 'video_to_flac']:
+            audio_formats = targets or [conv_type.split('_to_')[1]]
+            outputs.extend((audio_format, os.path.join(job_dir, f'output.{audio_format}')) for audio_format in audio_formats)
+            
+            if progress:
+                await progress(35)
+            
+            await convert_video_to_audio_multi(input_path, outputs, progress, cpu_slot)
+            
+            if progress:
+                await progress(65)
+        
+        else:
+            raise Exception(f"Неизвестный тип конвертации: {conv_type}")
+        
+        scratch_space.check_usage(job_dir)
+        
+        if progress:
+            await progress(80)
+        
+        if '.' in original_name:
+            name_without_ext = original_name.rsplit('.', 1)[0]
+        else:
+            name_without_ext = original_name
+        
+        mime_types = {
+            'mp4': 'video/mp4',
+            'gif': 'image/gif',
+            'mp3': 'audio/mpeg',
+            'wav': 'audio/wav',
+            'flac': 'audio/flac'
+        }
+        
+        loop = asyncio.get_running_loop()
+        for output_ext, output_path in outputs:
+            output_size = os.path.getsize(output_path)
+            if output_size == 0:
+                raise Exception("Результат конвертации пуст")
+            
+            converted_file = {
+                'filename': f"{name_without_ext}_converted.{output_ext}",
+                'mime_type': mime_types.get(output_ext, 'application/octet-stream')
+            }
+            if output_dir:
+                with trace_span('move_output', format=output_ext, bytes=output_size):
+                    result_dir = tempfile.mkdtemp(prefix='result_', dir=output_dir)
+                    converted_file['path'] = os.path.join(result_dir, os.path.basename(converted_file['filename']))
+                    results.append(converted_file)
+                    await loop.run_in_executor(None, shutil.move, output_path, converted_file['path'])
+            else:
+                with trace_span('read_output', format=output_ext, bytes=output_size):
+                    converted_file['bytes'] = await loop.run_in_executor(None, read_output, output_path)
+                results.append(converted_file)
+        
+        if progress:
+            await progress(90)
+        
+        return results
+        
+    except asyncio.CancelledError:
+        remove_results(results)
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при конвертации видео: {e}")
+        remove_results(results)
+        raise
+    finally:
+        if job_dir:
+            scratch_space.remove_job_dir(job_dir)
@@ -0,0 +1,23 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='FFmpeg не установлен')
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture(scope='session')
+def bot():
+    import importlib.util
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Конвертатор файлов ver3.py')
+    spec = importlib.util.spec_from_file_location('converter_bot', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
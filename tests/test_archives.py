@@ -0,0 +1,68 @@
+import io
+import os
+import asyncio
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from file_converter.archives import ArchiveWriter
+
+def jpeg_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 24), color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def image_user_info():
+    return {'type': 'jpg_to_png', 'source': 'jpg', 'target': 'png', 'targets': None, 'max_size': 10 * 1024 * 1024, 'max_files': 1,
+            'as_file': True}
+
+def run_archive(bot, monkeypatch, work_dir, members):
+    archive_path = work_dir / 'photos.zip'
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    monkeypatch.setitem(bot.config, 'local_bot_api_url', 'http://stand-in')
+    monkeypatch.setattr(bot.delivery_queue, 'spool_dir', str(work_dir / 'outbox'))
+    file = SimpleNamespace(file_path=str(archive_path), file_size=os.path.getsize(archive_path))
+    file_info = {'file_id': 'z', 'file_name': 'photos.zip', 'archive': True}
+    
+    async def run():
+        return await bot.convert_archive(image_user_info(), file_info, file)
+    
+    return asyncio.run(run())
+
+def test_archive_members_are_converted_into_result_zip(bot, monkeypatch, work_dir):
+    results = run_archive(bot, monkeypatch, work_dir, {
+        'a.jpg': jpeg_bytes('red'),
+        'folder/b.jpeg': jpeg_bytes('blue'),
+        'broken.jpg': b'not an image',
+        'notes.txt': b'skip me'
+    })
+    
+    assert [result['filename'] for result in results] == ['photos_converted.zip']
+    with zipfile.ZipFile(results[0]['path']) as archive:
+        assert sorted(archive.namelist()) == ['a_converted.png', 'errors.txt', 'folder/b_converted.png']
+        assert Image.open(io.BytesIO(archive.read('folder/b_converted.png'))).format == 'PNG'
+        errors = archive.read('errors.txt').decode('utf-8')
+    assert 'broken.jpg' in errors
+    assert 'notes.txt: неподдерживаемый формат' in errors
+
+def test_archive_with_no_convertible_members_fails(bot, monkeypatch, work_dir):
+    with pytest.raises(Exception, match='ни одного файла'):
+        run_archive(bot, monkeypatch, work_dir, {'broken.jpg': b'not an image'})
+    assert os.listdir(work_dir / 'outbox') == []
+
+def test_archive_writer_splits_parts_and_keeps_names_unique(work_dir):
+    writer = ArchiveWriter(str(work_dir), 'photos', 1500)
+    writer.add('a.png', b'x' * 1000)
+    writer.add('a.png', b'y' * 1000)
+    writer.add('b.png', b'z' * 10)
+    parts = writer.close()
+    
+    assert [os.path.basename(part) for part in parts] == ['photos_converted.zip', 'photos_converted_part2.zip']
+    with zipfile.ZipFile(parts[0]) as archive:
+        assert archive.namelist() == ['a.png']
+    with zipfile.ZipFile(parts[1]) as archive:
+        assert archive.namelist() == ['a_2.png', 'b.png']
@@ -0,0 +1,166 @@
+import os
+import asyncio
+from types import SimpleNamespace
+
+def make_message(user_id, **fields):
+    replies = []
+    
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+    
+    message = SimpleNamespace(chat_id=user_id, message_id=1, reply_text=reply_text, replies=replies, **fields)
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=message)
+
+def video_user_info():
+    return {'type': 'mp4_to_GIF', 'source': 'video', 'target': 'GIF', 'max_size': 50 * 1024 * 1024, 'max_files': 1, 'files': []}
+
+def test_long_video_for_gif_is_accepted_with_trim_notice(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'start_prefetch', lambda *args: None)
+    user_info = video_user_info()
+    bot.user_data[501] = user_info
+    video = SimpleNamespace(file_id='v', file_name='long.mp4', file_size=1024, mime_type='video/mp4', duration=45)
+    update = make_message(501, video=video)
+    
+    asyncio.run(bot.handle_video(update, None))
+    
+    assert [file_info['file_id'] for file_info in user_info['files']] == ['v']
+    assert len(update.message.replies) == 1
+    assert '✅' in update.message.replies[0]
+    assert f"первых {bot.GIF_MAX_DURATION} секунд" in update.message.replies[0]
+
+def test_short_video_for_gif_has_no_trim_notice(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'start_prefetch', lambda *args: None)
+    user_info = video_user_info()
+    bot.user_data[502] = user_info
+    video = SimpleNamespace(file_id='v', file_name='short.mp4', file_size=1024, mime_type='video/mp4', duration=10)
+    update = make_message(502, video=video)
+    
+    asyncio.run(bot.handle_video(update, None))
+    
+    assert len(user_info['files']) == 1
+    assert '✂️' not in update.message.replies[0]
+
+def test_stale_album_timer_does_not_split_the_group(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'start_prefetch', lambda *args: None)
+    monkeypatch.setitem(bot.config, 'media_group_debounce', 0.05)
+    user_info = {'type': 'jpg_to_png', 'source': 'jpg', 'target': 'png', 'max_size': 1024 * 1024, 'max_files': 5, 'files': []}
+    bot.user_data[503] = user_info
+    
+    def album_item(message_id):
+        update = make_message(503, media_group_id='album')
+        update.message.message_id = message_id
+        file_info = {'file_id': f'p{message_id}', 'file_name': None, 'message_id': message_id}
+        return update, file_info
+    
+    async def run():
+        first_update, first_file = album_item(10)
+        await bot.queue_media_group_item(first_update, 503, user_info, first_file)
+        stale_timer = bot.media_groups[(503, 'album')]['timer']
+        
+        late_update, late_file = album_item(11)
+        await bot.queue_media_group_item(late_update, 503, user_info, late_file)
+        await asyncio.gather(stale_timer, return_exceptions=True)
+        
+        await asyncio.create_task(bot.flush_media_group((503, 'album'), 0))
+        assert (503, 'album') in bot.media_groups
+        
+        await bot.media_groups[(503, 'album')]['timer']
+        return first_update.message.replies
+    
+    replies = asyncio.run(run())
+    
+    assert [file_info['file_id'] for file_info in user_info['files']] == ['p10', 'p11']
+    assert (503, 'album') not in bot.media_groups
+    assert len(replies) == 1
+    assert 'Альбом добавлен: 2 из 2' in replies[0]
+
+def test_help_shows_effective_limits(bot, monkeypatch):
+    update = make_message(504)
+    asyncio.run(bot.help_command(update, None))
+    assert 'Максимальный размер: 20 МБ' in update.message.replies[0]
+    
+    monkeypatch.setitem(bot.config, 'local_bot_api_url', 'http://127.0.0.1:8081')
+    monkeypatch.setitem(bot.config, 'size_limits_mb', {'video_to_mp3': 700})
+    update = make_message(504)
+    asyncio.run(bot.help_command(update, None))
+    
+    assert '20 МБ' not in update.message.replies[0]
+    assert 'Максимальный размер: 2000 МБ' in update.message.replies[0]
+    assert 'Максимальный размер: 700–2000 МБ' in update.message.replies[0]
+    assert f"первых {bot.GIF_MAX_DURATION} секунд" in update.message.replies[0]
+
+def prefetch_user_info():
+    return {'type': 'jpg_to_png', 'source': 'jpg', 'target': 'png', 'targets': None, 'max_size': 10 * 1024 * 1024, 'max_files': 2, 'files': []}
+
+def fake_prefetch_conversion(bot, monkeypatch, work_dir, blocked=()):
+    monkeypatch.setattr(bot.delivery_queue, 'spool_dir', str(work_dir / 'outbox'))
+    
+    async def convert_file(user_info, file_info, idx, total_files, status_msg=None, user_id=None):
+        if file_info['file_id'] in blocked:
+            await asyncio.Event().wait()
+        return [{'bytes': b'png', 'filename': f"{file_info['file_id']}_converted.png", 'mime_type': 'image/png'}]
+    
+    monkeypatch.setattr(bot, 'convert_file', convert_file)
+
+def add_prefetched_file(bot, user_info, file_id):
+    file_info = {'file_id': file_id, 'file_name': f'{file_id}.jpg'}
+    user_info['files'].append(file_info)
+    bot.start_prefetch(701, 701, user_info, file_info)
+    return file_info
+
+async def wait_for_tasks(prefetches):
+    await asyncio.wait([prefetch['task'] for prefetch in prefetches], timeout=5)
+
+def test_claimed_prefetch_result_is_kept_on_disk(bot, monkeypatch, work_dir):
+    fake_prefetch_conversion(bot, monkeypatch, work_dir)
+    user_info = prefetch_user_info()
+    
+    async def run():
+        file_info = add_prefetched_file(bot, user_info, 'a')
+        prefetch = bot.claim_prefetch(user_info, file_info)
+        converted = await prefetch['task']
+        user_info.pop('prefetch_timer').cancel()
+        return converted
+    
+    converted = asyncio.run(run())
+    
+    assert len(converted) == 1
+    assert 'bytes' not in converted[0]
+    assert converted[0]['path'].startswith(bot.delivery_queue.spool_dir)
+    with open(converted[0]['path'], 'rb') as f:
+        assert f.read() == b'png'
+
+def test_prefetch_with_changed_settings_is_dropped(bot, monkeypatch, work_dir):
+    fake_prefetch_conversion(bot, monkeypatch, work_dir)
+    user_info = prefetch_user_info()
+    
+    async def run():
+        file_info = add_prefetched_file(bot, user_info, 'a')
+        await wait_for_tasks([file_info['prefetch']])
+        user_info['targets'] = ['png', 'webp']
+        claimed = bot.claim_prefetch(user_info, file_info)
+        user_info.pop('prefetch_timer').cancel()
+        return claimed
+    
+    assert asyncio.run(run()) is None
+    assert os.listdir(bot.delivery_queue.spool_dir) == []
+
+def test_expired_prefetch_is_cancelled_and_removed(bot, monkeypatch, work_dir):
+    fake_prefetch_conversion(bot, monkeypatch, work_dir, blocked=['b'])
+    monkeypatch.setitem(bot.config, 'prefetch_timeout', 0.2)
+    user_info = prefetch_user_info()
+    
+    async def run():
+        done_info = add_prefetched_file(bot, user_info, 'a')
+        blocked_info = add_prefetched_file(bot, user_info, 'b')
+        prefetches = [done_info['prefetch'], blocked_info['prefetch']]
+        await user_info['prefetch_timer']
+        await wait_for_tasks(prefetches)
+        return prefetches
+    
+    done, blocked = asyncio.run(run())
+    
+    assert not done['task'].cancelled()
+    assert blocked['task'].cancelled()
+    assert all('prefetch' not in file_info for file_info in user_info['files'])
+    assert os.listdir(bot.delivery_queue.spool_dir) == []
@@ -0,0 +1,49 @@
+from PIL import Image
+
+from file_converter import cli
+from file_converter.resources import CpuBudget
+
+def test_same_names_in_different_folders_do_not_collide(work_dir):
+    for folder, color in [('a', 'red'), ('b', 'blue')]:
+        (work_dir / 'photos' / folder).mkdir(parents=True)
+        Image.new('RGB', (8, 8), color).save(work_dir / 'photos' / folder / 'x.jpg')
+    
+    assert cli.main(['jpg_to_png', 'photos/**/*.jpg', '-o', 'out', '-j', '1']) == 0
+    
+    first = Image.open(work_dir / 'out' / 'a' / 'x_converted.png').convert('RGB').getpixel((0, 0))
+    second = Image.open(work_dir / 'out' / 'b' / 'x_converted.png').convert('RGB').getpixel((0, 0))
+    assert first[0] > 200 and second[2] > 200
+    assert not (work_dir / 'bot_config.json').exists()
+
+def test_single_directory_keeps_its_layout(work_dir):
+    (work_dir / 'photos' / 'sub').mkdir(parents=True)
+    Image.new('RGB', (8, 8)).save(work_dir / 'photos' / 'top.jpg')
+    Image.new('RGB', (8, 8)).save(work_dir / 'photos' / 'sub' / 'inner.jpg')
+    
+    inputs = cli.collect_inputs(['photos'], 'jpg')
+    
+    assert sorted(relative_dir for path, relative_dir in inputs) == ['.', 'sub']
+
+def test_limit_cores_lowers_max_jobs():
+    budget = CpuBudget(None, False)
+    budget.cores = list(range(16))
+    budget.max_jobs = 8
+    
+    budget.limit_cores(4)
+    
+    assert budget.cores == [0, 1, 2, 3]
+    assert budget.max_jobs == 2
+    assert budget.semaphore._value == 2
+
+def test_same_stem_in_one_folder_keeps_source_extension(work_dir):
+    (work_dir / 'photos').mkdir()
+    Image.new('RGB', (8, 8), 'red').save(work_dir / 'photos' / 'x.jpg')
+    Image.new('RGB', (8, 8), 'blue').save(work_dir / 'photos' / 'x.jpeg')
+    Image.new('RGB', (8, 8), 'green').save(work_dir / 'photos' / 'y.jpg')
+    
+    assert cli.main(['jpg_to_png', 'photos', '-o', 'out', '-j', '1']) == 0
+    
+    assert sorted(path.name for path in (work_dir / 'out').glob('*.png')) == ['x_jpeg_converted.png', 'x_jpg_converted.png', 'y_converted.png']
+    assert Image.open(work_dir / 'out' / 'x_jpg_converted.png').convert('RGB').getpixel((0, 0))[0] > 200
+    assert Image.open(work_dir / 'out' / 'x_jpeg_converted.png').convert('RGB').getpixel((0, 0))[2] > 200
+    assert len((work_dir / 'out' / cli.STATE_FILE).read_text(encoding='utf-8').splitlines()) == 3
@@ -0,0 +1,86 @@
+import io
+import asyncio
+import threading
+
+from PIL import Image
+
+from conftest import requires_ffmpeg
+from file_converter import convert
+
+def make_gif(frames=10, size=(64, 48)):
+    images = [Image.new('RGB', size, (index * 20, 100, 50)) for index in range(frames)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format='GIF', save_all=True, append_images=images[1:], duration=100, loop=0)
+    return buffer.getvalue()
+
+@requires_ffmpeg
+def test_gif_to_mp4_goes_through_video_branch():
+    converted_files = asyncio.run(convert('GIF_to_mp4', make_gif(), 'clip.gif'))
+    
+    assert [converted_file['filename'] for converted_file in converted_files] == ['clip_converted.mp4']
+    assert converted_files[0]['bytes'][4:8] == b'ftyp'
+
+@requires_ffmpeg
+def test_gif_to_mp4_target_size():
+    converted_files = asyncio.run(convert('GIF_to_mp4', make_gif(), 'clip.gif', target_size=512 * 1024))
+    
+    assert converted_files[0]['bytes'][4:8] == b'ftyp'
+    assert len(converted_files[0]['bytes']) <= 512 * 1024
+
+def test_image_target_size_runs_off_the_event_loop():
+    image = Image.effect_noise((1200, 900), 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    
+    async def run():
+        ticks = 0
+        
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+        
+        task = asyncio.create_task(ticker())
+        converted_files = await convert('png_to_jpg', buffer.getvalue(), 'noise.png', target_size=100 * 1024)
+        task.cancel()
+        return converted_files, ticks
+    
+    converted_files, ticks = asyncio.run(run())
+    assert len(converted_files[0]['bytes']) <= 100 * 1024
+    assert ticks > 1
+
+def test_document_conversion_runs_off_the_event_loop(monkeypatch):
+    from file_converter import documents
+    threads = []
+    extract = documents.extract_html_text_streaming
+    
+    def record(html_bytes):
+        threads.append(threading.current_thread())
+        return extract(html_bytes)
+    
+    monkeypatch.setattr(documents, 'extract_html_text_streaming', record)
+    converted_files = asyncio.run(convert('html_to_txt', b'<html><body><p>Hello</p><script>x()</script></body></html>', 'page.html'))
+    
+    assert converted_files[0]['bytes'] == b'Hello'
+    assert threads and threads[0] is not threading.main_thread()
+
+def test_multi_target_copies_image_in_workers(monkeypatch):
+    from file_converter import images
+    threads = []
+    copy = Image.Image.copy
+    
+    def record(image):
+        threads.append(threading.current_thread())
+        return copy(image)
+    
+    monkeypatch.setattr(Image.Image, 'copy', record)
+    image = Image.new('RGB', (64, 48), 'red')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    
+    results = asyncio.run(images.convert_image_multi(buffer.getvalue(), 'png', ['jpg', 'webp', 'GIF']))
+    
+    assert sorted(results) == ['GIF', 'jpg', 'webp']
+    assert len(threads) == 3
+    assert threading.main_thread() not in threads
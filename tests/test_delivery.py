@@ -0,0 +1,204 @@
+import os
+import asyncio
+import datetime
+import threading
+import subprocess
+import importlib.util
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from conftest import requires_ffmpeg
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def stand_in(work_dir):
+    spec = importlib.util.spec_from_file_location('fake_bot_api_server', os.path.join(ROOT, 'tools', 'fake_bot_api_server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    
+    files_dir = work_dir / 'files'
+    files_dir.mkdir()
+    handler = type('Handler', (module.BotApiHandler,), {'state': module.StandInState(str(files_dir))})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield SimpleNamespace(url=f'http://127.0.0.1:{server.server_address[1]}', files_dir=files_dir, state=handler.state)
+    server.shutdown()
+    server.server_close()
+
+def make_video(path):
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=2', '-f', 'lavfi', '-i', 'color=c=red:s=64x48:d=2',
+         '-shortest', '-c:v', 'libx264', '-c:a', 'aac', '-y', str(path)],
+        check=True
+    )
+
+def run_job(bot, monkeypatch, stand_in, user_info, local):
+    if local:
+        monkeypatch.setitem(bot.config, 'local_bot_api_url', stand_in.url)
+    else:
+        monkeypatch.setitem(bot.config, 'local_bot_api_url', '')
+    monkeypatch.setattr(bot.delivery_queue, 'spool_dir', str(stand_in.files_dir.parent / 'outbox'))
+    
+    async def run():
+        options = bot.bot_api_options() or {'base_url': f'{stand_in.url}/bot', 'base_file_url': f'{stand_in.url}/file/bot'}
+        telegram_bot = bot.Bot('123:abc', request=bot.build_request('api'), **options)
+        await telegram_bot.initialize()
+        monkeypatch.setattr(bot, 'application', SimpleNamespace(bot=telegram_bot, bot_data={}), raising=False)
+        monkeypatch.setattr(bot, 'transfer_bot', None)
+        try:
+            await bot.process_conversion(user_info, 601, 601, 1)
+        finally:
+            await telegram_bot.shutdown()
+    
+    asyncio.run(run())
+    return [sent for sent in stand_in.state.sent if sent['method'] not in ['sendMessage', 'editMessageText']]
+
+def audio_user_info(file_name):
+    return {'type': 'video_to_mp3', 'source': 'video', 'target': 'mp3', 'targets': None, 'max_size': 100 * 1024 * 1024, 'max_files': 1,
+            'files': [{'file_id': file_name, 'file_name': file_name}]}
+
+@requires_ffmpeg
+def test_local_mode_uploads_video_result_by_path(bot, monkeypatch, stand_in):
+    from file_converter import video
+    
+    def read_into_memory(*args):
+        raise AssertionError('результат не должен читаться в память')
+    
+    monkeypatch.setattr(video, 'read_output', read_into_memory)
+    monkeypatch.setattr(bot, 'read_input_file', read_into_memory)
+    make_video(stand_in.files_dir / 'clip.mp4')
+    
+    sent = run_job(bot, monkeypatch, stand_in, audio_user_info('clip.mp4'), local=True)
+    
+    assert [item['method'] for item in sent] == ['sendAudio']
+    assert sent[0]['uploads'] == []
+    assert len(sent[0]['files']) == 1
+    assert sent[0]['files'][0].startswith(bot.delivery_queue.spool_dir)
+    assert sent[0]['files'][0].endswith('clip_converted.mp3')
+    assert os.listdir(bot.delivery_queue.spool_dir) == []
+
+@requires_ffmpeg
+def test_remote_mode_uploads_video_result_as_multipart(bot, monkeypatch, stand_in):
+    make_video(stand_in.files_dir / 'clip.mp4')
+    
+    sent = run_job(bot, monkeypatch, stand_in, audio_user_info('clip.mp4'), local=False)
+    
+    assert [item['method'] for item in sent] == ['sendAudio']
+    assert sent[0]['files'] == []
+    assert len(sent[0]['uploads']) == 1
+    assert os.listdir(bot.delivery_queue.spool_dir) == []
+
+def make_queue(bot, monkeypatch, work_dir):
+    monkeypatch.setitem(bot.config, 'delivery_spool_dir', str(work_dir / 'outbox'))
+    monkeypatch.setitem(bot.config, 'local_bot_api_url', 'http://stand-in')
+    monkeypatch.setitem(bot.config, 'delivery_backoff_base', 0)
+    return bot.DeliveryQueue()
+
+def record_sends(bot, monkeypatch, failures=(), album_failures=()):
+    failures = list(failures)
+    album_failures = list(album_failures)
+    sent = []
+    
+    async def send_file(chat_id, converted_file, conv_type):
+        sent.append([converted_file['filename']])
+        if failures:
+            raise failures.pop(0)
+    
+    async def send_album(chat_id, batch, conv_type):
+        sent.append([converted_file['filename'] for converted_file in batch])
+        if album_failures:
+            raise album_failures.pop(0)
+    
+    monkeypatch.setattr(bot, 'send_converted_file', send_file)
+    monkeypatch.setattr(bot, 'send_converted_album', send_album)
+    return sent
+
+def text_results(*names):
+    return [{'bytes': name.encode(), 'filename': name, 'mime_type': 'text/plain'} for name in names]
+
+def submit(queue, batch):
+    async def run():
+        return await (await queue.submit(601, batch, 'txt_to_docx'))
+    
+    return asyncio.run(run())
+
+def test_token_bucket_allows_burst_then_delays(monkeypatch, bot):
+    now = [100.0]
+    monkeypatch.setattr(bot.time, 'monotonic', lambda: now[0])
+    bucket = bot.TokenBucket(2, 2)
+    
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve(2) == pytest.approx(1.5)
+    now[0] += 1.5
+    assert bucket.reserve() == pytest.approx(0.5)
+
+def test_delivery_retries_after_retry_after_and_network_errors(bot, monkeypatch, work_dir):
+    queue = make_queue(bot, monkeypatch, work_dir)
+    sent = record_sends(bot, monkeypatch, failures=[bot.RetryAfter(datetime.timedelta(0)), bot.NetworkError('сеть')])
+    
+    assert submit(queue, text_results('a.txt')) == 1
+    assert sent == [['a.txt'], ['a.txt'], ['a.txt']]
+    assert os.listdir(queue.spool_dir) == []
+
+def test_delivery_gives_up_after_max_attempts(bot, monkeypatch, work_dir):
+    queue = make_queue(bot, monkeypatch, work_dir)
+    monkeypatch.setitem(bot.config, 'delivery_max_attempts', 2)
+    sent = record_sends(bot, monkeypatch, failures=[bot.NetworkError('сеть')] * 3)
+    
+    with pytest.raises(Exception, match='2 попыток'):
+        submit(queue, text_results('a.txt'))
+    assert len(sent) == 2
+    assert os.listdir(queue.spool_dir) == []
+
+def test_read_timeout_after_upload_is_not_resent(bot, monkeypatch, work_dir):
+    import httpx
+    
+    queue = make_queue(bot, monkeypatch, work_dir)
+    timed_out = bot.TimedOut()
+    timed_out.__cause__ = httpx.ReadTimeout('read')
+    sent = record_sends(bot, monkeypatch, album_failures=[timed_out])
+    
+    assert submit(queue, text_results('a.txt', 'b.txt')) == 2
+    assert sent == [['a.txt', 'b.txt']]
+
+def test_connect_timeout_is_retried(bot, monkeypatch, work_dir):
+    import httpx
+    
+    queue = make_queue(bot, monkeypatch, work_dir)
+    timed_out = bot.TimedOut()
+    timed_out.__cause__ = httpx.ConnectTimeout('connect')
+    sent = record_sends(bot, monkeypatch, failures=[timed_out])
+    
+    assert submit(queue, text_results('a.txt')) == 1
+    assert sent == [['a.txt'], ['a.txt']]
+
+def test_failed_album_falls_back_to_single_files(bot, monkeypatch, work_dir):
+    queue = make_queue(bot, monkeypatch, work_dir)
+    sent = record_sends(bot, monkeypatch, failures=[bot.BadRequest('слишком большой')], album_failures=[bot.BadRequest('альбом')])
+    
+    assert submit(queue, text_results('a.txt', 'b.txt', 'c.txt')) == 2
+    assert sent == [['a.txt', 'b.txt', 'c.txt'], ['a.txt'], ['b.txt'], ['c.txt']]
+
+def test_resume_sends_only_undelivered_items(bot, monkeypatch, work_dir):
+    queue = make_queue(bot, monkeypatch, work_dir)
+    delivery = queue.spool(601, text_results('a.txt', 'b.txt'), 'txt_to_docx')
+    delivery['items'][0]['delivered'] = True
+    queue.save_manifest(delivery)
+    os.makedirs(os.path.join(queue.spool_dir, 'result_stale'))
+    sent = record_sends(bot, monkeypatch)
+    
+    async def run():
+        resumed = bot.DeliveryQueue()
+        resumed.resume()
+        assert resumed.pending() == 1
+        return await resumed.queues[601][0]['future']
+    
+    assert asyncio.run(run()) == 2
+    assert sent == [['b.txt']]
+    assert os.listdir(queue.spool_dir) == []
@@ -0,0 +1,55 @@
+import io
+import asyncio
+import zipfile
+import xml.etree.ElementTree as ET
+
+from docx import Document
+
+from file_converter.documents import convert_html_to_docx
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def html_to_docx(html):
+    return asyncio.run(convert_html_to_docx(f'<html><body>{html}</body></html>'.encode('utf-8')))
+
+def document_body(docx_bytes):
+    with zipfile.ZipFile(io.BytesIO(docx_bytes)) as docx_zip:
+        return ET.fromstring(docx_zip.read('word/document.xml')).find(W + 'body')
+
+def assert_tables_well_formed(body):
+    for table in body.iter(W + 'tbl'):
+        rows = table.findall(W + 'tr')
+        assert rows
+        for row in rows:
+            cells = row.findall(W + 'tc')
+            assert cells
+            for cell in cells:
+                assert cell.findall(W + 'p') or cell.findall(W + 'tbl')
+                assert list(cell)[-1].tag == W + 'p'
+
+def test_empty_table_is_dropped():
+    docx_bytes = html_to_docx('<p>до</p><table></table><p>после</p>')
+    body = document_body(docx_bytes)
+    
+    assert not list(body.iter(W + 'tbl'))
+    assert [paragraph.text for paragraph in Document(io.BytesIO(docx_bytes)).paragraphs][-2:] == ['до', 'после']
+
+def test_empty_row_is_dropped():
+    docx_bytes = html_to_docx('<table><tr></tr><tr><td>a</td><td>b</td></tr><tr></tr></table>')
+    body = document_body(docx_bytes)
+    assert_tables_well_formed(body)
+    
+    table = Document(io.BytesIO(docx_bytes)).tables[0]
+    assert [[cell.text for cell in row.cells] for row in table.rows] == [['a', 'b']]
+
+def test_ragged_and_nested_tables():
+    docx_bytes = html_to_docx(
+        '<table><tr><td>1</td></tr><tr><td>2</td><td>3</td><td>4</td></tr>'
+        '<tr><td><table><tr></tr></table></td><td><table><tr><td>x</td></tr></table></td></tr></table>'
+    )
+    body = document_body(docx_bytes)
+    assert_tables_well_formed(body)
+    
+    rows = body.find(W + 'tbl').findall(W + 'tr')
+    assert [len(row.findall(W + 'tc')) for row in rows] == [1, 3, 2]
+    assert len(list(body.iter(W + 'tbl'))) == 2
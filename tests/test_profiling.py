@@ -0,0 +1,31 @@
+import threading
+
+from file_converter.config import config
+from file_converter.profiling import ProfilerControl
+
+def test_only_one_call_is_profiled_at_a_time(work_dir, monkeypatch):
+    monkeypatch.setitem(config, 'profile_dir', str(work_dir / 'profiles'))
+    profiler = ProfilerControl()
+    profiler.start()
+    
+    inside = threading.Event()
+    release = threading.Event()
+    
+    def slow():
+        inside.set()
+        release.wait(5)
+        return 'slow'
+    
+    results = []
+    thread = threading.Thread(target=lambda: results.append(profiler.wrap(slow)()))
+    thread.start()
+    inside.wait(5)
+    results.append(profiler.wrap(lambda: 'fast')())
+    release.set()
+    thread.join()
+    
+    result = profiler.stop()
+    assert sorted(results) == ['fast', 'slow']
+    assert result['calls'] == 1
+    assert result['skipped'] == 1
+    assert 'slow' in result['report']
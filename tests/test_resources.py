@@ -0,0 +1,87 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from file_converter.config import config
+from file_converter.resources import QualityPolicy, ScratchSpace
+
+def make_scratch(path, quota):
+    scratch = ScratchSpace()
+    scratch.roots = [{'path': str(path), 'quota': quota, 'max_job': None, 'reserved': 0}]
+    return scratch
+
+def test_sweep_only_removes_own_job_dirs(work_dir):
+    scratch = make_scratch(work_dir, 1024 * 1024 * 1024)
+    dead_job = work_dir / 'converter_job_999999999_abc'
+    dead_job.mkdir()
+    foreign_dir = work_dir / 'segments_other'
+    foreign_dir.mkdir()
+    foreign_file = work_dir / 'tmpabc.gif.part'
+    foreign_file.write_bytes(b'data')
+    os.utime(foreign_file, (0, 0))
+    
+    assert scratch.sweep() == 1
+    assert not dead_job.exists()
+    assert foreign_dir.exists()
+    assert foreign_file.exists()
+
+def test_check_usage_enforces_quota(work_dir):
+    scratch = make_scratch(work_dir, 80 * 1024 * 1024)
+    job_dir = scratch.create_job_dir(0)
+    
+    with open(os.path.join(job_dir, 'small.bin'), 'wb') as f:
+        f.truncate(1024)
+    scratch.check_usage(job_dir)
+    
+    with open(os.path.join(job_dir, 'output.bin'), 'wb') as f:
+        f.truncate(100 * 1024 * 1024)
+    with pytest.raises(Exception, match='Недостаточно места'):
+        scratch.check_usage(job_dir)
+    
+    scratch.remove_job_dir(job_dir)
+    assert scratch.roots[0]['reserved'] == 0
+
+def make_policy():
+    budget = SimpleNamespace(active_jobs=0, waiting_jobs=0, max_jobs=2)
+    memory = SimpleNamespace(waiters=[])
+    pool = SimpleNamespace(in_flight=0, workers=4)
+    return QualityPolicy(budget, memory, pool), budget, memory, pool
+
+def test_quality_tier_follows_conversion_pool_backlog(monkeypatch):
+    monkeypatch.setitem(config, 'quality_tier_min_seconds', 0)
+    policy, budget, memory, pool = make_policy()
+    
+    pool.in_flight = 6
+    assert policy.update()['name'] == 'reduced'
+    pool.in_flight = 10
+    assert policy.update()['name'] == 'fast'
+    
+    pool.in_flight = 8
+    assert policy.update()['name'] == 'fast'
+    pool.in_flight = 6
+    assert policy.update()['name'] == 'reduced'
+    pool.in_flight = 4
+    assert policy.update()['name'] == 'reduced'
+    pool.in_flight = 3
+    assert policy.update()['name'] == 'normal'
+
+def test_quality_tier_counts_memory_waiters(monkeypatch):
+    monkeypatch.setitem(config, 'quality_tier_min_seconds', 0)
+    policy, budget, memory, pool = make_policy()
+    
+    budget.active_jobs = 2
+    assert policy.update()['name'] == 'normal'
+    memory.waiters = [{}, {}, {}]
+    assert policy.update()['name'] == 'fast'
+
+def test_quality_tier_holds_for_min_seconds(monkeypatch):
+    monkeypatch.setitem(config, 'quality_tier_min_seconds', 3600)
+    policy, budget, memory, pool = make_policy()
+    
+    pool.in_flight = 6
+    assert policy.update()['name'] == 'reduced'
+    pool.in_flight = 0
+    assert policy.update()['name'] == 'reduced'
+    pool.in_flight = 10
+    assert policy.update()['name'] == 'fast'
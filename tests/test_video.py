@@ -0,0 +1,39 @@
+import re
+import asyncio
+import subprocess
+
+from conftest import requires_ffmpeg
+from file_converter import convert, video
+
+def count_frames(path):
+    result = subprocess.run(['ffmpeg', '-i', path, '-map', '0:v', '-f', 'framecrc', '-'], capture_output=True, text=True)
+    frames = len([line for line in result.stdout.splitlines() if line and not line.startswith('#')])
+    hours, minutes, seconds = re.search(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr).groups()
+    return frames, int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+@requires_ffmpeg
+def test_segmented_encode_matches_single_encode(work_dir):
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=duration=25:size=64x48:rate=10', '-y', 'input.gif'], check=True)
+    
+    async def run():
+        ffmpeg_path = await video.find_ffmpeg_cached()
+        await video.run_ffmpeg_command([ffmpeg_path, '-i', 'input.gif'] + video.gif_to_mp4_encode_args() + ['-y', 'single.mp4'])
+        for segment_count in [2, 3, 4]:
+            await video.convert_GIF_to_mp4_segmented(ffmpeg_path, 'input.gif', f'segmented_{segment_count}.mp4', 25.0, segment_count)
+    
+    asyncio.run(run())
+    
+    assert count_frames('single.mp4') == (250, 25.0)
+    for segment_count in [2, 3, 4]:
+        assert count_frames(f'segmented_{segment_count}.mp4') == count_frames('single.mp4')
+
+@requires_ffmpeg
+def test_long_video_to_gif_is_trimmed(work_dir):
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=duration=40:size=64x48:rate=5', '-y', 'long.mp4'], check=True)
+    
+    converted_files = asyncio.run(convert('mp4_to_GIF', input_path='long.mp4'))
+    with open('long.gif', 'wb') as f:
+        f.write(converted_files[0]['bytes'])
+    
+    _, duration = count_frames('long.gif')
+    assert duration <= video.GIF_MAX_DURATION + 0.5
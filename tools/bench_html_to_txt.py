@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_converter import documents
+
+WORDS = ['конвертер', 'файл', 'страница', 'документ', 'текст', 'изображение', 'видео', 'данные', 'пример', 'бот', 'Telegram', 'HTML']
+
+def make_page(paragraphs, charset):
+    rng = random.Random(42)
+    parts = [
+        f'<html><head><meta charset="{charset}"><title>Тестовая страница</title>',
+        '<style>body { font-family: sans-serif; } .x { color: red; }</style></head><body>'
+    ]
+    for i in range(paragraphs):
+        text = ' '.join(rng.choice(WORDS) for _ in range(20))
+        if i % 50 == 0:
+            parts.append(f'<script>var data{i} = "{text}"; function f{i}() {{ return data{i}.length; }}</script>')
+        if i % 20 == 0:
+            parts.append(f'<h2>Раздел {i}</h2><table><tr><td>{text[:30]}</td><td>{i}</td></tr></table>')
+        parts.append(f'<div class="x"><p>{text} <a href="/page{i}">ссылка</a> &amp; &laquo;цитата&raquo;</p></div>\n')
+    parts.append('</body></html>')
+    return ''.join(parts).encode(charset)
+
+def measure(func, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(data)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение движков HTML → TXT')
+    parser.add_argument('--paragraphs', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--charset', default='windows-1251')
+    args = parser.parse_args()
+    
+    data = make_page(args.paragraphs, args.charset)
+    print(f"Размер страницы: {len(data) / (1024 * 1024):.2f} МБ, кодировка {args.charset}")
+    
+    bs4_time = measure(documents.convert_html_to_txt_bs4, data, args.repeat)
+    fast_time = measure(documents.convert_html_to_txt_sync, data, args.repeat)
+    
+    print(f"BeautifulSoup: {bs4_time:.3f} сек ({len(data) / bs4_time / (1024 * 1024):.1f} МБ/с)")
+    print(f"Потоковый парсер: {fast_time:.3f} сек ({len(data) / fast_time / (1024 * 1024):.1f} МБ/с)")
+    print(f"Ускорение: x{bs4_time / fast_time:.2f}")
+
+if __name__ == '__main__':
+    sys.exit(main())
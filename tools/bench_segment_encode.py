@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_converter import video
+
+async def make_gif(ffmpeg_path, path, duration, size):
+    await video.run_ffmpeg_command([
+        ffmpeg_path,
+        '-f', 'lavfi',
+        '-i', f'testsrc2=duration={duration}:size={size}:rate=15',
+        '-y',
+        path
+    ], timeout=600)
+
+async def encode_single(ffmpeg_path, input_path, output_path, threads):
+    cmd = [ffmpeg_path, '-i', input_path] + video.gif_to_mp4_encode_args()
+    if threads:
+        cmd += ['-threads', str(threads)]
+    await video.run_ffmpeg_command(cmd + ['-movflags', 'faststart', '-y', output_path], timeout=600)
+
+async def encode_segmented(ffmpeg_path, input_path, output_path, duration, segments):
+    await video.convert_GIF_to_mp4_segmented(ffmpeg_path, input_path, output_path, duration, segments)
+
+def measure(coro_factory, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        asyncio.run(coro_factory())
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение кодирования GIF → MP4 целиком и по сегментам')
+    parser.add_argument('--durations', default='10,20,40,80')
+    parser.add_argument('--size', default='640x480')
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--max-segments', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    
+    ffmpeg_path = asyncio.run(video.find_ffmpeg_cached())
+    if not ffmpeg_path:
+        print("FFmpeg не найден")
+        return 1
+    
+    cpu_count = os.cpu_count() or 1
+    print(f"Ядер CPU: {cpu_count}, разрешение {args.size}")
+    
+    work_dir = tempfile.mkdtemp(prefix='bench_segments_')
+    try:
+        for duration in [float(value) for value in args.durations.split(',')]:
+            input_path = os.path.join(work_dir, 'input.gif')
+            output_path = os.path.join(work_dir, 'output.mp4')
+            asyncio.run(make_gif(ffmpeg_path, input_path, duration, args.size))
+            print(f"\nДлительность {duration:.0f} сек, GIF {os.path.getsize(input_path) / (1024 * 1024):.1f} МБ")
+            
+            results = []
+            for threads in sorted({1, cpu_count, 0}):
+                label = f"целиком, -threads {threads}" if threads else "целиком, -threads auto"
+                elapsed = measure(lambda: encode_single(ffmpeg_path, input_path, output_path, threads), args.repeat)
+                results.append((label, elapsed, os.path.getsize(output_path)))
+            
+            for segments in range(2, args.max_segments + 1):
+                elapsed = measure(lambda: encode_segmented(ffmpeg_path, input_path, output_path, duration, segments), args.repeat)
+                results.append((f"{segments} сегмента(ов)", elapsed, os.path.getsize(output_path)))
+            
+            baseline = min(elapsed for label, elapsed, _ in results if label.startswith('целиком'))
+            for label, elapsed, size in results:
+                print(f"  {label:28} {elapsed:7.2f} сек  x{baseline / elapsed:.2f}  {size / 1024:.0f} КБ")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
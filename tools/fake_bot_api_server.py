@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.parse
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_INFO = {
+    'id': 100000001,
+    'is_bot': True,
+    'first_name': 'Local Bot API',
+    'username': 'local_bot_api_bot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False
+}
+
+SEND_METHODS = {
+    'sendDocument': 'document',
+    'sendPhoto': 'photo',
+    'sendVideo': 'video',
+    'sendAudio': 'audio',
+    'sendAnimation': 'animation'
+}
+
+class StandInState:
+    def __init__(self, files_dir):
+        self.files_dir = os.path.abspath(files_dir)
+        self.lock = threading.Lock()
+        self.updates = []
+        self.sent = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+    
+    def message(self, chat_id, **fields):
+        with self.lock:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private' if int(chat_id) > 0 else 'group'}
+        }
+        message.update(fields)
+        return message
+    
+    def add_update(self, update):
+        with self.lock:
+            update.setdefault('update_id', self.next_update_id)
+            self.next_update_id = update['update_id'] + 1
+            self.updates.append(update)
+    
+    def take_updates(self, offset):
+        with self.lock:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            return list(self.updates)
+    
+    def record(self, method, params, local_paths, uploads):
+        with self.lock:
+            self.sent.append({'method': method, 'params': params, 'files': local_paths, 'uploads': uploads})
+
+def parse_params(handler):
+    length = int(handler.headers.get('Content-Length') or 0)
+    body = handler.rfile.read(length) if length else b''
+    content_type = handler.headers.get('Content-Type', '')
+    params = {}
+    uploads = []
+    
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename() is not None:
+                uploads.append(name)
+                params[name] = f'<upload {part.get_filename()}>'
+            else:
+                params[name] = part.get_content()
+    elif content_type.startswith('application/json'):
+        params = json.loads(body or b'{}')
+    else:
+        params = dict(urllib.parse.parse_qsl(body.decode('utf-8')))
+    
+    for key, value in list(params.items()):
+        if isinstance(value, str):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                pass
+    return params, uploads
+
+def local_paths(params):
+    paths = []
+    values = list(params.values())
+    while values:
+        value = values.pop()
+        if isinstance(value, list):
+            values.extend(value)
+        elif isinstance(value, dict):
+            values.extend(value.values())
+        elif isinstance(value, str) and value.startswith('file://'):
+            paths.append(urllib.parse.unquote(urllib.parse.urlparse(value).path))
+    return paths
+
+class BotApiHandler(BaseHTTPRequestHandler):
+    state = None
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def reply(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def ok(self, result):
+        self.reply(200, {'ok': True, 'result': result})
+    
+    def error(self, status, description):
+        self.reply(status, {'ok': False, 'error_code': status, 'description': description})
+    
+    def do_GET(self):
+        if self.path == '/stand-in/sent':
+            with self.state.lock:
+                self.ok(self.state.sent)
+            return
+        if self.path.startswith('/file/bot'):
+            path = os.path.join(self.state.files_dir, os.path.basename(urllib.parse.unquote(self.path)))
+            if not os.path.isfile(path):
+                self.error(404, 'Not Found')
+                return
+            with open(path, 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.handle_api({})
+    
+    def do_POST(self):
+        if self.path == '/stand-in/updates':
+            params, _ = parse_params(self)
+            self.state.add_update(params)
+            self.ok(True)
+            return
+        params, uploads = parse_params(self)
+        self.handle_api(params, uploads)
+    
+    def handle_api(self, params, uploads=()):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            self.error(404, 'Not Found')
+            return
+        
+        method = parts[1]
+        if method == 'getMe':
+            self.ok(BOT_INFO)
+        elif method in ['deleteWebhook', 'setMyCommands', 'logOut', 'close', 'answerCallbackQuery', 'deleteMessage']:
+            self.ok(True)
+        elif method == 'getUpdates':
+            deadline = time.monotonic() + min(float(params.get('timeout') or 0), 1.0)
+            updates = self.state.take_updates(int(params.get('offset') or 0))
+            while not updates and time.monotonic() < deadline:
+                time.sleep(0.05)
+                updates = self.state.take_updates(int(params.get('offset') or 0))
+            self.ok(updates)
+        elif method == 'getFile':
+            path = os.path.join(self.state.files_dir, os.path.basename(str(params.get('file_id'))))
+            if not os.path.isfile(path):
+                self.error(400, 'Bad Request: invalid file_id')
+                return
+            self.ok({
+                'file_id': params['file_id'],
+                'file_unique_id': params['file_id'],
+                'file_size': os.path.getsize(path),
+                'file_path': path
+            })
+        elif method in ['sendMessage', 'editMessageText']:
+            self.ok(self.state.message(params.get('chat_id', 1), text=params.get('text', '')))
+        elif method in SEND_METHODS or method == 'sendMediaGroup':
+            paths = local_paths(params)
+            missing = [path for path in paths if not os.path.isfile(path)]
+            if missing:
+                self.error(400, f'Bad Request: file not found: {missing[0]}')
+                return
+            self.state.record(method, params, paths, list(uploads))
+            print(f"{method} chat={params.get('chat_id')} local={paths} uploads={list(uploads)}", flush=True)
+            if method == 'sendMediaGroup':
+                self.ok([self.state.message(params['chat_id']) for _ in params.get('media', [])])
+            else:
+                self.ok(self.state.message(params['chat_id']))
+        else:
+            self.ok(True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка локального сервера Bot API (--local) для проверки бота без Telegram')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--files-dir', default='.', help='каталог, файлы которого отдаются через getFile по имени как file_id')
+    args = parser.parse_args()
+    
+    BotApiHandler.state = StandInState(args.files_dir)
+    server = ThreadingHTTPServer((args.host, args.port), BotApiHandler)
+    print(f"Bot API: http://{args.host}:{args.port}, файлы из {BotApiHandler.state.files_dir}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
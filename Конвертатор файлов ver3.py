@@ -1,21 +1,39 @@
 import os
 import sys
+import glob
 import json
 import time
+import threading
+import traceback
+import tracemalloc
 import logging
+import inspect
+import pathlib
 import tempfile
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from PIL import Image, ImageSequence
-import io
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from bs4 import BeautifulSoup
-import subprocess
+import uuid
+import zipfile
+import httpx
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, InputMediaPhoto, InputMediaVideo, InputMediaAudio, InputMediaDocument
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
+from telegram.error import BadRequest, RetryAfter, NetworkError, TimedOut
+from collections import deque
 import shutil
 
+from file_converter.config import config
+from file_converter.metrics import Counter, Gauge, Histogram, METRICS_SIZE_BUCKETS, render_metrics
+from file_converter.tracing import JobTrace, current_span_id, current_trace, setup_trace_logs, trace_span
+from file_converter.profiling import memory_snapshots, profiler, take_memory_snapshot
+from file_converter.resources import memory_budget, scratch_space
+from file_converter.formats import SOURCE_EXTENSIONS, read_file_header
+from file_converter.video import GIF_MAX_DURATION, find_ffmpeg_cached
+from file_converter.conversion import (
+    MULTI_TARGET_OPTIONS, PHOTO_DELIVERY_MAX_SIDE, convert_input, photo_delivery_side,
+    supports_send_as_file, supports_target_size
+)
+from file_converter.archives import ArchiveWriter, archive_members, read_archive_member
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -24,102 +42,118 @@ logger = logging.getLogger(__name__)
 
 user_data = {}
 processing_files = {}
-ffmpeg_cache = None
-config_file = "bot_config.json"
+
 privacy_accepted = {}
+multi_selection = {}
+active_jobs = {}
+media_groups = {}
 
 user_data_lock = asyncio.Lock()
 processing_files_lock = asyncio.Lock()
+active_jobs_lock = asyncio.Lock()
+media_groups_lock = asyncio.Lock()
 
-def load_config():
-    if os.path.exists(config_file):
-        with open(config_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-def save_config(config):
-    with open(config_file, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=2)
-
-config = load_config()
-
-def find_ffmpeg_cached():
-    global ffmpeg_cache
-    if ffmpeg_cache and os.path.exists(ffmpeg_cache):
-        return ffmpeg_cache
-    
-    if 'ffmpeg_path' in config and os.path.exists(config['ffmpeg_path']):
-        ffmpeg_cache = config['ffmpeg_path']
-        return ffmpeg_cache
-    
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    local_ffmpeg = os.path.join(current_dir, "ffmpeg.exe")
-    
-    if os.path.exists(local_ffmpeg):
-        config['ffmpeg_path'] = local_ffmpeg
-        save_config(config)
-        ffmpeg_cache = local_ffmpeg
-        return local_ffmpeg
-    
-    ffmpeg_in_path = shutil.which('ffmpeg')
-    if ffmpeg_in_path:
-        config['ffmpeg_path'] = ffmpeg_in_path
-        save_config(config)
-        ffmpeg_cache = ffmpeg_in_path
-        return ffmpeg_in_path
-    
-    common_paths = ['ffmpeg.exe', 'ffmpeg', r'.\ffmpeg.exe']
-    for path in common_paths:
-        try:
-            creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-            result = subprocess.run(
-                [path, '-version'],
-                capture_output=True,
-                text=True,
-                creationflags=creation_flags,
-                timeout=3
-            )
-            if result.returncode == 0:
-                config['ffmpeg_path'] = path
-                save_config(config)
-                ffmpeg_cache = path
-                return path
-        except:
-            continue
-    
-    return None
+TARGET_SIZE_OPTIONS_MB = [1, 2, 5, 8, 10]
 
-def detect_file_type(file_bytes, filename):
-    filename_lower = filename.lower()
-    
-    if filename_lower.endswith('.gif'):
-        return 'GIF'
-    elif filename_lower.endswith(('.mp4', '.mov', '.avi', '.mkv', '.webm')):
-        return 'video'
-    elif filename_lower.endswith(('.jpg', '.jpeg')):
-        return 'jpg'
-    elif filename_lower.endswith('.png'):
-        return 'png'
-    elif filename_lower.endswith('.webp'):
-        return 'webp'
-    elif filename_lower.endswith('.txt'):
-        return 'txt'
-    elif filename_lower.endswith(('.docx', '.doc')):
-        return 'docx'
-    elif filename_lower.endswith(('.html', '.htm')):
-        return 'html'
-    
-    if len(file_bytes) >= 6:
-        if file_bytes[:6] in [b'GIF87a', b'GIF89a']:
-            return 'GIF'
-        elif file_bytes[:8] == b'\x89PNG\r\n\x1a\n':
-            return 'png'
-        elif file_bytes[:2] == b'\xff\xd8':
-            return 'jpg'
-        elif len(file_bytes) >= 12 and file_bytes[:4] == b'RIFF' and file_bytes[8:12] == b'WEBP':
-            return 'webp'
-    
-    return 'unknown'
+METRICS_PORT = 9108
+
+TRACEMALLOC_FRAMES = 25
+LOOP_LAG_INTERVAL = 0.1
+LOOP_LAG_THRESHOLD_MS = 250
+PREFETCH_TIMEOUT = 600
+MEDIA_GROUP_DEBOUNCE = 1.0
+MEDIA_GROUP_MAX_ITEMS = 10
+MAX_CONCURRENT_UPDATES = 256
+
+HTTP_POOLS = {
+    'updates': {
+        'connection_pool_size': 1,
+        'read_timeout': 5.0,
+        'write_timeout': 5.0,
+        'connect_timeout': 5.0,
+        'pool_timeout': 1.0
+    },
+    'api': {
+        'connection_pool_size': 64,
+        'read_timeout': 10.0,
+        'write_timeout': 10.0,
+        'connect_timeout': 5.0,
+        'pool_timeout': 5.0
+    },
+    'transfer': {
+        'connection_pool_size': 16,
+        'read_timeout': 300.0,
+        'write_timeout': 300.0,
+        'media_write_timeout': 300.0,
+        'connect_timeout': 10.0,
+        'pool_timeout': 60.0
+    }
+}
+DELIVERY_GLOBAL_RATE = 25
+DELIVERY_GLOBAL_BURST = 30
+DELIVERY_CHAT_RATE = 1.0
+DELIVERY_CHAT_BURST = 10
+DELIVERY_GROUP_RATE = 20 / 60
+DELIVERY_GROUP_BURST = 5
+DELIVERY_MAX_ATTEMPTS = 6
+DELIVERY_BACKOFF_BASE = 1.0
+DELIVERY_BACKOFF_MAX = 30.0
+DELIVERY_SPOOL_MAX_AGE = 24 * 3600
+LOCAL_BOT_API_MAX_MB = 2000
+
+ARCHIVE_MAX_MB = 20
+
+ARCHIVE_PART_MB = 48
+
+CONVERSION_MENU = {
+    'jpg_to_png': ('jpg', 'png', 20, '🖼️', 5),
+    'jpg_to_webp': ('jpg', 'webp', 20, '🖼️', 5),
+    'jpg_to_GIF': ('jpg', 'GIF', 20, '🖼️', 5),
+    'png_to_jpg': ('png', 'jpg', 20, '🖼️', 5),
+    'png_to_webp': ('png', 'webp', 20, '🖼️', 5),
+    'png_to_GIF': ('png', 'GIF', 20, '🖼️', 5),
+    'webp_to_jpg': ('webp', 'jpg', 20, '🖼️', 5),
+    'webp_to_png': ('webp', 'png', 20, '🖼️', 5),
+    'webp_to_GIF': ('webp', 'GIF', 20, '🖼️', 5),
+    'GIF_to_jpg': ('GIF', 'jpg', 20, '🖼️', 5),
+    'GIF_to_png': ('GIF', 'png', 20, '🖼️', 5),
+    'GIF_to_webp': ('GIF', 'webp', 20, '🖼️', 5),
+    
+    'txt_to_docx': ('txt', 'docx', 10, '📝', 3),
+    'docx_to_txt': ('docx', 'txt', 10, '📝', 3),
+    'html_to_txt': ('html', 'txt', 10, '🌐', 3),
+    'html_to_docx': ('html', 'docx', 10, '🌐', 3),
+    
+    'GIF_to_mp4': ('GIF', 'mp4', 50, '🎬', 1),
+    'mp4_to_GIF': ('video', 'GIF', 50, '🎬', 1),
+    'video_to_mp3': ('video', 'mp3', 50, '🎵', 1),
+    'video_to_wav': ('video', 'wav', 50, '🎵', 1),
+    'video_to_flac': ('video', 'flac', 50, '🎵', 1),
+}
+
+IMAGE_CONVERSIONS = [f'{source}_to_{target}' for source in ['jpg', 'png', 'webp', 'GIF'] for target in ['jpg', 'png', 'webp', 'GIF'] if source != target]
+TEXT_CONVERSIONS = ['txt_to_docx', 'docx_to_txt']
+HTML_CONVERSIONS = ['html_to_txt', 'html_to_docx']
+VIDEO_CONVERSIONS = ['GIF_to_mp4', 'mp4_to_GIF']
+AUDIO_CONVERSIONS = ['video_to_mp3', 'video_to_wav', 'video_to_flac']
+
+download_seconds = Histogram('converter_download_seconds', 'Время скачивания файла из Telegram', ['conv_type'])
+convert_seconds = Histogram('converter_convert_seconds', 'Время конвертации одного файла', ['conv_type'])
+upload_seconds = Histogram('converter_upload_seconds', 'Время отправки результата в Telegram', ['conv_type', 'method'])
+
+input_bytes = Histogram('converter_input_bytes', 'Размер входных файлов', ['conv_type'], METRICS_SIZE_BUCKETS)
+bytes_in_total = Counter('converter_bytes_in_total', 'Скачано байт', ['conv_type'])
+bytes_out_total = Counter('converter_bytes_out_total', 'Отправлено байт', ['conv_type'])
+files_total = Counter('converter_files_total', 'Обработанные файлы по результату', ['conv_type', 'status'])
+
+telegram_requests_total = Counter('converter_telegram_requests_total', 'Запросы к Telegram Bot API', ['pool', 'method', 'status'])
+telegram_request_seconds = Histogram('converter_telegram_request_seconds', 'Время запроса к Telegram Bot API', ['pool', 'method'])
+telegram_rate_limited_total = Counter('converter_telegram_rate_limited_total', 'Ответы 429 от Telegram Bot API', ['method'])
+archive_members_total = Counter('converter_archive_members_total', 'Файлы из ZIP-архивов по итогу', ['conv_type', 'status'])
+deliveries_total = Counter('converter_deliveries_total', 'Доставки результатов по итогу', ['status'])
+delivery_retries_total = Counter('converter_delivery_retries_total', 'Повторные попытки отправки', ['reason'])
+
+loop_lag_seconds = Histogram('converter_event_loop_lag_seconds', 'Задержка цикла событий asyncio', buckets=[0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
 
 async def update_progress(user_id, file_index, total_files, progress, status_msg=None):
     async with processing_files_lock:
@@ -134,21 +168,30 @@ async def update_progress(user_id, file_index, total_files, progress, status_msg
         progress_bar = "🟩" * int(progress / 20) + "⬜" * (5 - int(progress / 20))
         text = f"🔄 **Обработка файла {file_index}/{total_files}**\n\n{progress_bar} {progress}%\n\n⏳ Пожалуйста, подождите..."
         try:
-            await status_msg.edit_text(text, parse_mode='Markdown')
-        except:
+            with trace_span('progress_edit', progress=progress):
+                await status_msg.edit_text(text, parse_mode='Markdown', reply_markup=cancel_job_markup())
+        except Exception:
             pass
 
 async def show_progress_bar(message, current, total, text=""):
+    if message is None:
+        return
+    
     try:
         progress = int((current / total) * 100) if total > 0 else 0
         progress_bar = "🟩" * int(progress / 20) + "⬜" * (5 - int(progress / 20))
-        await message.edit_text(
-            f"🔄 **{text}**\n\n{progress_bar} {progress}%\n\n📊 Прогресс: {current}/{total} файлов",
-            parse_mode='Markdown'
-        )
-    except:
+        with trace_span('progress_edit', text=text):
+            await message.edit_text(
+                f"🔄 **{text}**\n\n{progress_bar} {progress}%\n\n📊 Прогресс: {current}/{total} файлов",
+                parse_mode='Markdown',
+                reply_markup=cancel_job_markup()
+            )
+    except Exception:
         pass
 
+def cancel_job_markup():
+    return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отменить", callback_data='cancel_job')]])
+
 async def show_main_menu_after_conversion(chat_id):
     keyboard = [
         [InlineKeyboardButton("📸 Изображения", callback_data='category_images')],
@@ -195,7 +238,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_menu')]
     ]
     
-    message = "📋 **Доступные категории:**\n\n📸 **Изображения:**\n• JPG/JPEG ↔ PNG ↔ WebP ↔ GIF\n• Максимальный размер: 20 МБ\n• До 5 файлов за раз\n• Для GIF используется только первый кадр\n\n📄 **Документы:**\n• TXT ↔ DOCX\n• HTML → TXT/DOCX\n• Максимальный размер: 10 МБ\n• До 3 файлов за раз\n\n🎬 **Видео/Аудио:**\n• GIF ↔ MP4\n• Видео → MP3/WAV/FLAC\n• Максимальный размер: 50 МБ\n• 1 файл за раз\n• Максимальная длительность GIF: 30 секунд\n\n⚠️ **Важно:**\n• Бот не хранит файлы дольше времени конвертации\n• Мы не анализируем содержимое файлов\n• Для видео требуется FFmpeg\n\n🔄 **Как пользоваться:**\n1. Выберите формат конвертации\n2. Отправьте файл(ы)\n3. Отправьте команду /convert или нажмите кнопку\n4. Получите результат\n5. /cancel для отмены"
+    message = categories_text() + "\n\n🔄 **Как пользоваться:**\n1. Выберите формат конвертации\n2. Отправьте файл(ы)\n3. Отправьте команду /convert или нажмите кнопку\n4. Получите результат\n5. /cancel для отмены"
     
     await update.message.reply_text(
         message,
@@ -228,14 +271,70 @@ async def convert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
+    if await cancel_job(user_id):
+        await update.message.reply_text("⛔ Конвертация остановлена.")
+        return
+    
     async with user_data_lock:
         if user_id in user_data:
+            discard_prefetch(user_data[user_id])
             del user_data[user_id]
     async with processing_files_lock:
         if user_id in processing_files:
             del processing_files[user_id]
     await update.message.reply_text("Операция отменена.")
 
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Команда доступна только администраторам.")
+        return
+    
+    action = context.args[0].lower() if context.args else 'status'
+    if action == 'start':
+        if profiler.start():
+            await update.message.reply_text("🔬 Профилирование конвертаций включено. Остановите командой /profile stop")
+        else:
+            await update.message.reply_text("🔬 Профилирование уже идет.")
+    elif action == 'stop':
+        result = profiler.stop()
+        if not result:
+            await update.message.reply_text("Профилирование не запущено.")
+            return
+        
+        await update.message.reply_text(
+            f"🔬 Профиль сохранен: {result['path']}\n"
+            f"Длительность: {result['duration']:.0f} сек, вызовов конвертеров: {result['calls']}, без профиля (параллельно с другим вызовом): {result['skipped']}\n\n"
+            f"{result['report'][-3000:]}"
+        )
+    else:
+        state = "идет" if profiler.active else "не запущено"
+        await update.message.reply_text(f"Профилирование {state}.\nИспользование: /profile start | /profile stop")
+
+async def memsnap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Команда доступна только администраторам.")
+        return
+    
+    action = context.args[0].lower() if context.args else 'snapshot'
+    if action == 'stop':
+        tracemalloc.stop()
+        memory_snapshots['previous'] = None
+        await update.message.reply_text("tracemalloc остановлен.")
+        return
+    
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(config.get('tracemalloc_frames', TRACEMALLOC_FRAMES))
+        await update.message.reply_text("🧠 tracemalloc включен. Повторите /memsnap, чтобы сделать снимок; /memsnap stop - выключить")
+        return
+    
+    loop = asyncio.get_running_loop()
+    path, current, peak, report = await loop.run_in_executor(None, take_memory_snapshot)
+    await update.message.reply_text(
+        f"🧠 Снимок памяти сохранен: {path}\n"
+        f"Отслеживается: {current / (1024 * 1024):.1f} МБ, пик: {peak / (1024 * 1024):.1f} МБ\n\n"
+        f"{report[:3000]}"
+    )
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -245,6 +344,9 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         privacy_accepted[user_id] = True
         await start_from_query(query)
     
+    elif query.data == 'cancel_job':
+        await cancel_job(user_id)
+    
     elif query.data == 'help':
         await help_command_from_query(query)
     
@@ -293,38 +395,47 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif query.data == 'start_conversion':
         await start_conversion_from_button(query, user_id)
     
+    elif query.data == 'target_size_menu':
+        await show_target_size_options(query, user_id)
+    
+    elif query.data == 'as_file_toggle':
+        await toggle_send_as_file(query, user_id)
+    
+    elif query.data.startswith('target_size_'):
+        await set_target_size(query, user_id, int(query.data.rsplit('_', 1)[1]))
+    
+    elif query.data.startswith('multi_toggle_'):
+        await toggle_multi_target(query, user_id, query.data[len('multi_toggle_'):])
+    
+    elif query.data.startswith('multi_') and query.data != 'multi_done':
+        await start_multi_target_selection(query, user_id, query.data[len('multi_'):])
+    
     else:
-        conversion_map = {
-            'jpg_to_png': ('jpg', 'png', 20, '🖼️', 5),
-            'jpg_to_webp': ('jpg', 'webp', 20, '🖼️', 5),
-            'jpg_to_GIF': ('jpg', 'GIF', 20, '🖼️', 5),
-            'png_to_jpg': ('png', 'jpg', 20, '🖼️', 5),
-            'png_to_webp': ('png', 'webp', 20, '🖼️', 5),
-            'png_to_GIF': ('png', 'GIF', 20, '🖼️', 5),
-            'webp_to_jpg': ('webp', 'jpg', 20, '🖼️', 5),
-            'webp_to_png': ('webp', 'png', 20, '🖼️', 5),
-            'webp_to_GIF': ('webp', 'GIF', 20, '🖼️', 5),
-            'GIF_to_jpg': ('GIF', 'jpg', 20, '🖼️', 5),
-            'GIF_to_png': ('GIF', 'png', 20, '🖼️', 5),
-            'GIF_to_webp': ('GIF', 'webp', 20, '🖼️', 5),
+        conv_key = query.data
+        targets = None
+        
+        if query.data == 'multi_done':
+            async with user_data_lock:
+                selection = multi_selection.get(user_id)
+                if selection and selection['targets']:
+                    del multi_selection[user_id]
             
-            'txt_to_docx': ('txt', 'docx', 10, '📝', 3),
-            'docx_to_txt': ('docx', 'txt', 10, '📝', 3),
-            'html_to_txt': ('html', 'txt', 10, '🌐', 3),
-            'html_to_docx': ('html', 'docx', 10, '🌐', 3),
+            if not selection:
+                await show_main_menu(query)
+                return
+            if not selection['targets']:
+                await show_multi_target_options(query, user_id, selection['source'])
+                return
             
-            'GIF_to_mp4': ('GIF', 'mp4', 50, '🎬', 1),
-            'mp4_to_GIF': ('video', 'GIF', 50, '🎬', 1),
-            'video_to_mp3': ('video', 'mp3', 50, '🎵', 1),
-            'video_to_wav': ('video', 'wav', 50, '🎵', 1),
-            'video_to_flac': ('video', 'flac', 50, '🎵', 1),
-        }
+            targets = [target for target in MULTI_TARGET_OPTIONS[selection['source']] if target in selection['targets']]
+            conv_key = f"{selection['source']}_to_{targets[0]}"
         
-        if query.data in conversion_map:
-            source, target, max_mb, emoji, max_files = conversion_map[query.data]
+        if conv_key in CONVERSION_MENU:
+            source, target, max_mb, emoji, max_files = CONVERSION_MENU[conv_key]
+            max_mb = conversion_max_mb(conv_key, max_mb)
             
-            if query.data in ['GIF_to_mp4', 'mp4_to_GIF', 'video_to_mp3', 'video_to_wav', 'video_to_flac']:
-                ffmpeg_path = find_ffmpeg_cached()
+            if conv_key in ['GIF_to_mp4', 'mp4_to_GIF', 'video_to_mp3', 'video_to_wav', 'video_to_flac']:
+                ffmpeg_path = await find_ffmpeg_cached()
                 if not ffmpeg_path:
                     await query.edit_message_text(
                         "❌ **FFmpeg не найден**\n\nПоложите `ffmpeg.exe` в папку с ботом или установите через Chocolatey:\n`choco install ffmpeg -y`",
@@ -336,10 +447,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     return
             
             async with user_data_lock:
+                if user_id in user_data:
+                    discard_prefetch(user_data[user_id])
                 user_data[user_id] = {
-                    'type': query.data,
+                    'type': conv_key,
                     'source': source,
                     'target': target,
+                    'targets': targets,
                     'max_size': max_mb * 1024 * 1024,
                     'max_files': max_files,
                     'files': [],
@@ -362,20 +476,29 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             }
             
             files_text = f"Максимум файлов: {max_files}" if max_files > 1 else "Только 1 файл"
+            if config.get('archive_batch', True):
+                files_text += f" или ZIP-архив до {conversion_max_mb('archive', ARCHIVE_MAX_MB)} МБ с файлами"
+            
+            target_text = ' + '.join(t.upper() for t in targets) if targets else target.upper()
+            result_text = ', '.join(format_names.get(t, t) for t in targets) if targets else format_names.get(target, target)
             
             warning_text = ""
-            if query.data in ['GIF_to_jpg', 'GIF_to_png', 'GIF_to_webp']:
+            if conv_key in ['GIF_to_jpg', 'GIF_to_png', 'GIF_to_webp']:
                 warning_text = "\n⚠️ Используется только первый кадр GIF"
-            elif query.data == 'mp4_to_GIF':
+            elif conv_key == 'mp4_to_GIF':
                 warning_text = "\n⚠️ Telegram может отправлять GIF как MP4"
             
+            keyboard = [[InlineKeyboardButton("🚀 Начать конвертацию", callback_data='start_conversion')]]
+            if supports_target_size(conv_key):
+                keyboard.append([InlineKeyboardButton("🎯 Уложить в размер", callback_data='target_size_menu')])
+            if supports_send_as_file(conv_key):
+                keyboard.append([InlineKeyboardButton("📎 Отправлять файлом", callback_data='as_file_toggle')])
+            keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data='back_to_category')])
+            
             await query.edit_message_text(
-                f"{emoji} **{source.upper()} → {target.upper()}**\n\n📤 Отправьте файл(ы) .{source}\n📏 Максимальный размер: {max_mb} МБ\n📦 {files_text}\n\n📋 Тип: {format_names.get(source, source)}\n✅ Результат: {format_names.get(target, target)}{warning_text}\n\n💡 **Инструкция:**\n1. Отправьте файлы\n2. Когда готовы, отправьте /convert\n3. Или нажмите '🚀 Начать конвертацию'\n\n❌ Отмена: /cancel",
+                f"{emoji} **{source.upper()} → {target_text}**\n\n📤 Отправьте файл(ы) .{source}\n📏 Максимальный размер: {max_mb} МБ\n📦 {files_text}\n\n📋 Тип: {format_names.get(source, source)}\n✅ Результат: {result_text}{warning_text}\n\n💡 **Инструкция:**\n1. Отправьте файлы\n2. Когда готовы, отправьте /convert\n3. Или нажмите '🚀 Начать конвертацию'\n\n❌ Отмена: /cancel",
                 parse_mode='Markdown',
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🚀 Начать конвертацию", callback_data='start_conversion')],
-                    [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_category')]
-                ])
+                reply_markup=InlineKeyboardMarkup(keyboard)
             )
 
 async def start_from_query(query):
@@ -399,7 +522,7 @@ async def help_command_from_query(query):
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_menu')]
     ]
     
-    message = "📋 **Доступные категории:**\n\n📸 **Изображения:**\n• JPG/JPEG ↔ PNG ↔ WebP ↔ GIF\n• Максимальный размер: 20 МБ\n• До 5 файлов за раз\n• Для GIF используется только первый кадр\n\n📄 **Документы:**\n• TXT ↔ DOCX\n• HTML → TXT/DOCX\n• Максимальный размер: 10 МБ\n• До 3 файлов за раз\n\n🎬 **Видео/Аудио:**\n• GIF ↔ MP4\n• Видео → MP3/WAV/FLAC\n• Максимальный размер: 50 МБ\n• 1 файл за раз\n• Максимальная длительность GIF: 30 секунд\n\n⚠️ **Важно:**\n• Бот не хранит файлы дольше времени конвертации\n• Мы не анализируем содержимое файлов\n• Для видео требуется FFmpeg"
+    message = categories_text()
     
     await query.edit_message_text(
         message,
@@ -458,7 +581,7 @@ async def show_image_categories(query):
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_menu')]
     ]
     await query.edit_message_text(
-        "📸 **Категория: Изображения**\n\nВыберите исходный формат:\n• JPG/JPEG\n• PNG\n• WebP\n• GIF\n\n📏 Максимальный размер: 20 МБ\n📦 До 5 файлов за раз\n\n⚠️ Для GIF используется только первый кадр\n💡 Можно отправить несколько файлов сразу",
+        f"📸 **Категория: Изображения**\n\nВыберите исходный формат:\n• JPG/JPEG\n• PNG\n• WebP\n• GIF\n\n📏 Максимальный размер: {max_size_text(IMAGE_CONVERSIONS)}\n📦 До 5 файлов за раз\n\n⚠️ Для GIF используется только первый кадр\n💡 Можно отправить несколько файлов сразу",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -470,13 +593,13 @@ async def show_document_formats(query):
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_menu')]
     ]
     await query.edit_message_text(
-        "📄 **Категория: Документы**\n\nВыберите тип документа:\n• TXT (текстовые файлы)\n• DOCX (Word документы)\n• HTML/HTM (веб-страницы)\n\n📏 Максимальный размер: 10 МБ\n📦 До 3 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
+        f"📄 **Категория: Документы**\n\nВыберите тип документа:\n• TXT (текстовые файлы)\n• DOCX (Word документы)\n• HTML/HTM (веб-страницы)\n\n📏 Максимальный размер: {max_size_text(TEXT_CONVERSIONS + HTML_CONVERSIONS)}\n📦 До 3 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
 async def show_video_categories(query):
-    ffmpeg_available = find_ffmpeg_cached() is not None
+    ffmpeg_available = await find_ffmpeg_cached() is not None
     
     keyboard = [
         [InlineKeyboardButton("🎬 Конвертация видео", callback_data='video_conversion')],
@@ -484,7 +607,7 @@ async def show_video_categories(query):
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_menu')]
     ]
     
-    message = "🎬 **Категория: Видео/Аудио**\n\nВыберите тип операции:\n• Конвертация видео (GIF ↔ MP4)\n• Извлечение аудио из видео\n\n📏 Максимальный размер: 50 МБ\n📦 Только 1 файл за раз\n📝 Максимальная длительность GIF: 30 секунд\n\n"
+    message = f"🎬 **Категория: Видео/Аудио**\n\nВыберите тип операции:\n• Конвертация видео (GIF ↔ MP4)\n• Извлечение аудио из видео\n\n📏 Максимальный размер: {max_size_text(VIDEO_CONVERSIONS + AUDIO_CONVERSIONS)}\n📦 Только 1 файл за раз\n📝 {gif_duration_text()}\n\n"
     
     if ffmpeg_available:
         message += "✅ FFmpeg найден"
@@ -504,7 +627,7 @@ async def show_video_conversion_formats(query):
         [InlineKeyboardButton("⬅️ Назад", callback_data='category_video')]
     ]
     await query.edit_message_text(
-        "🎬 **Конвертация видео**\n\nВыберите направление конвертации:\n• GIF → MP4 (анимация в видео)\n• Видео → GIF (видео в анимацию)\n\n⚠️ Telegram отправляет GIF как MP4\n📏 Максимальный размер: 50 МБ\n⏱️ Максимальная длительность: 30 секунд\n📦 Только 1 файл за раз",
+        f"🎬 **Конвертация видео**\n\nВыберите направление конвертации:\n• GIF → MP4 (анимация в видео)\n• Видео → GIF (видео в анимацию)\n\n⚠️ Telegram отправляет GIF как MP4\n📏 Максимальный размер: {max_size_text(VIDEO_CONVERSIONS)}\n⏱️ {gif_duration_text()}\n📦 Только 1 файл за раз",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -514,10 +637,11 @@ async def show_audio_extraction_formats(query):
         [InlineKeyboardButton("🎵 Видео → MP3", callback_data='video_to_mp3')],
         [InlineKeyboardButton("🎵 Видео → WAV", callback_data='video_to_wav')],
         [InlineKeyboardButton("🎵 Видео → FLAC", callback_data='video_to_flac')],
+        [InlineKeyboardButton("🧩 Несколько форматов", callback_data='multi_video')],
         [InlineKeyboardButton("⬅️ Назад", callback_data='category_video')]
     ]
     await query.edit_message_text(
-        "🎵 **Извлечение аудио из видео**\n\nВыберите формат аудио:\n• Видео → MP3 (хорошее сжатие)\n• Видео → WAV (без сжатия, высокое качество)\n• Видео → FLAC (без потерь)\n\n📏 Максимальный размер: 50 МБ\n📦 Только 1 файл за раз",
+        f"🎵 **Извлечение аудио из видео**\n\nВыберите формат аудио:\n• Видео → MP3 (хорошее сжатие)\n• Видео → WAV (без сжатия, высокое качество)\n• Видео → FLAC (без потерь)\n\n📏 Максимальный размер: {max_size_text(AUDIO_CONVERSIONS)}\n📦 Только 1 файл за раз",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -529,7 +653,7 @@ async def show_text_category(query):
         [InlineKeyboardButton("⬅️ Назад", callback_data='category_documents')]
     ]
     await query.edit_message_text(
-        "📝 **Текстовые файлы**\n\nВыберите направление конвертации:\n• TXT → DOCX\n• DOCX → TXT\n\n📏 Максимальный размер: 10 МБ\n📦 До 3 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
+        f"📝 **Текстовые файлы**\n\nВыберите направление конвертации:\n• TXT → DOCX\n• DOCX → TXT\n\n📏 Максимальный размер: {max_size_text(TEXT_CONVERSIONS)}\n📦 До 3 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -541,7 +665,7 @@ async def show_html_formats(query):
         [InlineKeyboardButton("⬅️ Назад", callback_data='category_documents')]
     ]
     await query.edit_message_text(
-        "🌐 **HTML файлы**\n\nВыберите направление конвертации:\n• HTML → TXT\n• HTML → DOCX\n\n📋 Поддерживаются: .html, .htm\n📏 Максимальный размер: 10 МБ\n📦 До 3 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
+        f"🌐 **HTML файлы**\n\nВыберите направление конвертации:\n• HTML → TXT\n• HTML → DOCX\n\n📋 Поддерживаются: .html, .htm\n📏 Максимальный размер: {max_size_text(HTML_CONVERSIONS)}\n📦 До 3 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -551,10 +675,11 @@ async def show_jpg_formats(query):
         [InlineKeyboardButton("🖼️ JPG → PNG", callback_data='jpg_to_png')],
         [InlineKeyboardButton("🖼️ JPG → WebP", callback_data='jpg_to_webp')],
         [InlineKeyboardButton("🖼️ JPG → GIF", callback_data='jpg_to_GIF')],
+        [InlineKeyboardButton("🧩 Несколько форматов", callback_data='multi_jpg')],
         [InlineKeyboardButton("⬅️ Назад", callback_data='category_images')]
     ]
     await query.edit_message_text(
-        "🖼️ **Исходный формат: JPG/JPEG**\n\nВыберите целевой формат:\n• JPG → PNG\n• JPG → WebP\n• JPG → GIF\n\n📏 Максимальный размер: 20 МБ\n📦 До 5 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
+        f"🖼️ **Исходный формат: JPG/JPEG**\n\nВыберите целевой формат:\n• JPG → PNG\n• JPG → WebP\n• JPG → GIF\n\n📏 Максимальный размер: {max_size_text(conv_key for conv_key in IMAGE_CONVERSIONS if conv_key.startswith('jpg_'))}\n📦 До 5 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -564,10 +689,11 @@ async def show_png_formats(query):
         [InlineKeyboardButton("🖼️ PNG → JPG", callback_data='png_to_jpg')],
         [InlineKeyboardButton("🖼️ PNG → WebP", callback_data='png_to_webp')],
         [InlineKeyboardButton("🖼️ PNG → GIF", callback_data='png_to_GIF')],
+        [InlineKeyboardButton("🧩 Несколько форматов", callback_data='multi_png')],
         [InlineKeyboardButton("⬅️ Назад", callback_data='category_images')]
     ]
     await query.edit_message_text(
-        "🖼️ **Исходный формат: PNG**\n\nВыберите целевой формат:\n• PNG → JPG\n• PNG → WebP\n• PNG → GIF\n\n📏 Максимальный размер: 20 МБ\n📦 До 5 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
+        f"🖼️ **Исходный формат: PNG**\n\nВыберите целевой формат:\n• PNG → JPG\n• PNG → WebP\n• PNG → GIF\n\n📏 Максимальный размер: {max_size_text(conv_key for conv_key in IMAGE_CONVERSIONS if conv_key.startswith('png_'))}\n📦 До 5 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -577,10 +703,11 @@ async def show_webp_formats(query):
         [InlineKeyboardButton("🖼️ WebP → JPG", callback_data='webp_to_jpg')],
         [InlineKeyboardButton("🖼️ WebP → PNG", callback_data='webp_to_png')],
         [InlineKeyboardButton("🖼️ WebP → GIF", callback_data='webp_to_GIF')],
+        [InlineKeyboardButton("🧩 Несколько форматов", callback_data='multi_webp')],
         [InlineKeyboardButton("⬅️ Назад", callback_data='category_images')]
     ]
     await query.edit_message_text(
-        "🖼️ **Исходный формат: WebP**\n\nВыберите целевой формат:\n• WebP → JPG\n• WebP → PNG\n• WebP → GIF\n\n📏 Максимальный размер: 20 МБ\n📦 До 5 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
+        f"🖼️ **Исходный формат: WebP**\n\nВыберите целевой формат:\n• WebP → JPG\n• WebP → PNG\n• WebP → GIF\n\n📏 Максимальный размер: {max_size_text(conv_key for conv_key in IMAGE_CONVERSIONS if conv_key.startswith('webp_'))}\n📦 До 5 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -590,10 +717,11 @@ async def show_GIF_formats(query):
         [InlineKeyboardButton("🖼️ GIF → JPG", callback_data='GIF_to_jpg')],
         [InlineKeyboardButton("🖼️ GIF → PNG", callback_data='GIF_to_png')],
         [InlineKeyboardButton("🖼️ GIF → WebP", callback_data='GIF_to_webp')],
+        [InlineKeyboardButton("🧩 Несколько форматов", callback_data='multi_GIF')],
         [InlineKeyboardButton("⬅️ Назад", callback_data='category_images')]
     ]
     await query.edit_message_text(
-        "🖼️ **Исходный формат: GIF**\n\nВыберите целевой формат:\n• GIF → JPG\n• GIF → PNG\n• GIF → WebP\n\n⚠️ Используется только первый кадр\n📏 Максимальный размер: 20 МБ\n📦 До 5 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
+        f"🖼️ **Исходный формат: GIF**\n\nВыберите целевой формат:\n• GIF → JPG\n• GIF → PNG\n• GIF → WebP\n\n⚠️ Используется только первый кадр\n📏 Максимальный размер: {max_size_text(conv_key for conv_key in IMAGE_CONVERSIONS if conv_key.startswith('GIF_'))}\n📦 До 5 файлов за раз\n\n💡 Можно отправить несколько файлов сразу",
         parse_mode='Markdown',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -610,6 +738,124 @@ async def show_cloud_options(query):
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+async def start_multi_target_selection(query, user_id, source):
+    if source not in MULTI_TARGET_OPTIONS:
+        await show_main_menu(query)
+        return
+    
+    async with user_data_lock:
+        multi_selection[user_id] = {'source': source, 'targets': []}
+    
+    await show_multi_target_options(query, user_id, source)
+
+async def toggle_multi_target(query, user_id, target):
+    async with user_data_lock:
+        selection = multi_selection.get(user_id)
+        if selection and target in MULTI_TARGET_OPTIONS[selection['source']]:
+            if target in selection['targets']:
+                selection['targets'].remove(target)
+            else:
+                selection['targets'].append(target)
+            source = selection['source']
+        else:
+            source = None
+    
+    if not source:
+        await show_main_menu(query)
+        return
+    
+    await show_multi_target_options(query, user_id, source)
+
+async def show_multi_target_options(query, user_id, source):
+    async with user_data_lock:
+        selected = list(multi_selection.get(user_id, {}).get('targets', []))
+    
+    keyboard = [
+        [InlineKeyboardButton(f"{'✅' if target in selected else '⬜'} {target.upper()}", callback_data=f'multi_toggle_{target}')]
+        for target in MULTI_TARGET_OPTIONS[source]
+    ]
+    keyboard.append([InlineKeyboardButton("✔️ Готово", callback_data='multi_done')])
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data='audio_extraction' if source == 'video' else f'{source}_category')])
+    
+    await query.edit_message_text(
+        f"🧩 **Несколько форматов: {source.upper()}**\n\nОтметьте целевые форматы.\nФайл будет загружен и декодирован один раз, а результат придёт в каждом выбранном формате.\n\nВыбрано: {len(selected)}",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def toggle_send_as_file(query, user_id):
+    async with user_data_lock:
+        if user_id not in user_data or not supports_send_as_file(user_data[user_id]['type']):
+            as_file = None
+        else:
+            as_file = not user_data[user_id].get('as_file')
+            user_data[user_id]['as_file'] = as_file
+    
+    if as_file is None:
+        await show_main_menu(query)
+        return
+    
+    if as_file:
+        text = "📎 **Результаты будут отправлены файлом**\n\nИзображения придут в полном разрешении, без сжатия Telegram."
+        button = "🖼️ Отправлять как фото"
+    else:
+        text = f"🖼️ **Результаты будут отправлены как фото**\n\nTelegram сжимает фото до {config.get('photo_delivery_max_side', PHOTO_DELIVERY_MAX_SIDE)} px, поэтому бот скачивает и обрабатывает изображение сразу в этом разрешении."
+        button = "📎 Отправлять файлом"
+    
+    await query.edit_message_text(
+        f"{text}\n\n📤 Отправьте файл(ы), затем отправьте /convert или нажмите '🚀 Начать конвертацию'\n\n❌ Отмена: /cancel",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🚀 Начать конвертацию", callback_data='start_conversion')],
+            [InlineKeyboardButton(button, callback_data='as_file_toggle')],
+            [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_category')]
+        ])
+    )
+
+async def show_target_size_options(query, user_id):
+    async with user_data_lock:
+        conv_type = user_data[user_id]['type'] if user_id in user_data else None
+    
+    if not conv_type or not supports_target_size(conv_type):
+        await show_main_menu(query)
+        return
+    
+    keyboard = [
+        [InlineKeyboardButton(f"🎯 До {size_mb} МБ", callback_data=f'target_size_{size_mb}')]
+        for size_mb in TARGET_SIZE_OPTIONS_MB
+    ]
+    keyboard.append([InlineKeyboardButton("♾️ Без ограничения", callback_data='target_size_0')])
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data='back_to_category')])
+    
+    await query.edit_message_text(
+        "🎯 **Уложить в размер**\n\nВыберите максимальный размер результата.\nКачество и разрешение будут подобраны автоматически.",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def set_target_size(query, user_id, size_mb):
+    async with user_data_lock:
+        if user_id not in user_data or not supports_target_size(user_data[user_id]['type']):
+            conv_type = None
+        else:
+            conv_type = user_data[user_id]['type']
+            user_data[user_id]['target_size'] = size_mb * 1024 * 1024 if size_mb > 0 else None
+    
+    if not conv_type:
+        await show_main_menu(query)
+        return
+    
+    size_text = f"до {size_mb} МБ" if size_mb > 0 else "без ограничения"
+    await query.edit_message_text(
+        f"🎯 **Размер результата: {size_text}**\n\n📤 Отправьте файл(ы), затем отправьте /convert или нажмите '🚀 Начать конвертацию'\n\n❌ Отмена: /cancel",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🚀 Начать конвертацию", callback_data='start_conversion')],
+            [InlineKeyboardButton("🎯 Изменить размер", callback_data='target_size_menu')],
+            [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_category')]
+        ])
+    )
+
 async def start_conversion_from_button(query, user_id):
     async with user_data_lock:
         if user_id not in user_data:
@@ -626,394 +872,904 @@ async def start_conversion_from_button(query, user_id):
 async def start_conversion_from_query(query, user_id):
     async with user_data_lock:
         user_info = user_data[user_id]
-    await process_conversion(user_info, user_id, query.message.chat_id, query.message.message_id)
+    await run_conversion_job(user_info, user_id, query.message.chat_id, query.message.message_id)
 
 async def start_conversion(update: Update, user_info, user_id):
-    await process_conversion(user_info, user_id, update.message.chat_id, update.message.message_id)
+    await run_conversion_job(user_info, user_id, update.message.chat_id, update.message.message_id)
 
-async def convert_image(file_bytes, source_format, target_format):
-    try:
-        image = Image.open(io.BytesIO(file_bytes))
-        
-        if target_format in ['jpg', 'jpeg'] and image.mode in ['RGBA', 'P']:
-            image = image.convert('RGB')
-        elif target_format == 'png' and image.mode == 'P':
-            image = image.convert('RGBA')
-        
-        output_buffer = io.BytesIO()
-        
-        save_params = {}
-        if target_format == 'jpg':
-            save_params['format'] = 'JPEG'
-            save_params['quality'] = 95
-        elif target_format == 'png':
-            save_params['format'] = 'PNG'
-            save_params['optimize'] = True
-        elif target_format == 'webp':
-            save_params['format'] = 'WEBP'
-            save_params['quality'] = 90
-        elif target_format == 'GIF':
-            save_params['format'] = 'GIF'
-            if source_format == 'GIF':
-                if hasattr(image, 'is_animated') and image.is_animated:
-                    image.seek(0)
-        
-        image.save(output_buffer, **save_params)
-        output_buffer.seek(0)
-        
-        return output_buffer.getvalue()
-        
-    except Exception as e:
-        logger.error(f"Ошибка конвертации изображения: {e}")
-        raise
+async def run_conversion_job(user_info, user_id, chat_id, message_id):
+    async with active_jobs_lock:
+        running = active_jobs.get(user_id)
+        if running and not running.done():
+            await application.bot.send_message(chat_id=chat_id, text="⏳ Конвертация уже идет. Дождитесь окончания или нажмите /cancel.")
+            return
+        active_jobs[user_id] = asyncio.create_task(conversion_job(user_info, user_id, chat_id, message_id))
 
-async def convert_txt_to_docx(txt_content):
+async def conversion_job(user_info, user_id, chat_id, message_id):
     try:
-        doc = Document()
-        doc.add_heading('Конвертированный документ', 0)
-        
-        paragraphs = txt_content.split('\n')
-        for para in paragraphs:
-            if para.strip():
-                p = doc.add_paragraph(para.strip())
-                p.alignment = WD_ALIGN_PARAGRAPH.LEFT
-        
-        doc_buffer = io.BytesIO()
-        doc.save(doc_buffer)
-        doc_buffer.seek(0)
-        
-        return doc_buffer.getvalue()
-    except Exception as e:
-        logger.error(f"Ошибка конвертации TXT в DOCX: {e}")
-        raise
+        await process_conversion(user_info, user_id, chat_id, message_id)
+    except asyncio.CancelledError:
+        logger.info(f"Конвертация пользователя {user_id} отменена")
+    finally:
+        async with active_jobs_lock:
+            if active_jobs.get(user_id) is asyncio.current_task():
+                del active_jobs[user_id]
 
-async def convert_docx_to_txt(docx_bytes):
-    try:
-        doc_buffer = io.BytesIO(docx_bytes)
-        doc = Document(doc_buffer)
-        
-        text_content = []
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text_content.append(paragraph.text)
-        
-        return '\n'.join(text_content).encode('utf-8')
-    except Exception as e:
-        logger.error(f"Ошибка конвертации DOCX в TXT: {e}")
-        raise
+async def cancel_job(user_id):
+    async with active_jobs_lock:
+        task = active_jobs.get(user_id)
+    
+    if not task or task.done():
+        return False
+    
+    task.cancel()
+    await asyncio.wait([task])
+    return True
 
-async def convert_html_to_txt(html_bytes):
-    try:
-        html_content = html_bytes.decode('utf-8', errors='ignore')
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        for script in soup(["script", "style"]):
-            script.decompose()
-        
-        text = soup.get_text()
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-        
-        return text.encode('utf-8')
-    except Exception as e:
-        logger.error(f"Ошибка конвертации HTML в TXT: {e}")
-        raise
+Gauge('converter_active_jobs', 'Идущие конвертации пользователей', callback=lambda: len(active_jobs))
 
-async def convert_html_to_docx(html_bytes):
-    try:
-        txt_content = await convert_html_to_txt(html_bytes)
-        return await convert_txt_to_docx(txt_content.decode('utf-8', errors='ignore'))
-    except Exception as e:
-        logger.error(f"Ошибка конвертации HTML в DOCX: {e}")
-        raise
+def telegram_api_method(url):
+    if '/file/bot' in url:
+        return 'file_download'
+    return url.rsplit('/', 1)[-1] or 'unknown'
+
+http_pools = {}
+transfer_bot = None
+
+class InstrumentedRequest(HTTPXRequest):
+    def __init__(self, pool_name='api', **kwargs):
+        super().__init__(**kwargs)
+        self.pool_name = pool_name
+        self.pool_size = kwargs.get('connection_pool_size', 1)
+        self.in_flight = 0
+        http_pools[pool_name] = self
+    
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = telegram_api_method(url)
+        started = time.monotonic()
+        self.in_flight += 1
+        try:
+            status_code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            telegram_requests_total.inc(pool=self.pool_name, method=api_method, status='error')
+            raise
+        finally:
+            self.in_flight -= 1
+            telegram_request_seconds.observe(time.monotonic() - started, pool=self.pool_name, method=api_method)
+        
+        telegram_requests_total.inc(pool=self.pool_name, method=api_method, status=status_code)
+        if status_code == 429:
+            telegram_rate_limited_total.inc(method=api_method)
+        return status_code, payload
+
+def build_request(pool_name):
+    supported = inspect.signature(HTTPXRequest.__init__).parameters
+    options = dict(HTTP_POOLS[pool_name], **config.get('http_pools', {}).get(pool_name, {}))
+    return InstrumentedRequest(pool_name, **{key: value for key, value in options.items() if key in supported})
+
+def files_bot():
+    return transfer_bot or application.bot
+
+def local_bot_api_url():
+    return (config.get('local_bot_api_url') or '').rstrip('/')
+
+def bot_api_options():
+    api_url = local_bot_api_url()
+    if not api_url:
+        return {}
+    return {
+        'base_url': f"{api_url}/bot",
+        'base_file_url': f"{api_url}/file/bot",
+        'local_mode': True
+    }
+
+def conversion_max_mb(conv_key, default_mb):
+    if local_bot_api_url():
+        default_mb = config.get('local_max_file_mb', LOCAL_BOT_API_MAX_MB)
+    return config.get('size_limits_mb', {}).get(conv_key, default_mb)
 
-async def run_ffmpeg_command(cmd, timeout=120):
+def max_size_text(conv_keys):
+    limits = sorted({conversion_max_mb(conv_key, CONVERSION_MENU[conv_key][2]) for conv_key in conv_keys})
+    if len(limits) == 1:
+        return f"{limits[0]} МБ"
+    return f"{limits[0]}–{limits[-1]} МБ"
+
+def gif_duration_text():
+    return f"GIF создается из первых {config.get('gif_max_duration', GIF_MAX_DURATION)} секунд видео"
+
+def categories_text():
+    return (
+        f"📋 **Доступные категории:**\n\n📸 **Изображения:**\n• JPG/JPEG ↔ PNG ↔ WebP ↔ GIF\n• Максимальный размер: {max_size_text(IMAGE_CONVERSIONS)}\n• До 5 файлов за раз\n• Для GIF используется только первый кадр\n\n"
+        f"📄 **Документы:**\n• TXT ↔ DOCX\n• HTML → TXT/DOCX\n• Максимальный размер: {max_size_text(TEXT_CONVERSIONS + HTML_CONVERSIONS)}\n• До 3 файлов за раз\n\n"
+        f"🎬 **Видео/Аудио:**\n• GIF ↔ MP4\n• Видео → MP3/WAV/FLAC\n• Максимальный размер: {max_size_text(VIDEO_CONVERSIONS + AUDIO_CONVERSIONS)}\n• 1 файл за раз\n• {gif_duration_text()}\n\n"
+        "⚠️ **Важно:**\n• Бот не хранит файлы дольше времени конвертации\n• Мы не анализируем содержимое файлов\n• Для видео требуется FFmpeg"
+    )
+
+def local_file_path(file):
+    if local_bot_api_url() and file.file_path and os.path.isabs(file.file_path) and os.path.isfile(file.file_path):
+        return file.file_path
+    return None
+
+async def start_transfer_bot(application):
+    global transfer_bot
+    bot = Bot(application.bot.token, request=build_request('transfer'), **bot_api_options())
+    await bot.initialize()
+    transfer_bot = bot
+
+async def stop_transfer_bot(application):
+    global transfer_bot
+    if transfer_bot:
+        await transfer_bot.shutdown()
+        transfer_bot = None
+
+Gauge('converter_http_pool_in_use', 'Запросы, занимающие соединения пула', ['pool'], callback=lambda: {(name,): request.in_flight for name, request in http_pools.items()})
+Gauge('converter_http_pool_size', 'Размер пула соединений', ['pool'], callback=lambda: {(name,): request.pool_size for name, request in http_pools.items()})
+
+async def handle_metrics_request(reader, writer):
     try:
-        logger.info(f"Запуск FFmpeg: {' '.join(cmd)}")
-        
-        creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            creationflags=creation_flags,
-            timeout=timeout
-        )
-        
-        if result.returncode != 0:
-            error_msg = result.stderr[:500] if result.stderr else "Неизвестная ошибка"
-            if error_msg:
-                error_msg = error_msg.encode('utf-8', errors='ignore').decode('utf-8')
-            logger.error(f"Ошибка FFmpeg: {error_msg}")
-            raise Exception(f"Ошибка FFmpeg: {error_msg}")
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b'\r\n', b'\n', b''):
+                break
+        
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?', 1)[0] == '/metrics':
+            status = '200 OK'
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            body = render_metrics().encode('utf-8')
+        else:
+            status = '404 Not Found'
+            content_type = 'text/plain; charset=utf-8'
+            body = b'Not Found\n'
         
-        return True
-    except subprocess.TimeoutExpired:
-        raise Exception("Таймаут конвертации. Файл слишком большой или сложный.")
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
     except Exception as e:
-        raise Exception(f"Ошибка выполнения FFmpeg: {str(e)}")
-
-async def convert_GIF_to_mp4(input_path, output_path, user_id=None, status_msg=None):
-    ffmpeg_path = find_ffmpeg_cached()
-    if not ffmpeg_path:
-        raise Exception("FFmpeg не найден")
-    
-    cmd = [
-        ffmpeg_path,
-        '-i', input_path,
-        '-movflags', 'faststart',
-        '-pix_fmt', 'yuv420p',
-        '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
-        '-c:v', 'libx264',
-        '-preset', 'medium',
-        '-crf', '23',
-        '-y',
-        output_path
-    ]
-    
-    await run_ffmpeg_command(cmd, timeout=180)
+        logger.error(f"Ошибка обработки запроса метрик: {e}")
+    finally:
+        writer.close()
 
-async def convert_mp4_to_GIF(input_path, output_path, user_id=None, status_msg=None):
-    ffmpeg_path = find_ffmpeg_cached()
-    if not ffmpeg_path:
-        raise Exception("FFmpeg не найден")
+async def start_metrics_server(application):
+    port = config.get('metrics_port', METRICS_PORT)
+    if not port:
+        return
     
+    host = config.get('metrics_host', '127.0.0.1')
     try:
-        probe_cmd = [
-            ffmpeg_path,
-            '-i', input_path,
-            '-show_entries', 'format=duration',
-            '-v', 'quiet',
-            '-of', 'csv=p=0'
-        ]
-        
-        creation_flags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-        result = subprocess.run(
-            probe_cmd,
-            capture_output=True,
-            text=True,
-            creationflags=creation_flags,
-            timeout=10
-        )
-        
-        duration = 0
-        if result.returncode == 0 and result.stdout.strip():
-            duration = float(result.stdout.strip())
-            if duration > 30:
-                raise Exception(f"Видео слишком длинное ({duration:.1f} сек). Максимум: 30 секунд.")
-        
-        filter_complex = '[0:v] fps=10,scale=320:-1:flags=lanczos,split [a][b];[a] palettegen=stats_mode=diff [p];[b][p] paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle'
-        
-        if duration > 10:
-            filter_complex = f'[0:v] trim=0:30, {filter_complex}'
-        
-        cmd = [
-            ffmpeg_path,
-            '-i', input_path,
-            '-vf', filter_complex,
-            '-loop', '0',
-            '-y',
-            output_path
-        ]
-        
-        if user_id and status_msg:
-            await update_progress(user_id, 1, 1, 55, status_msg)
-        
-        await run_ffmpeg_command(cmd, timeout=180)
+        application.bot_data['metrics_server'] = await asyncio.start_server(handle_metrics_request, host, port)
+        logger.info(f"Метрики доступны по адресу http://{host}:{port}/metrics")
+    except OSError as e:
+        logger.error(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+
+def is_admin(user_id):
+    return user_id in config.get('admin_ids', [])
+
+class UserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self.user_locks = {}
+    
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            await coroutine
+            return
         
-        if user_id and status_msg:
-            await update_progress(user_id, 1, 1, 75, status_msg)
-            
-    except Exception as e:
+        entry = self.user_locks.setdefault(user.id, {'lock': asyncio.Lock(), 'pending': 0})
+        entry['pending'] += 1
         try:
-            logger.info(f"Пробуем упрощенный метод конвертации MP4 в GIF: {e}")
-            simple_cmd = [
-                ffmpeg_path,
-                '-i', input_path,
-                '-vf', 'fps=10,scale=320:-1:flags=lanczos',
-                '-y',
-                output_path
-            ]
-            await run_ffmpeg_command(simple_cmd, timeout=180)
-        except Exception as simple_error:
-            raise Exception(f"Не удалось конвертировать MP4 в GIF: {str(e)}. Упрощенный метод тоже не сработал: {str(simple_error)}")
-
-async def convert_video_to_audio(input_path, output_path, audio_format, user_id=None, status_msg=None):
-    ffmpeg_path = find_ffmpeg_cached()
-    if not ffmpeg_path:
-        raise Exception("FFmpeg не найден")
-    
-    cmd = [ffmpeg_path, '-i', input_path]
-    
-    if audio_format == 'mp3':
-        cmd.extend(['-q:a', '2', '-map', 'a'])
-    elif audio_format == 'wav':
-        cmd.extend(['-acodec', 'pcm_s16le', '-ac', '2', '-ar', '44100'])
-    elif audio_format == 'flac':
-        cmd.extend(['-acodec', 'flac', '-compression_level', '5'])
-    
-    cmd.extend(['-y', output_path])
-    
-    if user_id and status_msg:
-        await update_progress(user_id, 1, 1, 55, status_msg)
-    
-    await run_ffmpeg_command(cmd, timeout=180)
+            async with entry['lock']:
+                await coroutine
+        finally:
+            entry['pending'] -= 1
+            if not entry['pending']:
+                del self.user_locks[user.id]
+    
+    async def initialize(self):
+        pass
     
-    if user_id and status_msg:
-        await update_progress(user_id, 1, 1, 75, status_msg)
+    async def shutdown(self):
+        pass
 
-async def process_video_conversion(file_bytes, conv_type, original_name, user_id=None, status_msg=None):
-    input_path = None
-    output_path = None
+def update_processor():
+    concurrent_updates = config.get('concurrent_updates', True)
+    if concurrent_updates is False:
+        return False
+    if concurrent_updates is True:
+        concurrent_updates = MAX_CONCURRENT_UPDATES
+    return UserUpdateProcessor(concurrent_updates)
+
+class LoopLagMonitor:
+    def __init__(self, interval, threshold_ms):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.last_beat = time.monotonic()
+        self.reported_beat = None
+        self.loop_thread_id = None
+        self.task = None
+        self.thread = None
+    
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.task = asyncio.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, name='loop-lag-monitor', daemon=True)
+        self.thread.start()
+        logger.info(f"Мониторинг задержек цикла событий включен (порог {self.threshold * 1000:.0f} мс)")
+    
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0, now - self.last_beat - self.interval)
+            self.last_beat = now
+            loop_lag_seconds.observe(lag)
+            if lag >= self.threshold:
+                logger.warning(f"Цикл событий был заблокирован на {lag * 1000:.0f} мс")
+    
+    def watch(self):
+        while True:
+            time.sleep(self.interval)
+            beat = self.last_beat
+            lag = time.monotonic() - beat - self.interval
+            if lag < self.threshold or self.reported_beat == beat:
+                continue
+            
+            self.reported_beat = beat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else "стек недоступен\n"
+            logger.warning(f"Цикл событий заблокирован уже {lag * 1000:.0f} мс, стек:\n{stack}")
+
+async def start_loop_lag_monitor(application):
+    threshold_ms = config.get('loop_lag_threshold_ms', LOOP_LAG_THRESHOLD_MS)
+    if not threshold_ms:
+        return
     
+    monitor = LoopLagMonitor(config.get('loop_lag_interval', LOOP_LAG_INTERVAL), threshold_ms)
+    monitor.start()
+    application.bot_data['loop_lag_monitor'] = monitor
+
+async def post_init(application):
+    await start_transfer_bot(application)
+    delivery_queue.resume()
+    await start_metrics_server(application)
+    await start_loop_lag_monitor(application)
+
+async def post_shutdown(application):
+    await stop_transfer_bot(application)
+
+def plan_download(user_info, file_info):
+    sizes = sorted(file_info.get('photo_sizes') or [], key=lambda size: size['width'] * size['height'])
+    if not sizes:
+        return file_info
+    
+    max_side = photo_delivery_side(user_info)
+    if max_side:
+        for size in sizes:
+            if max(size['width'], size['height']) >= max_side:
+                return size
+    return sizes[-1]
+
+def conversion_progress(user_id, status_msg, idx, total_files):
+    if not status_msg:
+        return None
+    
+    async def report(percent=None, text=None):
+        if text:
+            await show_progress_bar(status_msg, idx, total_files, text)
+        if percent is not None and user_id:
+            await update_progress(user_id, 1, 1, percent, status_msg)
+    return report
+
+async def convert_file(user_info, file_info, idx, total_files, status_msg=None, user_id=None):
+    reservation = None
     try:
-        detected_type = detect_file_type(bytes(file_bytes), original_name)
-        
-        logger.info(f"Определен тип файла: {detected_type} для {original_name}")
-        
-        if conv_type == 'GIF_to_mp4' and detected_type != 'GIF':
-            if detected_type == 'video':
-                raise Exception(f"Файл {original_name} является видеофайлом (MP4), а не GIF.")
+        await show_progress_bar(status_msg, idx-1, total_files, "Загрузка файлов...")
+        
+        download = plan_download(user_info, file_info)
+        with trace_span('get_file', width=download.get('width'), height=download.get('height')):
+            file = await files_bot().get_file(download['file_id'])
+        
+        if file_info.get('archive'):
+            await show_progress_bar(status_msg, idx-1, total_files, "Обработка архива...")
+            return await convert_archive(user_info, file_info, file, status_msg, user_id)
+        
+        input_size = file.file_size or download.get('file_size') or user_info['max_size']
+        if memory_budget.would_wait(user_info['type'], input_size):
+            await show_progress_bar(status_msg, idx-1, total_files, "Ожидание свободной памяти...")
+        reservation = await memory_budget.acquire(user_info['type'], input_size)
+        
+        await show_progress_bar(status_msg, idx-1, total_files, "Скачивание файла...")
+        
+        download_started = time.monotonic()
+        local_path = local_file_path(file)
+        with trace_span('download', local=bool(local_path)) as span:
+            if local_path and user_info['type'] in ['GIF_to_mp4', 'mp4_to_GIF', 'video_to_mp3', 'video_to_wav', 'video_to_flac']:
+                file_bytes = read_file_header(local_path)
+                input_length = os.path.getsize(local_path)
+                logger.info(f"Файл {file_info['file_name']} читается напрямую с диска сервера Bot API: {local_path}")
             else:
-                raise Exception(f"Файл {original_name} не является GIF файлом.")
-        
-        if conv_type == 'mp4_to_GIF' and detected_type not in ['video', 'GIF', 'mp4']:
-            raise Exception(f"Файл {original_name} не является видеофайлом.")
-        
-        if conv_type == 'GIF_to_mp4':
-            input_ext = 'gif'
-        elif conv_type == 'mp4_to_GIF':
-            if detected_type == 'GIF':
-                input_ext = 'gif'
-            else:
-                input_ext = 'mp4'
-        elif conv_type in ['video_to_mp3', 'video_to_wav', 'video_to_flac']:
-            input_ext = 'mp4'
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{input_ext}') as tmp_input:
-            tmp_input.write(bytes(file_bytes))
-            input_path = tmp_input.name
+                file_bytes = await file.download_as_bytearray()
+                input_length = len(file_bytes)
+                local_path = None
+            span['bytes'] = input_length
+        download_seconds.observe(time.monotonic() - download_started, conv_type=user_info['type'])
+        bytes_in_total.inc(input_length, conv_type=user_info['type'])
+        input_bytes.observe(input_length, conv_type=user_info['type'])
+        
+        if input_length > user_info['max_size']:
+            max_mb = user_info['max_size'] // (1024 * 1024)
+            raise Exception(f"Файл слишком большой. Максимум: {max_mb} МБ")
         
-        if user_id and status_msg:
-            await update_progress(user_id, 1, 1, 25, status_msg)
+        await show_progress_bar(status_msg, idx-1, total_files, "Конвертация файла...")
         
-        if conv_type == 'GIF_to_mp4':
-            output_ext = 'mp4'
-            output_path = input_path + '.mp4'
-            
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 35, status_msg)
-            
-            await convert_GIF_to_mp4(input_path, output_path, user_id, status_msg)
-            
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 65, status_msg)
+        convert_started = time.monotonic()
+        os.makedirs(delivery_queue.spool_dir, exist_ok=True)
+        with trace_span('convert'):
+            converted_files = await convert_input(
+                user_info, file_bytes, file_info['file_name'], conversion_progress(user_id, status_msg, idx, total_files), local_path, delivery_queue.spool_dir
+            )
         
-        elif conv_type == 'mp4_to_GIF':
-            output_ext = 'gif'
-            output_path = input_path + '.gif'
-            
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 35, status_msg)
-            
-            if detected_type == 'GIF':
-                logger.info(f"Файл уже является GIF, копируем без конвертации")
-                with open(input_path, 'rb') as f_in:
-                    with open(output_path, 'wb') as f_out:
-                        f_out.write(f_in.read())
-            else:
-                await convert_mp4_to_GIF(input_path, output_path, user_id, status_msg)
-            
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 65, status_msg)
+        convert_seconds.observe(time.monotonic() - convert_started, conv_type=user_info['type'])
         
-        elif conv_type == 'video_to_mp3':
-            output_ext = 'mp3'
-            output_path = input_path + '.mp3'
+        return converted_files
+    finally:
+        if reservation:
+            await memory_budget.release(reservation)
+
+def archive_max_size():
+    return conversion_max_mb('archive', ARCHIVE_MAX_MB) * 1024 * 1024
+
+def archive_part_size():
+    default_mb = config.get('local_max_file_mb', LOCAL_BOT_API_MAX_MB) if local_bot_api_url() else ARCHIVE_PART_MB
+    return config.get('archive_part_mb', default_mb) * 1024 * 1024
+
+async def convert_archive(user_info, file_info, file, status_msg=None, user_id=None):
+    original_name = file_info['file_name']
+    conv_type = user_info['type']
+    base_name = original_name.rsplit('.', 1)[0] if '.' in original_name else original_name
+    
+    os.makedirs(delivery_queue.spool_dir, exist_ok=True)
+    output_dir = tempfile.mkdtemp(prefix='archive_', dir=delivery_queue.spool_dir)
+    writer = ArchiveWriter(output_dir, base_name, archive_part_size())
+    loop = asyncio.get_running_loop()
+    job_dir = None
+    parts = None
+    
+    try:
+        archive_path = local_file_path(file)
+        download_started = time.monotonic()
+        with trace_span('download', local=bool(archive_path), archive=True) as span:
+            if not archive_path:
+                job_dir = scratch_space.create_job_dir(file.file_size or file_info.get('file_size') or 0)
+                archive_path = os.path.join(job_dir, 'input.zip')
+                await file.download_to_drive(archive_path)
+                scratch_space.check_usage(job_dir)
+            archive_size = os.path.getsize(archive_path)
+            span['bytes'] = archive_size
+        download_seconds.observe(time.monotonic() - download_started, conv_type=conv_type)
+        bytes_in_total.inc(archive_size, conv_type=conv_type)
+        
+        if archive_size > archive_max_size():
+            raise Exception(f"Архив слишком большой. Максимум: {archive_max_size() // (1024 * 1024)} МБ")
+        if not zipfile.is_zipfile(archive_path):
+            raise Exception(f"Файл {original_name} не является ZIP-архивом.")
+        
+        with zipfile.ZipFile(archive_path) as archive:
+            members, errors = archive_members(archive, user_info)
+            if not members:
+                raise Exception(f"В архиве {original_name} нет подходящих файлов.")
+            logger.info(f"Архив {original_name}: файлов для конвертации {len(members)}, пропущено {len(errors)}")
             
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 35, status_msg)
+            semaphore = asyncio.Semaphore(config.get('archive_parallel', os.cpu_count() or 2))
+            write_lock = asyncio.Lock()
+            progress = {'done': 0, 'converted': 0}
             
-            await convert_video_to_audio(input_path, output_path, 'mp3', user_id, status_msg)
+            async def convert_member(member):
+                async with semaphore:
+                    reservation = await memory_budget.acquire(conv_type, member.file_size)
+                    try:
+                        with trace_span('archive_member', file_name=member.filename):
+                            member_name = os.path.basename(member.filename)
+                            file_bytes = await loop.run_in_executor(None, read_archive_member, archive, member, user_info['max_size'])
+                            converted = await convert_input(user_info, file_bytes, member_name)
+                            del file_bytes
+                            
+                            folder = os.path.dirname(member.filename)
+                            async with write_lock:
+                                for converted_file in converted:
+                                    entry_name = f"{folder}/{converted_file['filename']}" if folder else converted_file['filename']
+                                    await loop.run_in_executor(None, writer.add, entry_name, converted_file['bytes'])
+                        
+                        progress['converted'] += 1
+                        archive_members_total.inc(conv_type=conv_type, status='ok')
+                    except Exception as e:
+                        errors.append(f"{member.filename}: {e}")
+                        archive_members_total.inc(conv_type=conv_type, status='error')
+                        logger.error(f"Ошибка конвертации {member.filename} из архива {original_name}: {e}")
+                    finally:
+                        await memory_budget.release(reservation)
+                        progress['done'] += 1
+                        if user_id and status_msg:
+                            await update_progress(user_id, progress['done'], len(members), int(progress['done'] * 100 / len(members)), status_msg)
             
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 65, status_msg)
+            await asyncio.gather(*[convert_member(member) for member in members])
         
-        elif conv_type == 'video_to_wav':
-            output_ext = 'wav'
-            output_path = input_path + '.wav'
-            
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 35, status_msg)
-            
-            await convert_video_to_audio(input_path, output_path, 'wav', user_id, status_msg)
-            
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 65, status_msg)
+        if not progress['converted']:
+            raise Exception(f"Не удалось сконвертировать ни одного файла из архива {original_name}. {errors[0] if errors else ''}")
+        if errors:
+            await loop.run_in_executor(None, writer.add, 'errors.txt', '\n'.join(errors).encode('utf-8'))
+        parts = await loop.run_in_executor(None, writer.close)
         
-        elif conv_type == 'video_to_flac':
-            output_ext = 'flac'
-            output_path = input_path + '.flac'
-            
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 35, status_msg)
-            
-            await convert_video_to_audio(input_path, output_path, 'flac', user_id, status_msg)
-            
-            if user_id and status_msg:
-                await update_progress(user_id, 1, 1, 65, status_msg)
+        logger.info(f"Архив {original_name}: сконвертировано {progress['converted']} из {len(members)}, частей результата: {len(parts)}")
+        if status_msg:
+            errors_text = f"\n⚠️ Ошибок: {len(errors)}, список в errors.txt" if errors else ""
+            try:
+                await status_msg.reply_text(f"📦 {original_name}: сконвертировано {progress['converted']} из {len(members)} файлов{errors_text}")
+            except Exception:
+                pass
         
+        return [
+            {
+                'path': part,
+                'filename': os.path.basename(part),
+                'mime_type': 'application/zip',
+                'as_document': True,
+                'archive_part': True
+            }
+            for part in parts
+        ]
+    finally:
+        if job_dir:
+            scratch_space.remove_job_dir(job_dir)
+        if parts is None:
+            writer.close()
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+def prefetch_key(user_info):
+    return (user_info['type'], user_info.get('target_size'), tuple(user_info.get('targets') or []), bool(user_info.get('as_file')))
+
+def start_prefetch(user_id, chat_id, user_info, file_info):
+    if not config.get('eager_conversion', True) or file_info.get('archive'):
+        return
+    
+    idx = len(user_info['files'])
+    trace = JobTrace(user_id, chat_id, user_info['type'], 1, kind='prefetch')
+    task = asyncio.create_task(run_prefetch(trace, user_info, file_info, idx))
+    task.add_done_callback(lambda finished: finished.cancelled() or finished.exception())
+    file_info['prefetch'] = {
+        'task': task,
+        'key': prefetch_key(user_info),
+        'trace_id': trace.trace_id
+    }
+    
+    timer = user_info.get('prefetch_timer')
+    if timer:
+        timer.cancel()
+    user_info['prefetch_timer'] = asyncio.create_task(
+        expire_prefetch(user_id, user_info, config.get('prefetch_timeout', PREFETCH_TIMEOUT))
+    )
+    logger.info(f"Фоновая конвертация файла {idx} пользователя {user_id} запущена (трассировка {trace.trace_id})")
+
+async def run_prefetch(trace, user_info, file_info, idx):
+    current_trace.set(trace)
+    try:
+        converted_files = await convert_file(user_info, file_info, idx, idx)
+        spooling = asyncio.get_running_loop().run_in_executor(None, spool_converted_files, converted_files, delivery_queue.spool_dir)
+        try:
+            return await asyncio.shield(spooling)
+        except asyncio.CancelledError:
+            spooling.add_done_callback(lambda future: future.exception() or remove_converted_files(future.result()))
+            raise
+    except asyncio.CancelledError:
+        trace.status = 'cancelled'
+        raise
+    except Exception:
+        trace.files_failed += 1
+        raise
+    finally:
+        trace.finish()
+
+def claim_prefetch(user_info, file_info):
+    prefetch = file_info.pop('prefetch', None)
+    if not prefetch:
+        return None
+    
+    if prefetch['key'] != prefetch_key(user_info) or prefetch['task'].cancelled():
+        drop_prefetch(prefetch)
+        return None
+    return prefetch
+
+def drop_prefetch(prefetch):
+    task = prefetch['task']
+    if not task.done():
+        task.cancel()
+        return True
+    if not task.cancelled() and not task.exception():
+        remove_converted_files(task.result())
+    return False
+
+def discard_prefetch(user_info):
+    timer = user_info.pop('prefetch_timer', None)
+    if timer and timer is not asyncio.current_task():
+        timer.cancel()
+    
+    cancelled = 0
+    for file_info in user_info['files']:
+        prefetch = file_info.pop('prefetch', None)
+        if prefetch and drop_prefetch(prefetch):
+            cancelled += 1
+    return cancelled
+
+async def expire_prefetch(user_id, user_info, timeout):
+    await asyncio.sleep(timeout)
+    cancelled = discard_prefetch(user_info)
+    logger.info(f"Сессия пользователя {user_id} не завершена за {timeout} сек: фоновая конвертация сброшена (остановлено задач: {cancelled})")
+
+def delivery_method(converted_file):
+    mime_type = converted_file['mime_type']
+    if mime_type.startswith('image/') and not converted_file.get('as_document'):
+        return 'photo'
+    elif mime_type.startswith('audio/'):
+        return 'audio'
+    elif mime_type.startswith('video/'):
+        return 'video'
+    return 'document'
+
+def plan_deliveries(converted_files):
+    batches = []
+    last_group = None
+    for converted_file in converted_files:
+        method = delivery_method(converted_file)
+        group = 'visual' if method in ['photo', 'video'] else method
+        if config.get('send_albums', True) and batches and group == last_group and len(batches[-1]) < MEDIA_GROUP_MAX_ITEMS:
+            batches[-1].append(converted_file)
         else:
-            raise Exception(f"Неизвестный тип конвертации: {conv_type}")
-        
-        if user_id and status_msg:
-            await update_progress(user_id, 1, 1, 80, status_msg)
-        
-        with open(output_path, 'rb') as f:
-            converted_bytes = f.read()
-        
-        if len(converted_bytes) == 0:
-            raise Exception("Результат конвертации пуст")
-        
-        if user_id and status_msg:
-            await update_progress(user_id, 1, 1, 90, status_msg)
-        
-        if '.' in original_name:
-            name_without_ext = original_name.rsplit('.', 1)[0]
+            batches.append([converted_file])
+        last_group = group
+    return batches
+
+def converted_payload(converted_file):
+    if 'bytes' in converted_file:
+        return converted_file['bytes']
+    if 'input_file' in converted_file:
+        return converted_file['input_file']
+    return pathlib.Path(converted_file['path'])
+
+def read_input_file(path, filename):
+    with open(path, 'rb') as f:
+        return InputFile(f, filename=filename, attach=True)
+
+def remove_converted_files(converted_files):
+    for converted_file in converted_files:
+        if 'path' in converted_file:
+            shutil.rmtree(os.path.dirname(converted_file['path']), ignore_errors=True)
+
+def spool_converted_files(converted_files, spool_dir):
+    os.makedirs(spool_dir, exist_ok=True)
+    spooled = []
+    try:
+        for converted_file in converted_files:
+            if 'bytes' in converted_file:
+                result_dir = tempfile.mkdtemp(prefix='result_', dir=spool_dir)
+                path = os.path.join(result_dir, os.path.basename(converted_file['filename']) or 'file')
+                with open(path, 'wb') as f:
+                    f.write(converted_file['bytes'])
+                converted_file = {key: value for key, value in converted_file.items() if key != 'bytes'}
+                converted_file['path'] = path
+            spooled.append(converted_file)
+    except Exception:
+        remove_converted_files(spooled)
+        remove_converted_files(converted_files)
+        raise
+    return spooled
+
+def converted_size(converted_file):
+    if 'bytes' in converted_file:
+        return len(converted_file['bytes'])
+    return os.path.getsize(converted_file['path'])
+
+def converted_input_media(converted_file):
+    method = delivery_method(converted_file)
+    if method == 'photo':
+        return InputMediaPhoto(converted_payload(converted_file), caption=f"✅ {converted_file['filename']}", filename=converted_file['filename'])
+    elif method == 'video':
+        return InputMediaVideo(converted_payload(converted_file), caption=f"✅ {converted_file['filename']}", filename=converted_file['filename'])
+    elif method == 'audio':
+        return InputMediaAudio(converted_payload(converted_file), title=converted_file['filename'], filename=converted_file['filename'])
+    return InputMediaDocument(converted_payload(converted_file), filename=converted_file['filename'])
+
+async def send_converted_file(chat_id, converted_file, conv_type):
+    method = delivery_method(converted_file)
+    file_size = converted_size(converted_file)
+    upload_started = time.monotonic()
+    
+    with trace_span('upload', method=method, file_name=converted_file['filename'], bytes=file_size):
+        if method == 'photo':
+            await files_bot().send_photo(
+                chat_id=chat_id,
+                photo=converted_payload(converted_file),
+                caption=f"✅ {converted_file['filename']}"
+            )
+        elif method == 'audio':
+            await files_bot().send_audio(
+                chat_id=chat_id,
+                audio=converted_payload(converted_file),
+                title=converted_file['filename'],
+                filename=converted_file['filename']
+            )
+        elif method == 'video':
+            await files_bot().send_video(
+                chat_id=chat_id,
+                video=converted_payload(converted_file),
+                caption=f"✅ {converted_file['filename']}"
+            )
         else:
-            name_without_ext = original_name
-        
-        new_filename = f"{name_without_ext}_converted.{output_ext}"
+            await files_bot().send_document(
+                chat_id=chat_id,
+                document=converted_payload(converted_file),
+                filename=converted_file['filename']
+            )
+    
+    upload_seconds.observe(time.monotonic() - upload_started, conv_type=conv_type, method=method)
+    bytes_out_total.inc(file_size, conv_type=conv_type)
+
+async def send_converted_album(chat_id, batch, conv_type):
+    total_bytes = sum(converted_size(converted_file) for converted_file in batch)
+    upload_started = time.monotonic()
+    
+    with trace_span('upload', method='media_group', files=len(batch), bytes=total_bytes):
+        await files_bot().send_media_group(
+            chat_id=chat_id,
+            media=[converted_input_media(converted_file) for converted_file in batch]
+        )
+    
+    upload_seconds.observe(time.monotonic() - upload_started, conv_type=conv_type, method='media_group')
+    bytes_out_total.inc(total_bytes, conv_type=conv_type)
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def reserve(self, cost=1):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= cost
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class DeliveryQueue:
+    def __init__(self):
+        self.spool_dir = config.get('delivery_spool_dir') or os.path.join(tempfile.gettempdir(), 'converter_bot_outbox')
+        self.global_bucket = TokenBucket(
+            config.get('delivery_global_rate', DELIVERY_GLOBAL_RATE),
+            config.get('delivery_global_burst', DELIVERY_GLOBAL_BURST)
+        )
+        self.chat_buckets = {}
+        self.queues = {}
+        self.workers = {}
+    
+    def chat_bucket(self, chat_id):
+        if chat_id not in self.chat_buckets:
+            if chat_id < 0:
+                self.chat_buckets[chat_id] = TokenBucket(
+                    config.get('delivery_group_rate', DELIVERY_GROUP_RATE),
+                    config.get('delivery_group_burst', DELIVERY_GROUP_BURST)
+                )
+            else:
+                self.chat_buckets[chat_id] = TokenBucket(
+                    config.get('delivery_chat_rate', DELIVERY_CHAT_RATE),
+                    config.get('delivery_chat_burst', DELIVERY_CHAT_BURST)
+                )
+        return self.chat_buckets[chat_id]
+    
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+    
+    def spool(self, chat_id, batch, conv_type):
+        delivery_dir = os.path.join(self.spool_dir, f"delivery_{uuid.uuid4().hex}")
+        os.makedirs(delivery_dir)
+        try:
+            items = []
+            for number, converted_file in enumerate(batch):
+                item_dir = os.path.join(delivery_dir, str(number))
+                os.makedirs(item_dir)
+                path = os.path.join(item_dir, os.path.basename(converted_file['filename']) or 'file')
+                if 'bytes' in converted_file:
+                    with open(path, 'wb') as f:
+                        f.write(converted_file['bytes'])
+                else:
+                    shutil.move(converted_file['path'], path)
+                    try:
+                        os.rmdir(os.path.dirname(converted_file['path']))
+                    except OSError:
+                        pass
+                items.append({
+                    'path': path,
+                    'filename': converted_file['filename'],
+                    'mime_type': converted_file['mime_type'],
+                    'as_document': bool(converted_file.get('as_document')),
+                    'delivered': False
+                })
+            
+            delivery = {
+                'dir': delivery_dir,
+                'chat_id': chat_id,
+                'conv_type': conv_type,
+                'created': time.time(),
+                'items': items
+            }
+            self.save_manifest(delivery)
+            return delivery
+        except Exception:
+            shutil.rmtree(delivery_dir, ignore_errors=True)
+            raise
+    
+    async def submit(self, chat_id, batch, conv_type):
+        spooling = asyncio.get_running_loop().run_in_executor(None, self.spool, chat_id, batch, conv_type)
+        try:
+            delivery = await asyncio.shield(spooling)
+        except asyncio.CancelledError:
+            spooling.add_done_callback(lambda future: future.exception() or shutil.rmtree(future.result()['dir'], ignore_errors=True))
+            raise
+        return self.enqueue(delivery, current_trace.get(), current_span_id.get())
+    
+    def enqueue(self, delivery, trace=None, span_id=None):
+        delivery['future'] = asyncio.get_running_loop().create_future()
+        delivery['trace'] = (trace, span_id)
+        chat_id = delivery['chat_id']
+        self.queues.setdefault(chat_id, deque()).append(delivery)
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self.chat_worker(chat_id))
+        return delivery['future']
+    
+    def save_manifest(self, delivery):
+        manifest = {key: value for key, value in delivery.items() if key not in ['future', 'trace']}
+        temp_path = os.path.join(delivery['dir'], 'manifest.json.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, os.path.join(delivery['dir'], 'manifest.json'))
+    
+    def resume(self):
+        resumed = 0
+        for manifest_path in glob.glob(os.path.join(self.spool_dir, 'delivery_*', 'manifest.json')):
+            delivery_dir = os.path.dirname(manifest_path)
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    delivery = json.load(f)
+                if time.time() - delivery['created'] > config.get('delivery_spool_max_age', DELIVERY_SPOOL_MAX_AGE):
+                    raise Exception("устарела")
+                delivery['dir'] = delivery_dir
+                self.enqueue(delivery).add_done_callback(lambda future: future.cancelled() or future.exception())
+                resumed += 1
+            except Exception as e:
+                logger.warning(f"Доставка {delivery_dir} не будет возобновлена: {e}")
+                shutil.rmtree(delivery_dir, ignore_errors=True)
         
-        mime_types = {
-            'mp4': 'video/mp4',
-            'gif': 'image/gif',
-            'mp3': 'audio/mpeg',
-            'wav': 'audio/wav',
-            'flac': 'audio/flac'
-        }
+        for delivery_dir in glob.glob(os.path.join(self.spool_dir, 'delivery_*')):
+            if not os.path.exists(os.path.join(delivery_dir, 'manifest.json')):
+                shutil.rmtree(delivery_dir, ignore_errors=True)
         
-        return {
-            'bytes': converted_bytes,
-            'filename': new_filename,
-            'mime_type': mime_types.get(output_ext, 'application/octet-stream')
-        }
+        for result_dir in glob.glob(os.path.join(self.spool_dir, 'archive_*')) + glob.glob(os.path.join(self.spool_dir, 'result_*')):
+            shutil.rmtree(result_dir, ignore_errors=True)
         
-    except Exception as e:
-        logger.error(f"Ошибка при конвертации видео: {e}")
-        raise
-    finally:
-        if input_path and os.path.exists(input_path):
+        if resumed:
+            logger.info(f"Возобновлено незавершенных доставок: {resumed}")
+    
+    async def chat_worker(self, chat_id):
+        queue = self.queues[chat_id]
+        try:
+            while queue:
+                delivery = queue[0]
+                trace_token = current_trace.set(delivery['trace'][0])
+                span_token = current_span_id.set(delivery['trace'][1])
+                try:
+                    if delivery['future'].cancelled():
+                        deliveries_total.inc(status='cancelled')
+                    else:
+                        delivered = await self.deliver(delivery)
+                        deliveries_total.inc(status='ok')
+                        if not delivery['future'].done():
+                            delivery['future'].set_result(delivered)
+                except Exception as e:
+                    deliveries_total.inc(status='failed')
+                    logger.error(f"Не удалось доставить результат в чат {chat_id}: {e}")
+                    if not delivery['future'].done():
+                        delivery['future'].set_exception(e)
+                finally:
+                    current_trace.reset(trace_token)
+                    current_span_id.reset(span_token)
+                    queue.popleft()
+                    shutil.rmtree(delivery['dir'], ignore_errors=True)
+        finally:
+            del self.queues[chat_id]
+            del self.workers[chat_id]
+    
+    async def wait_for_slot(self, chat_id, cost):
+        delay = max(self.global_bucket.reserve(cost), self.chat_bucket(chat_id).reserve(cost))
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    async def deliver(self, delivery):
+        pending = [item for item in delivery['items'] if not item['delivered']]
+        if len(pending) > 1:
             try:
-                os.unlink(input_path)
-            except:
-                pass
-        if output_path and os.path.exists(output_path):
+                await self.send_with_retries(delivery, pending)
+                return len(delivery['items'])
+            except Exception as e:
+                if delivery['future'].cancelled():
+                    raise
+                logger.error(f"Ошибка отправки альбома, отправляю файлы по одному: {e}")
+        
+        errors = []
+        for item in pending:
+            if item['delivered']:
+                continue
             try:
-                os.unlink(output_path)
-            except:
-                pass
+                await self.send_with_retries(delivery, [item])
+            except Exception as e:
+                errors.append(e)
+        
+        if errors and len(errors) == len(pending):
+            raise errors[0]
+        for e in errors:
+            logger.error(f"Файл не доставлен в чат {delivery['chat_id']}: {e}")
+        return sum(1 for item in delivery['items'] if item['delivered'])
+    
+    async def send_with_retries(self, delivery, items):
+        loop = asyncio.get_running_loop()
+        batch = []
+        for item in items:
+            if local_bot_api_url():
+                batch.append(dict(item))
+            else:
+                batch.append(dict(item, input_file=await loop.run_in_executor(None, read_input_file, item['path'], item['filename'])))
+        
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.wait_for_slot(delivery['chat_id'], len(items))
+            try:
+                if len(batch) > 1:
+                    await send_converted_album(delivery['chat_id'], batch, delivery['conv_type'])
+                else:
+                    await send_converted_file(delivery['chat_id'], batch[0], delivery['conv_type'])
+                break
+            except BadRequest:
+                raise
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                delay = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+                delivery_retries_total.inc(reason='retry_after')
+            except TimedOut as e:
+                if isinstance(e.__cause__, httpx.ReadTimeout):
+                    logger.warning(f"Telegram не ответил на отправку в чат {delivery['chat_id']} вовремя, файл мог быть уже доставлен - повторно не отправляю")
+                    break
+                delay = min(config.get('delivery_backoff_max', DELIVERY_BACKOFF_MAX), config.get('delivery_backoff_base', DELIVERY_BACKOFF_BASE) * 2 ** (attempt - 1))
+                delivery_retries_total.inc(reason='timeout')
+            except NetworkError:
+                delay = min(config.get('delivery_backoff_max', DELIVERY_BACKOFF_MAX), config.get('delivery_backoff_base', DELIVERY_BACKOFF_BASE) * 2 ** (attempt - 1))
+                delivery_retries_total.inc(reason='network')
+            
+            if attempt >= config.get('delivery_max_attempts', DELIVERY_MAX_ATTEMPTS):
+                raise Exception(f"Не удалось отправить файл после {attempt} попыток")
+            logger.warning(f"Повтор отправки в чат {delivery['chat_id']} через {delay:.1f} сек (попытка {attempt})")
+            await asyncio.sleep(delay)
+        
+        for item in items:
+            item['delivered'] = True
+        await loop.run_in_executor(None, self.save_manifest, delivery)
+
+delivery_queue = DeliveryQueue()
+
+Gauge('converter_delivery_queue_depth', 'Результаты, ожидающие отправки', callback=lambda: delivery_queue.pending())
+Gauge('converter_delivery_active_chats', 'Чаты с идущей доставкой', callback=lambda: len(delivery_queue.workers))
 
 async def process_conversion(user_info, user_id, chat_id, message_id):
     total_files = len(user_info['files'])
@@ -1023,218 +1779,198 @@ async def process_conversion(user_info, user_id, chat_id, message_id):
     
     status_msg = await application.bot.send_message(
         chat_id=chat_id,
-        text="🔄 Начинаю обработку файлов..."
+        text="🔄 Начинаю обработку файлов...",
+        reply_markup=cancel_job_markup()
     )
     
+    progress_state = {
+        'progress': 0,
+        'current_file': 1,
+        'total_files': total_files
+    }
     async with processing_files_lock:
-        processing_files[user_id] = {
-            'progress': 0,
-            'current_file': 1,
-            'total_files': total_files
-        }
+        processing_files[user_id] = progress_state
+    
+    trace = JobTrace(user_id, chat_id, user_info['type'], total_files)
+    trace_token = current_trace.set(trace)
+    timer = user_info.pop('prefetch_timer', None)
+    if timer:
+        timer.cancel()
+    logger.info(f"Задача {trace.trace_id}: пользователь {user_id}, {user_info['type']}, файлов: {total_files}")
     
+    converted_files = []
     try:
-        converted_files = []
-        
         for idx, file_info in enumerate(user_info['files'], 1):
+            original_name = file_info['file_name']
             try:
-                await show_progress_bar(status_msg, idx-1, total_files, "Загрузка файлов...")
-                
-                file = await application.bot.get_file(file_info['file_id'])
-                
-                await show_progress_bar(status_msg, idx-1, total_files, "Скачивание файла...")
-                
-                file_bytes = await file.download_as_bytearray()
-                
-                if len(file_bytes) > user_info['max_size']:
-                    max_mb = user_info['max_size'] // (1024 * 1024)
-                    raise Exception(f"Файл слишком большой. Максимум: {max_mb} МБ")
-                
-                await show_progress_bar(status_msg, idx-1, total_files, "Конвертация файла...")
-                
-                source_ext = user_info['source']
-                target_ext = user_info['target']
-                conv_type = user_info['type']
-                
-                original_name = file_info['file_name']
-                
-                detected_type = detect_file_type(bytes(file_bytes), original_name)
-                logger.info(f"Файл {original_name}: ожидаемый тип {source_ext}, определен как {detected_type}")
-                
-                if source_ext in ['jpg', 'jpeg', 'png', 'webp', 'GIF']:
-                    if source_ext == 'GIF' and detected_type != 'GIF':
-                        raise Exception(f"Файл {original_name} не является GIF.")
-                    elif source_ext == 'jpg' and detected_type not in ['jpg', 'jpeg']:
-                        raise Exception(f"Файл {original_name} не является JPG/JPEG.")
-                    elif source_ext == 'png' and detected_type != 'png':
-                        raise Exception(f"Файл {original_name} не является PNG.")
-                    elif source_ext == 'webp' and detected_type != 'webp':
-                        raise Exception(f"Файл {original_name} не является WebP.")
-                    
-                    converted_bytes = await convert_image(bytes(file_bytes), source_ext, target_ext)
-                    
-                    if '.' in original_name:
-                        name_without_ext = original_name.rsplit('.', 1)[0]
+                with trace_span('file', index=idx, file_name=original_name):
+                    prefetch = claim_prefetch(user_info, file_info)
+                    if prefetch:
+                        if not prefetch['task'].done():
+                            await show_progress_bar(status_msg, idx-1, total_files, "Завершение фоновой конвертации...")
+                        with trace_span('prefetch_wait', prefetch_trace_id=prefetch['trace_id']):
+                            converted_data = await prefetch['task']
                     else:
-                        name_without_ext = original_name
-                    
-                    new_filename = f"{name_without_ext}_converted.{target_ext}"
-                    
-                    mime_types = {
-                        'jpg': 'image/jpeg',
-                        'png': 'image/png',
-                        'webp': 'image/webp',
-                        'GIF': 'image/gif'
-                    }
+                        converted_data = await convert_file(user_info, file_info, idx, total_files, status_msg, user_id)
+                    converted_files.extend(converted_data)
+                    files_total.inc(conv_type=user_info['type'], status='ok')
                     
-                    converted_files.append({
-                        'bytes': converted_bytes,
-                        'filename': new_filename,
-                        'mime_type': mime_types.get(target_ext, f'image/{target_ext}')
-                    })
-                
-                elif conv_type == 'txt_to_docx':
-                    if detected_type != 'txt':
-                        raise Exception(f"Файл {original_name} не является текстовым файлом.")
-                    
-                    txt_content = bytes(file_bytes).decode('utf-8', errors='ignore')
-                    converted_bytes = await convert_txt_to_docx(txt_content)
-                    
-                    new_filename = f"{original_name.rsplit('.', 1)[0]}_converted.docx"
-                    
-                    converted_files.append({
-                        'bytes': converted_bytes,
-                        'filename': new_filename,
-                        'mime_type': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-                    })
-                
-                elif conv_type == 'docx_to_txt':
-                    if detected_type not in ['docx', 'doc']:
-                        raise Exception(f"Файл {original_name} не является Word документом.")
-                    
-                    converted_bytes = await convert_docx_to_txt(bytes(file_bytes))
-                    
-                    new_filename = f"{original_name.rsplit('.', 1)[0]}_converted.txt"
-                    
-                    converted_files.append({
-                        'bytes': converted_bytes,
-                        'filename': new_filename,
-                        'mime_type': 'text/plain'
-                    })
-                
-                elif conv_type == 'html_to_txt':
-                    if detected_type not in ['html', 'htm']:
-                        raise Exception(f"Файл {original_name} не является HTML файлом.")
-                    
-                    converted_bytes = await convert_html_to_txt(bytes(file_bytes))
-                    
-                    new_filename = f"{original_name.rsplit('.', 1)[0]}_converted.txt"
-                    
-                    converted_files.append({
-                        'bytes': converted_bytes,
-                        'filename': new_filename,
-                        'mime_type': 'text/plain'
-                    })
-                
-                elif conv_type == 'html_to_docx':
-                    if detected_type not in ['html', 'htm']:
-                        raise Exception(f"Файл {original_name} не является HTML файлом.")
-                    
-                    converted_bytes = await convert_html_to_docx(bytes(file_bytes))
-                    
-                    new_filename = f"{original_name.rsplit('.', 1)[0]}_converted.docx"
-                    
-                    converted_files.append({
-                        'bytes': converted_bytes,
-                        'filename': new_filename,
-                        'mime_type': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-                    })
-                
-                elif conv_type in ['GIF_to_mp4', 'mp4_to_GIF', 'video_to_mp3', 'video_to_wav', 'video_to_flac']:
-                    await show_progress_bar(status_msg, idx, total_files, "Конвертация видео...")
-                    
-                    converted_data = await process_video_conversion(
-                        bytes(file_bytes), 
-                        conv_type, 
-                        original_name, 
-                        user_id, 
-                        status_msg
-                    )
-                    converted_files.append(converted_data)
-                
-                await show_progress_bar(status_msg, idx, total_files, "Файл обработан")
+                    await show_progress_bar(status_msg, idx, total_files, "Файл обработан")
                 
             except Exception as e:
+                files_total.inc(conv_type=user_info['type'], status='error')
+                trace.files_failed += 1
                 logger.error(f"Ошибка обработки файла {idx}: {e}")
                 try:
                     await status_msg.reply_text(f"❌ Ошибка при обработке файла {idx} ({original_name}): {str(e)[:100]}")
-                except:
+                except Exception:
                     pass
         
         if converted_files:
             success_count = 0
-            for converted_file in converted_files:
+            targets = user_info.get('targets') or [user_info['target']]
+            archive_files = sum(1 for file_info in user_info['files'] if file_info.get('archive'))
+            archive_parts = sum(1 for converted_file in converted_files if converted_file.get('archive_part'))
+            expected_count = (total_files - archive_files) * len(targets) + max(archive_parts, archive_files)
+            deliveries = []
+            for batch in plan_deliveries(converted_files):
                 try:
-                    mime_type = converted_file['mime_type']
-                    
-                    if mime_type.startswith('image/'):
-                        await application.bot.send_photo(
-                            chat_id=chat_id,
-                            photo=converted_file['bytes'],
-                            caption=f"✅ {converted_file['filename']}"
-                        )
-                    elif mime_type.startswith('audio/'):
-                        await application.bot.send_audio(
-                            chat_id=chat_id,
-                            audio=converted_file['bytes'],
-                            title=converted_file['filename'],
-                            filename=converted_file['filename']
-                        )
-                    elif mime_type.startswith('video/'):
-                        await application.bot.send_video(
-                            chat_id=chat_id,
-                            video=converted_file['bytes'],
-                            caption=f"✅ {converted_file['filename']}"
-                        )
-                    else:
-                        await application.bot.send_document(
-                            chat_id=chat_id,
-                            document=converted_file['bytes'],
-                            filename=converted_file['filename']
-                        )
-                    
-                    success_count += 1
-                    
+                    deliveries.append(await delivery_queue.submit(chat_id, batch, user_info['type']))
                 except Exception as e:
-                    logger.error(f"Ошибка отправки файла: {e}")
+                    logger.error(f"Ошибка постановки файла в очередь отправки: {e}")
+                    remove_converted_files(batch)
+            converted_files.clear()
+            
+            for result in await asyncio.gather(*deliveries, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.error(f"Ошибка отправки файла: {result}")
                     try:
-                        await status_msg.reply_text(f"❌ Не удалось отправить файл: {str(e)[:100]}")
-                    except:
+                        await status_msg.reply_text(f"❌ Не удалось отправить файл: {str(result)[:100]}")
+                    except Exception:
                         pass
+                else:
+                    success_count += result
             
             await status_msg.edit_text(
-                f"✅ Конвертация завершена!\n📊 Успешно обработано: {success_count}/{total_files} файлов\n📁 Формат: {user_info['source'].upper()} → {user_info['target'].upper()}"
+                f"✅ Конвертация завершена!\n📊 Успешно обработано: {success_count}/{expected_count} файлов\n📁 Формат: {user_info['source'].upper()} → {' + '.join(target.upper() for target in targets)}"
             )
             
             await show_main_menu_after_conversion(chat_id)
         else:
             await status_msg.edit_text("❌ Не удалось обработать файлы.")
         
+    except asyncio.CancelledError:
+        files_total.inc(conv_type=user_info['type'], status='cancelled')
+        trace.status = 'cancelled'
+        try:
+            await status_msg.edit_text("⛔ Конвертация отменена.")
+        except Exception:
+            pass
+        raise
+    
     except Exception as e:
+        trace.status = 'error'
         logger.error(f"Ошибка при обработке файлов: {e}")
         try:
             await status_msg.edit_text(f"❌ Ошибка: {str(e)[:150]}")
-        except:
+        except Exception:
             pass
     
     finally:
+        remove_converted_files(converted_files)
+        discard_prefetch(user_info)
+        current_trace.reset(trace_token)
+        trace.finish()
         async with processing_files_lock:
-            if user_id in processing_files:
+            if processing_files.get(user_id) is progress_state:
                 del processing_files[user_id]
         async with user_data_lock:
-            if user_id in user_data:
+            if user_data.get(user_id) is user_info:
                 del user_data[user_id]
 
+async def queue_media_group_item(update, user_id, user_info, file_info=None, error=None):
+    key = (user_id, update.message.media_group_id)
+    async with media_groups_lock:
+        group = media_groups.get(key)
+        if group is None:
+            group = {
+                'user_info': user_info,
+                'message': update.message,
+                'files': [],
+                'errors': [],
+                'timer': None
+            }
+            media_groups[key] = group
+        
+        if file_info:
+            group['files'].append(file_info)
+        if error:
+            group['errors'].append(error)
+        if update.message.message_id < group['message'].message_id:
+            group['message'] = update.message
+        
+        if group['timer']:
+            group['timer'].cancel()
+        group['timer'] = asyncio.create_task(flush_media_group(key, config.get('media_group_debounce', MEDIA_GROUP_DEBOUNCE)))
+
+async def reject_file(update, user_id, user_info, text):
+    if update.message.media_group_id:
+        await queue_media_group_item(update, user_id, user_info, error=text)
+    else:
+        await update.message.reply_text(text)
+
+async def flush_media_group(key, delay):
+    await asyncio.sleep(delay)
+    async with media_groups_lock:
+        group = media_groups.get(key)
+        if not group or group['timer'] is not asyncio.current_task():
+            return
+        del media_groups[key]
+    
+    user_id = key[0]
+    user_info = group['user_info']
+    message = group['message']
+    accepted = 0
+    async with user_data_lock:
+        if user_data.get(user_id) is not user_info:
+            return
+        
+        files = sorted(group['files'], key=lambda file_info: file_info['message_id'])
+        for file_info in files:
+            if len(user_info['files']) >= user_info['max_files']:
+                break
+            if not file_info['file_name']:
+                file_info['file_name'] = f"photo_{len(user_info['files']) + 1}.jpg"
+            user_info['files'].append(file_info)
+            start_prefetch(user_id, message.chat_id, user_info, file_info)
+            accepted += 1
+        
+        loaded = len(user_info['files'])
+        remaining = user_info['max_files'] - loaded
+    
+    lines = [f"✅ Альбом добавлен: {accepted} из {len(files)} файлов", f"📦 Загружено: {loaded}/{user_info['max_files']}"]
+    if accepted < len(files):
+        lines.append(f"⚠️ Не поместилось: {len(files) - accepted} (максимум {user_info['max_files']})")
+    for error in group['errors'][:5]:
+        lines.append(error)
+    if remaining > 0:
+        lines.append(f"📝 Осталось мест: {remaining}\n\nОтправьте ещё файлы или нажмите кнопку для начала конвертации.")
+    elif accepted:
+        lines.append("\n📊 Все файлы получены! Начинаем конвертацию...")
+    
+    keyboard = [
+        [InlineKeyboardButton("🚀 Начать конвертацию", callback_data='start_conversion')],
+        [InlineKeyboardButton("❌ Отменить", callback_data='back_to_category')]
+    ] if remaining > 0 else []
+    
+    try:
+        await message.reply_text('\n'.join(lines), reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None)
+    except Exception as e:
+        logger.error(f"Не удалось ответить на альбом: {e}")
+    
+    if remaining == 0 and accepted:
+        await run_conversion_job(user_info, user_id, message.chat_id, message.message_id)
+
 async def handle_documents(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
@@ -1253,7 +1989,7 @@ async def handle_documents(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         user_info = user_data[user_id]
     
-    if len(user_info['files']) >= user_info['max_files']:
+    if len(user_info['files']) >= user_info['max_files'] and not update.message.media_group_id:
         await update.message.reply_text(
             f"❌ Достигнут максимум {user_info['max_files']} файлов.\nОтправьте /convert для начала конвертации."
         )
@@ -1261,35 +1997,27 @@ async def handle_documents(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if update.message.document:
         document = update.message.document
-        
-        if document.file_size and document.file_size > user_info['max_size']:
-            max_mb = user_info['max_size'] // (1024 * 1024)
-            await update.message.reply_text(f"❌ Файл слишком большой. Максимум: {max_mb} МБ.")
-            return
-        
         file_name = document.file_name.lower() if document.file_name else "document"
         source_ext = user_info['source']
+        is_archive = file_name.endswith('.zip') and config.get('archive_batch', True)
+        max_size = archive_max_size() if is_archive else user_info['max_size']
         
-        allowed_extensions = {
-            'jpg': ['.jpg', '.jpeg', '.jpe', '.jfif'],
-            'png': ['.png'],
-            'webp': ['.webp'],
-            'GIF': ['.gif', '.gifv'],
-            'txt': ['.txt', '.text'],
-            'docx': ['.docx', '.doc'],
-            'html': ['.html', '.htm', '.xhtml'],
-            'video': ['.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv', '.mpg', '.mpeg', '.3gp']
-        }
+        if document.file_size and document.file_size > max_size:
+            max_mb = max_size // (1024 * 1024)
+            await reject_file(update, user_id, user_info, f"❌ Файл слишком большой. Максимум: {max_mb} МБ.")
+            return
         
-        if source_ext in allowed_extensions:
-            if not any(file_name.endswith(ext) for ext in allowed_extensions[source_ext]):
+        if source_ext in SOURCE_EXTENSIONS and not is_archive:
+            if not any(file_name.endswith(ext) for ext in SOURCE_EXTENSIONS[source_ext]):
                 if source_ext == 'video':
-                    await update.message.reply_text(
-                        f"❌ Ожидается видеофайл. Поддерживаемые форматы: {', '.join(allowed_extensions[source_ext])}"
+                    await reject_file(
+                        update, user_id, user_info,
+                        f"❌ Ожидается видеофайл. Поддерживаемые форматы: {', '.join(SOURCE_EXTENSIONS[source_ext])}"
                     )
                 else:
-                    await update.message.reply_text(
-                        f"❌ Неверный формат. Ожидается: {', '.join(allowed_extensions[source_ext])}"
+                    await reject_file(
+                        update, user_id, user_info,
+                        f"❌ Неверный формат. Ожидается: {', '.join(SOURCE_EXTENSIONS[source_ext])}"
                     )
                 return
         
@@ -1298,11 +2026,17 @@ async def handle_documents(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'file_name': document.file_name or f"file_{len(user_info['files']) + 1}.{source_ext}",
             'file_size': document.file_size,
             'mime_type': document.mime_type,
-            'message_id': update.message.message_id
+            'message_id': update.message.message_id,
+            'archive': is_archive
         }
         
+        if update.message.media_group_id:
+            await queue_media_group_item(update, user_id, user_info, file_info)
+            return
+        
         async with user_data_lock:
             user_info['files'].append(file_info)
+            start_prefetch(user_id, update.message.chat_id, user_info, file_info)
         
         remaining = user_info['max_files'] - len(user_info['files'])
         
@@ -1324,6 +2058,9 @@ async def handle_documents(update: Update, context: ContextTypes.DEFAULT_TYPE):
             message,
             reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
         )
+        
+        if remaining == 0:
+            await start_conversion(update, user_info, user_id)
 
 async def handle_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -1343,7 +2080,7 @@ async def handle_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         user_info = user_data[user_id]
     
-    if len(user_info['files']) >= user_info['max_files']:
+    if len(user_info['files']) >= user_info['max_files'] and not update.message.media_group_id:
         await update.message.reply_text(
             f"❌ Достигнут максимум {user_info['max_files']} файлов.\nОтправьте /convert для начала конвертации."
         )
@@ -1354,19 +2091,28 @@ async def handle_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if photo.file_size and photo.file_size > user_info['max_size']:
             max_mb = user_info['max_size'] // (1024 * 1024)
-            await update.message.reply_text(f"❌ Фото слишком большое. Максимум: {max_mb} МБ.")
+            await reject_file(update, user_id, user_info, f"❌ Фото слишком большое. Максимум: {max_mb} МБ.")
             return
         
         file_info = {
             'file_id': photo.file_id,
-            'file_name': f"photo_{len(user_info['files']) + 1}.jpg",
+            'file_name': None if update.message.media_group_id else f"photo_{len(user_info['files']) + 1}.jpg",
             'file_size': photo.file_size,
             'mime_type': 'image/jpeg',
-            'message_id': update.message.message_id
+            'message_id': update.message.message_id,
+            'photo_sizes': [
+                {'file_id': size.file_id, 'width': size.width, 'height': size.height, 'file_size': size.file_size}
+                for size in update.message.photo
+            ]
         }
         
+        if update.message.media_group_id:
+            await queue_media_group_item(update, user_id, user_info, file_info)
+            return
+        
         async with user_data_lock:
             user_info['files'].append(file_info)
+            start_prefetch(user_id, update.message.chat_id, user_info, file_info)
         
         remaining = user_info['max_files'] - len(user_info['files'])
         
@@ -1388,6 +2134,9 @@ async def handle_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
             message,
             reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
         )
+        
+        if remaining == 0:
+            await start_conversion(update, user_info, user_id)
 
 async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -1414,14 +2163,6 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.video:
         video = update.message.video
         
-        if user_info['type'] == 'mp4_to_GIF' and video.duration and video.duration > 30:
-            await update.message.reply_text(
-                "❌ Видео слишком длинное для конвертации в GIF.\n"
-                "Максимальная длительность: 30 секунд.\n"
-                f"Текущая длительность: {video.duration} секунд."
-            )
-            return
-        
         if video.file_size and video.file_size > user_info['max_size']:
             max_mb = user_info['max_size'] // (1024 * 1024)
             await update.message.reply_text(f"❌ Видео слишком большое. Максимум: {max_mb} МБ.")
@@ -1437,14 +2178,21 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         async with user_data_lock:
             user_info['files'].append(file_info)
+            start_prefetch(user_id, update.message.chat_id, user_info, file_info)
         
         duration_text = f"{video.duration} сек" if video.duration else "неизвестно"
         size_text = f"{video.file_size // (1024*1024)} МБ" if video.file_size else "неизвестно"
         
+        max_duration = config.get('gif_max_duration', GIF_MAX_DURATION)
+        trim_text = ""
+        if user_info['type'] == 'mp4_to_GIF' and video.duration and video.duration > max_duration:
+            trim_text = f"✂️ GIF будет создан из первых {max_duration} секунд видео.\n\n"
+        
         message = (
             f"✅ Видео добавлено!\n"
             f"📹 Размер: {size_text}\n"
             f"⏱️ Длительность: {duration_text}\n\n"
+            f"{trim_text}"
             f"Отправьте /convert для начала конвертации."
         )
         
@@ -1477,24 +2225,45 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif text in ['меню', 'menu', 'начать сначала']:
         await start(update, context)
 
-def main():
-    global application
-    
-    
-    TOKEN = ""
-    
-    application = Application.builder().token(TOKEN).build()
+def build_application(token):
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(build_request('api'))
+        .get_updates_request(build_request('updates'))
+        .concurrent_updates(update_processor())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    api_options = bot_api_options()
+    if api_options:
+        builder = builder.base_url(api_options['base_url']).base_file_url(api_options['base_file_url']).local_mode(True)
+        logger.info(f"Используется локальный сервер Bot API: {local_bot_api_url()}")
+    application = builder.build()
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("convert", convert_command))
     application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("memsnap", memsnap_command))
     application.add_handler(CallbackQueryHandler(button_handler))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photos))
     application.add_handler(MessageHandler(filters.Document.ALL, handle_documents))
     application.add_handler(MessageHandler(filters.VIDEO, handle_video))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    return application
+
+def main():
+    global application
+    
+    
+    TOKEN = ""
+    
+    application = build_application(TOKEN)
+    scratch_space.sweep()
+    setup_trace_logs()
     logger.info("___Бот запущен___")
     application.run_polling(allowed_updates=Update.ALL_TYPES, close_loop=False)
-        
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()